@@ -0,0 +1,96 @@
+"""Microbenchmark: decoding of cdx lines and reading of gzipped cdx files.
+
+Compares the former line decoding (split the line at every space, join
+the JSON parts again) and line-by-line reading from gzip.GzipFile with
+CdxParser.split_line and CdxParser.read_lines.
+
+Usage:
+  python3 benchmark/cdx_parser.py [cdx-00000.gz]
+
+Without argument a sample of synthetic cdx lines is used.
+"""
+
+import gzip
+import io
+import json
+import sys
+import time
+
+import ujson
+
+from crawlstats import CdxParser, SurtDomainCount
+
+
+def sample_cdx_lines(n=200000):
+    lines = []
+    for i in range(n):
+        host = 'www.example{}.com'.format(i // 50)
+        surt = 'com,example{})/page/{}'.format(i // 50, i % 50)
+        url = 'https://{}/page/{}?q=a b'.format(host, i % 50)
+        metadata = {'url': url, 'mime': 'text/html',
+                    'mime-detected': 'text/html', 'status': '200',
+                    'digest': 'SHA1{:032X}'.format(i), 'length': '12345',
+                    'offset': str(i * 12345),
+                    'filename': 'crawl-data/CC-MAIN-2024-10/segments/'
+                    '1707947473347.0/warc/CC-MAIN-20240220211055-'
+                    '20240221001055-00000.warc.gz',
+                    'charset': 'UTF-8', 'languages': 'eng'}
+        lines.append('{} 20240220211055 {}'.format(surt, json.dumps(metadata)))
+    return lines
+
+
+def split_join(line):
+    """Former decoding of cdx lines in CCStatsJob.count_mapper"""
+    parts = line.split(' ')
+    [surt_domain, path] = parts[0].split(')', 1)
+    return surt_domain, path, ' '.join(parts[2:])
+
+
+def measure(name, func, n):
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    print('{:<40} {:>12,.0f} lines/s'.format(name, n / elapsed))
+
+
+def decode(split, lines):
+    for line in lines:
+        _, _, json_string = split(line)
+        ujson.loads(json_string)
+
+
+def decode_and_count(lines):
+    count = SurtDomainCount('')
+    for line in lines:
+        _, path, json_string = CdxParser.split_line(line)
+        count.add(path, ujson.loads(json_string))
+
+
+def read_gzip_file(data):
+    for _ in gzip.GzipFile(fileobj=io.BytesIO(data)):
+        pass
+
+
+def read_blocks(data):
+    for _ in CdxParser.read_lines(io.BytesIO(data)):
+        pass
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'rb') as f:
+            data = f.read()
+        lines = [line.decode('utf-8')
+                 for line in CdxParser.read_lines(io.BytesIO(data))]
+    else:
+        lines = sample_cdx_lines()
+        data = gzip.compress('\n'.join(lines).encode('utf-8'))
+    n = len(lines)
+    print('{} cdx lines'.format(n))
+    measure('split/join + ujson.loads', lambda: decode(split_join, lines), n)
+    measure('CdxParser.split_line + ujson.loads',
+            lambda: decode(CdxParser.split_line, lines), n)
+    measure('CdxParser.split_line + SurtDomainCount.add',
+            lambda: decode_and_count(lines), n)
+    measure('gzip.GzipFile readline', lambda: read_gzip_file(data), n)
+    measure('CdxParser.read_lines', lambda: read_blocks(data), n)
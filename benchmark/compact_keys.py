@@ -0,0 +1,79 @@
+"""Benchmark: size of the map output (shuffled data) of the count job for
+one cdx file, JSON keys vs. compact keys (--compact-keys).
+
+Sizes are given uncompressed and compressed by zlib (level 1, similar to
+the fast codecs used to compress map output).
+
+Usage:
+  python3 benchmark/compact_keys.py [--exact-counts] [cdx-00000.gz]
+
+Without cdx file a sample of synthetic cdx lines is used.
+"""
+
+import gzip
+import json
+import os
+import sys
+import tempfile
+import zlib
+
+from crawlstats import CdxParser
+from crawlstats_local import LocalCCStatsJob
+
+
+def sample_cdx_file(path, n=200000):
+    with gzip.open(path, 'wt', encoding='utf-8') as cdx:
+        for i in range(n):
+            domain = 'example{:06d}'.format(i // 40)
+            host = ('www.' if i % 3 else 'blog.') + domain + '.com'
+            surt = 'com,{})/page/{}'.format(domain, i % 40)
+            metadata = {'url': 'https://{}/page/{}'.format(host, i % 40),
+                        'mime': 'text/html', 'mime-detected': 'text/html',
+                        'status': '200', 'digest': 'SHA1{:032X}'.format(i),
+                        'length': '12345', 'offset': str(i * 12345),
+                        'filename': 'crawl-data/CC-MAIN-2024-10/segments/'
+                        '1707947473347.0/warc/CC-MAIN-20240220211055-'
+                        '20240221001055-00000.warc.gz',
+                        'charset': 'UTF-8', 'languages': 'eng'}
+            cdx.write('{} 20240220211055 {}\n'.format(
+                surt, json.dumps(metadata)))
+
+
+def map_output(job_args, cdx_path):
+    job = LocalCCStatsJob(['--job=count'] + job_args)
+    _, write_line = job.pick_protocols(0, 'mapper')
+    os.environ['mapreduce_map_input_file'] = cdx_path
+    job.count_mapper_init()
+    lines = []
+    with open(cdx_path, 'rb') as cdx:
+        for line in CdxParser.read_lines(cdx):
+            for pair in job.count_mapper(None, line.decode('utf-8')):
+                lines.append(write_line(*pair) + b'\n')
+    for pair in job.count_mapper_final():
+        lines.append(write_line(*pair) + b'\n')
+    return b''.join(sorted(lines))
+
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if arg.startswith('--')]
+    paths = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    if not args:
+        args = ['--no-exact-counts']
+    if paths:
+        cdx_path = paths[0]
+    else:
+        tmp_dir = tempfile.mkdtemp()
+        cdx_path = os.path.join(tmp_dir, 'CC-MAIN-2024-10-cdx-00000.gz')
+        sample_cdx_file(cdx_path)
+    sizes = {}
+    for name, key_args in (('JSON keys', []),
+                           ('compact keys', ['--compact-keys'])):
+        output = map_output(args + key_args, cdx_path)
+        sizes[name] = (output.count(b'\n'), len(output),
+                       len(zlib.compress(output, 1)))
+        print('{:<15} {:>10,} records {:>14,} bytes {:>14,} bytes'
+              ' compressed'.format(name, *sizes[name]))
+    print('{:<15} {:>36.1%} {:>14.1%}'.format(
+        'reduction',
+        1 - sizes['compact keys'][1] / sizes['JSON keys'][1],
+        1 - sizes['compact keys'][2] / sizes['JSON keys'][2]))
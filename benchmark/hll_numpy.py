@@ -0,0 +1,66 @@
+"""Microbenchmark: HyperLogLog (registers in a list) vs. NumpyHyperLogLog.
+
+Measures adding items (one by one and in batches), merging 100 counters
+and the cardinality estimation.
+
+Usage:
+  python3 benchmark/hll_numpy.py [number_of_items]
+"""
+
+import sys
+import time
+
+from crawlhll import NumpyHyperLogLog
+from crawlstats import CrawlStatsJSONDecoder, CrawlStatsJSONEncoder
+from hyperloglog import HyperLogLog
+
+
+def timed(name, func, repeat=1):
+    start = time.time()
+    for _ in range(repeat):
+        res = func()
+    print('{:<40} {:>10.4f} sec'.format(name, (time.time() - start) / repeat))
+    return res
+
+
+def add_one_by_one(hll, items):
+    for item in items:
+        hll.add(item)
+    return hll
+
+
+def merge(cls, hlls):
+    hll = cls(.01)
+    hll.update(*hlls)
+    return hll
+
+
+def main(n):
+    items = ['https://www.example.com/page/{}'.format(i) for i in range(n)]
+    print('Adding {} items'.format(n))
+    hll = timed('HyperLogLog.add',
+                lambda: add_one_by_one(HyperLogLog(.01), items))
+    nhll = timed('NumpyHyperLogLog.add',
+                 lambda: add_one_by_one(NumpyHyperLogLog(.01), items))
+    timed('NumpyHyperLogLog.add_many',
+          lambda: NumpyHyperLogLog(.01).add_many(items))
+    assert(nhll.M.tolist() == hll.M)
+
+    hlls = [CrawlStatsJSONDecoder.json_decode_hyperloglog(
+        CrawlStatsJSONEncoder.json_encode_hyperloglog(hll))
+            for _ in range(100)]
+    list_hlls = []
+    for h in hlls:
+        list_hll = HyperLogLog(.01)
+        list_hll.M = h.M.tolist()
+        list_hlls.append(list_hll)
+    print('Merging 100 counters')
+    timed('HyperLogLog.update', lambda: merge(HyperLogLog, list_hlls))
+    timed('NumpyHyperLogLog.update', lambda: merge(NumpyHyperLogLog, hlls))
+    print('Cardinality estimate')
+    timed('HyperLogLog.card', hll.card, 10)
+    timed('NumpyHyperLogLog.card', nhll.card, 10)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -0,0 +1,98 @@
+"""Microbenchmark: encoding and decoding of the records of the count job
+output, mrjob's JSONProtocol (ujson) and the stdlib json module
+(StandardJSONProtocol) vs. FastJSONProtocol (orjson).
+
+The output of FastJSONProtocol is verified to be byte-identical to that
+of JSONProtocol.
+
+Usage:
+  python3 benchmark/json_protocol.py [count/part-00000.bz2]
+
+Without argument a sample of synthetic count records is used.
+"""
+
+import bz2
+import gzip
+import sys
+import time
+
+from mrjob.protocol import JSONProtocol, StandardJSONProtocol
+
+from crawlhll import NumpyHyperLogLog
+from crawlstats import CST, CrawlStatsJSONEncoder, FastJSONProtocol
+
+
+def read_lines(path):
+    if path.endswith('.bz2'):
+        f = bz2.open(path, 'rb')
+    elif path.endswith('.gz'):
+        f = gzip.open(path, 'rb')
+    else:
+        f = open(path, 'rb')
+    with f:
+        return [line.rstrip(b'\n') for line in f]
+
+
+def sample_lines(n=200000):
+    protocol = JSONProtocol()
+    lines = []
+    crawl = 14
+    for i in range(n):
+        host = 'www.example{}.com'.format(i // 3)
+        if i % 3 == 0:
+            key = (CST.surt_domain.value,
+                   'com,example{}'.format(i // 3), crawl)
+            value = (i % 1000 + 1, i % 500 + 1, 2)
+        elif i % 3 == 1:
+            key = (CST.host.value, host, crawl)
+            value = (i % 1000 + 1, i % 500 + 1)
+        else:
+            key = (CST.mimetype.value, 'text/html', crawl)
+            value = 1
+        lines.append(protocol.write(key, value))
+    hll = NumpyHyperLogLog(.01)
+    hll.add_many('http://www.example{}.com/'.format(i) for i in range(1000))
+    for item_type in (CST.url, CST.digest):
+        lines.append(protocol.write(
+            (CST.size_estimate.value, item_type.value, crawl),
+            CrawlStatsJSONEncoder.json_encode_hyperloglog(hll)))
+    return lines
+
+
+def measure(name, func, n, repeat=3):
+    elapsed = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed.append(time.perf_counter() - start)
+    print('{:<40} {:>12,.0f} records/s'.format(name, n / min(elapsed)))
+
+
+def decode(protocol, lines):
+    for line in lines:
+        protocol.read(line)
+
+
+def encode(protocol, records):
+    for key, value in records:
+        protocol.write(key, value)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        lines = read_lines(sys.argv[1])
+    else:
+        lines = sample_lines()
+    n = len(lines)
+    print('{} records'.format(n))
+    records = [JSONProtocol().read(line) for line in lines]
+    for key, value in records:
+        if (FastJSONProtocol().write(key, value)
+                != JSONProtocol().write(key, value)):
+            sys.exit('FastJSONProtocol output differs from JSONProtocol')
+    for name, protocol in (('StandardJSONProtocol (json)',
+                            StandardJSONProtocol),
+                           ('JSONProtocol (ujson)', JSONProtocol),
+                           ('FastJSONProtocol (orjson)', FastJSONProtocol)):
+        measure(name + ' decode', lambda: decode(protocol(), lines), n)
+        measure(name + ' encode', lambda: encode(protocol(), records), n)
@@ -0,0 +1,75 @@
+"""Microbenchmark: summing the values of one key in the count reducer,
+MultiCount.sum_values vs. MultiCount.sum_values_batched (numpy), for
+keys with few to many values (hot keys, e.g. MIME types or TLDs with the
+in-mapper combiner disabled) and different mixes of compressed values:
+integers only ("int"), lists of 2 or 3 counts ("list") or both ("mixed").
+
+The results of both methods are verified to be equal.
+
+Usage:
+  python3 benchmark/multicount_sum.py [--seed 1]
+"""
+
+import argparse
+import random
+import time
+
+from crawlstats import MultiCount
+
+
+def sample_values(rand, n, mix):
+    values = []
+    for _ in range(n):
+        pages = rand.randint(1, 10000)
+        if mix == 'int' or (mix == 'mixed' and rand.random() < .5):
+            values.append(pages)
+        else:
+            value = [pages, rand.randint(1, pages),
+                     rand.randint(1, 10)][:rand.randint(2, 3)]
+            values.append(MultiCount.compress(len(value), value))
+    return values
+
+
+def measure(func, values, min_time=.1):
+    """Seconds per call, best of three timings of repeated calls"""
+    repeat = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            func(iter(values))
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        repeat *= 4
+    timings = [elapsed]
+    for _ in range(2):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            func(iter(values))
+        timings.append(time.perf_counter() - start)
+    return min(timings) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark summing of MultiCount values')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    rand = random.Random(args.seed)
+    print('{:<6} {:>9} {:>14} {:>14} {:>8}'.format(
+        'mix', 'values', 'sum_values', 'batched', 'speedup'))
+    for mix in ('int', 'list', 'mixed'):
+        for n in (2, 100, 1000, 10000, 100000, 1000000):
+            values = sample_values(rand, n, mix)
+            if (MultiCount.sum_values_batched(values)
+                    != MultiCount.sum_values(values)):
+                raise AssertionError('Different sums ({}, {})'.format(
+                    mix, n))
+            scalar = measure(MultiCount.sum_values, values)
+            batched = measure(MultiCount.sum_values_batched, values)
+            print('{:<6} {:>9,} {:>12.1f}us {:>12.1f}us {:>7.1f}x'.format(
+                mix, n, scalar * 1e6, batched * 1e6, scalar / batched))
+
+
+if __name__ == '__main__':
+    main()
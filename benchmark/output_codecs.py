@@ -0,0 +1,69 @@
+"""Benchmark: wall time to compress and decompress a count job output and
+size of the compressed output, for every codec selectable by
+--count-output-codec and --stats-output-codec.
+
+Python's codec modules are used at the compression levels of the Hadoop
+codecs: gzip at zlib's default level 6 (Python's gzip module defaults to
+level 9), bzip2 and zstd at the modules' defaults (9 and 3). The zstd
+codec needs the zstandard module.
+
+Usage:
+  python3 benchmark/output_codecs.py [count/part-00000.bz2]
+
+Without argument a sample of synthetic count records is used (see
+benchmark/json_protocol.py).
+"""
+
+import bz2
+import functools
+import gzip
+import sys
+import time
+
+from crawlstats import OUTPUT_CODECS
+
+sys.path.insert(0, 'benchmark')
+from json_protocol import read_lines, sample_lines  # noqa: E402
+
+
+def codec_functions(codec):
+    if codec == 'gzip':
+        # level of Hadoop's GzipCodec (zlib default)
+        return (functools.partial(gzip.compress, compresslevel=6),
+                gzip.decompress)
+    if codec == 'bzip2':
+        return bz2.compress, bz2.decompress
+    if codec == 'zstd':
+        import zstandard
+        return (zstandard.ZstdCompressor().compress,
+                zstandard.ZstdDecompressor().decompress)
+    return bytes, bytes
+
+
+def measure(func, data, repeat=3):
+    elapsed = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(data)
+        elapsed.append(time.perf_counter() - start)
+    return min(elapsed), result
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        lines = read_lines(sys.argv[1])
+    else:
+        lines = sample_lines()
+    data = b'\n'.join(lines) + b'\n'
+    print('{} records, {:,} bytes'.format(len(lines), len(data)))
+    print('{:<6} {:>14} {:>7} {:>12} {:>12}'.format(
+        'codec', 'bytes', 'ratio', 'compress', 'decompress'))
+    for codec in OUTPUT_CODECS:
+        compress, decompress = codec_functions(codec)
+        compress_time, compressed = measure(compress, data)
+        decompress_time, decompressed = measure(decompress, compressed)
+        if decompressed != data:
+            sys.exit('Codec {} failed to restore input'.format(codec))
+        print('{:<6} {:>14,} {:>7.1%} {:>11.3f}s {:>11.3f}s'.format(
+            codec, len(compressed), len(compressed) / len(data),
+            compress_time, decompress_time))
@@ -0,0 +1,76 @@
+"""Benchmark: resolve the hosts of a cdx file into registered domain and
+public suffix, PublicSuffixResolver vs. tldextract.extract.
+
+Hosts are resolved once per SURT domain, same as in the count mapper
+(HostDomainCount.output). The results of both methods are verified to be
+equal.
+
+Usage:
+  python3 benchmark/public_suffix_resolver.py cdx-00000.gz [max_lines]
+"""
+
+import sys
+import time
+
+from urllib.parse import urlparse
+
+import tldextract
+import ujson
+
+from crawlstats import CdxParser
+from public_suffix import PublicSuffixResolver
+
+
+def read_hosts(cdx_path, max_lines):
+    """Distinct hosts per SURT domain"""
+    hosts = []
+    surt_domain_hosts = set()
+    last_surt_domain = None
+    with open(cdx_path, 'rb') as cdx:
+        for n, line in enumerate(CdxParser.read_lines(cdx)):
+            if n >= max_lines:
+                break
+            surt_domain, _path, json_string = CdxParser.split_line(
+                line.decode('utf-8'))
+            if surt_domain != last_surt_domain:
+                hosts.extend(surt_domain_hosts)
+                surt_domain_hosts = set()
+                last_surt_domain = surt_domain
+            host = urlparse(ujson.loads(json_string)['url']).hostname
+            if host is not None:
+                surt_domain_hosts.add(host.lower().strip('.'))
+    hosts.extend(surt_domain_hosts)
+    return hosts
+
+
+def main(cdx_path, max_lines):
+    hosts = read_hosts(cdx_path, max_lines)
+    print('Resolving {} hosts'.format(len(hosts)))
+
+    start = time.time()
+    expected = []
+    for host in hosts:
+        parsed = tldextract.extract(host)
+        expected.append((parsed.domain, parsed.suffix))
+    elapsed = time.time() - start
+    print('{:<24} {:>8.2f} sec {:>8.1f} µs/host'.format(
+        'tldextract', elapsed, 1e6 * elapsed / len(hosts)))
+
+    start = time.time()
+    resolver = PublicSuffixResolver()
+    results = [resolver.resolve(host) for host in hosts]
+    elapsed = time.time() - start
+    print('{:<24} {:>8.2f} sec {:>8.1f} µs/host (incl. init)'.format(
+        'PublicSuffixResolver', elapsed, 1e6 * elapsed / len(hosts)))
+
+    for (domain, suffix, _is_ip), (exp_domain, exp_suffix) in zip(
+            results, expected):
+        assert(suffix == exp_suffix)
+        if suffix:
+            assert(domain == exp_domain + '.' + exp_suffix)
+        else:
+            assert(domain == exp_domain)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 10000000)
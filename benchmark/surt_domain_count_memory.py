@@ -0,0 +1,68 @@
+"""Memory benchmark: counters of one large SURT domain in the count mapper.
+
+Adds a synthetic SURT domain with many URLs (default: one million) to
+SurtDomainCount, CompactSurtDomainCount (with and without URL hashes)
+and SpillingSurtDomainCount (limited to 100k URLs and digests), and
+reports the peak memory allocated (measured by tracemalloc) and the time
+needed to add the records.
+
+Usage:
+  python3 benchmark/surt_domain_count_memory.py [number_of_urls]
+"""
+
+import gc
+import sys
+import time
+import tracemalloc
+
+from crawlstats import SurtDomainCount, CompactSurtDomainCount
+from crawlstats import SpillingSurtDomainCount
+
+
+def sample_records(n):
+    for i in range(n):
+        path = '/{}/page-{}.html'.format(i % 1000, i)
+        url = 'https://www.example.com' + path
+        yield path, {'url': url, 'mime': 'text/html',
+                     'mime-detected': 'text/html', 'status': '200',
+                     'digest': 'SHA1{:032X}'.format(i // 2),
+                     'filename': 'crawl-data/CC-MAIN-2024-10/segments/'
+                     '1707947473347.0/warc/CC-MAIN-20240220211055-'
+                     '20240221001055-00000.warc.gz',
+                     'charset': 'UTF-8',
+                     'languages': ('eng', 'deu', 'eng,fra')[i % 3]}
+
+
+def measure(name, create, n):
+    gc.collect()
+    tracemalloc.start()
+    start = time.time()
+    count = create()
+    for path, metadata in sample_records(n):
+        count.add(path, metadata)
+    # URL counts must be readable after all records are added
+    unique_urls = count.unique_urls()
+    elapsed = time.time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('{:<32} {:>8.1f} MiB {:>8.1f} bytes/URL {:>8.1f} sec'.format(
+        name, peak / 1024 / 1024, peak / n, elapsed))
+    assert(unique_urls == n)
+    del count
+
+
+def main(n):
+    print('Adding {} URLs of a single SURT domain'.format(n))
+    measure('SurtDomainCount',
+            lambda: SurtDomainCount('com,example'), n)
+    measure('CompactSurtDomainCount',
+            lambda: CompactSurtDomainCount('com,example'), n)
+    measure('CompactSurtDomainCount (hashed)',
+            lambda: CompactSurtDomainCount('com,example', url_hashes=True),
+            n)
+    measure('SpillingSurtDomainCount',
+            lambda: SpillingSurtDomainCount('com,example', 100000), n)
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
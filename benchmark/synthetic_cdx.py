@@ -0,0 +1,313 @@
+"""Seeded generator of synthetic cdx files for benchmarks.
+
+The same seed and parameters always give the same cdx files. The
+distributions follow those observed in Common Crawl's monthly crawls:
+- pages per registered domain are Pareto-distributed (heavy tail, most
+  domains have only a few pages, few domains up to --max-domain-size),
+  larger domains have more hosts (SURT domains)
+- mix of TLDs (incl. two-label public suffixes and IP addresses),
+  HTTP status codes, MIME types, charsets and content languages
+- revisits of URLs and duplicate content (same digest)
+- robots.txt captures (robotstxt subset) for most hosts
+Lines are sorted by SURT URL and timestamp, every file is a sequence of
+gzip members of 3000 lines, same as the cdx files of the crawls.
+
+Usage:
+  python3 benchmark/synthetic_cdx.py --seed 1 --lines 1000000 \\
+      --files 4 --output-dir synthetic/
+"""
+
+import argparse
+import base64
+import gzip
+import json
+import os
+import random
+
+
+def weighted(choices):
+    """Values and cumulative weights for random.choices"""
+    values = [value for value, _ in choices]
+    cum_weights = []
+    total = 0
+    for _, weight in choices:
+        total += weight
+        cum_weights.append(total)
+    return values, cum_weights
+
+
+# public suffixes, SURT form
+TLDS = weighted([('com', 450), ('org', 50), ('net', 45), ('de', 55),
+                 ('ru', 45), ('uk,co', 25), ('jp', 20), ('fr', 20),
+                 ('it', 18), ('nl', 15), ('pl', 15), ('br,com', 15),
+                 ('au,com', 10), ('info', 10), ('es', 10), ('ca', 8),
+                 ('cz', 6), ('in', 6), ('io', 5), ('eu', 5),
+                 ('jp,co', 5), ('edu', 5), ('gov', 3), ('xn--p1ai', 2)])
+
+STATUS = weighted([('200', 810), ('301', 60), ('302', 35), ('404', 60),
+                   ('403', 10), ('500', 5), ('503', 5), ('410', 5),
+                   ('304', 2), ('307', 8)])
+
+ROBOTSTXT_STATUS = weighted([('200', 700), ('404', 200), ('301', 60),
+                             ('403', 20), ('500', 10), ('503', 10)])
+
+MIME = weighted([('text/html', 880), ('application/xhtml+xml', 35),
+                 ('application/pdf', 20), ('text/plain', 10),
+                 ('application/rss+xml', 8), ('text/xml', 8),
+                 ('application/json', 5), ('image/jpeg', 5),
+                 ('text/calendar', 3), ('unk', 10), ('application/zip', 2)])
+
+MIME_DETECTED = {'unk': 'text/html', 'text/xml': 'application/rss+xml',
+                 'text/plain': 'text/html'}
+
+CHARSET = weighted([('UTF-8', 850), ('ISO-8859-1', 50),
+                    ('windows-1252', 30), ('windows-1251', 20),
+                    ('Shift_JIS', 10), ('GB2312', 10), ('EUC-JP', 5),
+                    ('Big5', 5), ('windows-1250', 5), ('', 15)])
+
+LANGUAGES = weighted([('eng', 430), ('rus', 60), ('deu', 60), ('jpn', 50),
+                      ('zho', 50), ('spa', 45), ('fra', 45), ('ita', 25),
+                      ('por', 25), ('pol', 20), ('nld', 20), ('ces', 10),
+                      ('eng,fra', 20), ('eng,deu', 15), ('eng,spa', 15),
+                      ('deu,eng', 10), ('jpn,eng', 10), ('zho,eng', 10),
+                      ('eng,zho,jpn', 5), ('', 30)])
+
+SUBDOMAINS = ('blog', 'shop', 'news', 'forum', 'm', 'en', 'de', 'fr',
+              'mail', 'docs', 'support', 'static', 'dev', 'api', 'wiki')
+
+PATH_SEGMENTS = ('index', 'news', 'article', 'product', 'category', 'tag',
+                 'page', 'blog', 'post', 'item', 'search', 'about',
+                 'contact', 'de', 'en', 'fr', '2023', '2024', 'archive')
+
+LINES_PER_BLOCK = 3000
+
+
+class SyntheticCdx:
+    """Seeded generator of synthetic cdx lines"""
+
+    def __init__(self, seed=0, lines=100000, crawl='CC-MAIN-2024-10',
+                 domain_size_alpha=1.0, max_domain_size=100000,
+                 ip_address_ratio=.01, robotstxt_ratio=.8,
+                 revisit_ratio=.05, duplicate_ratio=.08):
+        self.seed = seed
+        self.num_lines = lines
+        self.crawl = crawl
+        self.domain_size_alpha = domain_size_alpha
+        self.max_domain_size = max_domain_size
+        self.ip_address_ratio = ip_address_ratio
+        self.robotstxt_ratio = robotstxt_ratio
+        self.revisit_ratio = revisit_ratio
+        self.duplicate_ratio = duplicate_ratio
+        self.rng = random.Random(seed)
+
+    def domain_hosts(self, domain, pages):
+        """Split the pages of a registered domain (SURT form) into hosts
+        (SURT domains), the number of hosts grows with the domain size"""
+        rng = self.rng
+        if rng.random() < .6:
+            main = domain + ',www'
+        else:
+            main = domain
+        hosts = {main: pages}
+        if pages < 3:
+            return hosts
+        n = min(len(SUBDOMAINS), int(rng.paretovariate(1.5)),
+                pages // 3)
+        for sub in rng.sample(SUBDOMAINS, n):
+            size = max(1, int(pages * rng.random() * .3))
+            size = min(size, hosts[main] - 1)
+            if size <= 0:
+                break
+            hosts[domain + ',' + sub] = size
+            hosts[main] -= size
+        return hosts
+
+    def plan(self):
+        """Sorted list of (SURT domain, pages), about num_lines pages in
+        total (robots.txt captures not included)"""
+        rng = self.rng
+        tlds, tld_weights = TLDS
+        hosts = {}
+        total = 0
+        n = 0
+        while total < self.num_lines:
+            pages = min(self.max_domain_size, self.num_lines - total,
+                        int(rng.paretovariate(self.domain_size_alpha)))
+            total += pages
+            n += 1
+            if rng.random() < self.ip_address_ratio:
+                hosts['{}.{}.{}.{}'.format(
+                    rng.randint(1, 223), rng.randint(0, 255),
+                    rng.randint(0, 255), rng.randint(1, 254))] = pages
+                continue
+            tld = rng.choices(tlds, cum_weights=tld_weights)[0]
+            domain = '{},{}{:x}'.format(
+                tld, rng.choice(PATH_SEGMENTS), n)
+            hosts.update(self.domain_hosts(domain, pages))
+        # cdx lines are sorted by "<SURT domain>)<path>"
+        return sorted(hosts.items(), key=lambda h: h[0] + ')')
+
+    def randrange(self, n):
+        # faster than random.randrange, precise enough here
+        return int(self.rng.random() * n)
+
+    def filename(self, subset):
+        return ('crawl-data/{0}/segments/1707947473347.{1}/{2}/{0}-'
+                '20240220211055-20240221001055-{3:05d}.warc.gz'.format(
+                    self.crawl, self.randrange(100), subset,
+                    self.randrange(80000)))
+
+    def timestamp(self):
+        seconds = self.randrange(10 * 24 * 3600)
+        return '202402{:02d}{:02d}{:02d}{:02d}'.format(
+            20 + seconds // 86400, seconds // 3600 % 24, seconds // 60 % 60,
+            seconds % 60)
+
+    def digest(self):
+        return 'sha1:' + base64.b32encode(
+            self.rng.getrandbits(160).to_bytes(20, 'big')).decode('ascii')
+
+    def capture(self, surt_domain, host, scheme, path, status, digest,
+                subset):
+        metadata = {'url': '{}://{}{}'.format(scheme, host, path)}
+        rng = self.rng
+        mime = 'text/html'
+        if subset == 'warc':
+            mime = rng.choices(*MIME)[0]
+        elif subset == 'robotstxt':
+            mime = 'text/plain'
+        metadata['mime'] = mime
+        metadata['mime-detected'] = MIME_DETECTED.get(mime, mime)
+        metadata['status'] = status
+        metadata['digest'] = digest
+        metadata['length'] = str(500 + self.randrange(100000))
+        metadata['offset'] = str(self.randrange(1000000000))
+        metadata['filename'] = self.filename(subset)
+        if status in ('301', '302', '307'):
+            metadata['redirect'] = '{}://{}/'.format(scheme, host)
+        if subset == 'warc' and mime in ('text/html',
+                                         'application/xhtml+xml'):
+            charset = rng.choices(*CHARSET)[0]
+            if charset:
+                metadata['charset'] = charset
+            languages = rng.choices(*LANGUAGES)[0]
+            if languages:
+                metadata['languages'] = languages
+        return '{}){} {} {}\n'.format(surt_domain, path.lower(),
+                                      self.timestamp(),
+                                      json.dumps(metadata))
+
+    def host_lines(self, surt_domain, pages):
+        """Sorted cdx lines of one SURT domain"""
+        rng = self.rng
+        if ',' in surt_domain:
+            host = '.'.join(reversed(surt_domain.split(',')))
+        else:
+            host = surt_domain  # IP address
+        scheme = 'https' if rng.random() < .75 else 'http'
+        lines = []
+        if rng.random() < self.robotstxt_ratio:
+            lines.append(self.capture(
+                surt_domain, host, scheme, '/robots.txt',
+                rng.choices(*ROBOTSTXT_STATUS)[0], self.digest(),
+                'robotstxt'))
+        paths = []
+        digests = []
+        for i in range(pages):
+            if paths and rng.random() < self.revisit_ratio:
+                path = rng.choice(paths)
+            else:
+                segments = rng.choices(PATH_SEGMENTS, k=self.randrange(4))
+                if i > 0:
+                    segments.append('{}.html'.format(i))
+                path = '/' + '/'.join(segments)
+                paths.append(path)
+            status = rng.choices(*STATUS)[0]
+            subset = 'warc' if status == '200' else 'crawldiagnostics'
+            if digests and rng.random() < self.duplicate_ratio:
+                digest = rng.choice(digests)
+            else:
+                digest = self.digest()
+                digests.append(digest)
+            lines.append(self.capture(surt_domain, host, scheme, path,
+                                      status, digest, subset))
+        lines.sort()
+        return lines
+
+    def lines(self, plan=None):
+        """Generate all cdx lines, sorted"""
+        if plan is None:
+            self.rng.seed(self.seed)
+            plan = self.plan()
+        for surt_domain, pages in plan:
+            yield from self.host_lines(surt_domain, pages)
+
+    @staticmethod
+    def write_block(cdx, lines):
+        # fixed modification time in gzip header, output is reproducible
+        cdx.write(gzip.compress(''.join(lines).encode('utf-8'),
+                                compresslevel=6, mtime=0))
+
+    def write(self, output_dir, files=1):
+        """Write the lines into cdx files of about equal size, return the
+        paths of the files"""
+        os.makedirs(output_dir, exist_ok=True)
+        self.rng.seed(self.seed)
+        plan = self.plan()
+        expected_lines = (sum(pages for _, pages in plan)
+                          + int(self.robotstxt_ratio * len(plan)))
+        lines_per_file = -(-expected_lines // files)
+        paths = []
+        cdx = None
+        block = []
+        written = 0
+        for line in self.lines(plan):
+            if cdx is None or (written >= lines_per_file
+                               and len(paths) < files):
+                if cdx is not None:
+                    self.write_block(cdx, block)
+                    cdx.close()
+                    block = []
+                    written = 0
+                path = os.path.join(output_dir, '{}-cdx-{:05d}.gz'.format(
+                    self.crawl, len(paths)))
+                paths.append(path)
+                cdx = open(path, 'wb')
+            block.append(line)
+            written += 1
+            if len(block) == LINES_PER_BLOCK:
+                self.write_block(cdx, block)
+                block = []
+        if cdx is not None:
+            self.write_block(cdx, block)
+            cdx.close()
+        return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Write synthetic cdx files')
+    parser.add_argument('--output-dir', required=True,
+                        help='Output directory')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the random number generator')
+    parser.add_argument('--lines', type=int, default=100000,
+                        help='Number of pages (approx. number of lines)')
+    parser.add_argument('--files', type=int, default=1,
+                        help='Number of cdx files')
+    parser.add_argument('--crawl', default='CC-MAIN-2024-10',
+                        help='ID of the crawl')
+    parser.add_argument('--domain-size-alpha', type=float, default=1.0,
+                        help='Shape of the Pareto distribution of pages'
+                        ' per domain (smaller: heavier tail)')
+    parser.add_argument('--max-domain-size', type=int, default=100000,
+                        help='Max. number of pages per domain')
+    args = parser.parse_args()
+    generator = SyntheticCdx(args.seed, args.lines, args.crawl,
+                             args.domain_size_alpha, args.max_domain_size)
+    for path in generator.write(args.output_dir, args.files):
+        print(path)
+
+
+if __name__ == '__main__':
+    main()
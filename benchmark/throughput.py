@@ -0,0 +1,299 @@
+"""Throughput benchmark suite: records per second and peak memory (RSS)
+of the count mapper, the count and stats reducers and the plot data
+loaders, run on seeded synthetic cdx files (see synthetic_cdx.py) of
+one or more sizes, or on given cdx files.
+
+Every stage is run in a fresh process so that the peak RSS is that of
+the stage. Only the processing is timed, reading the input into memory
+and writing the output are not. Results are written as JSON. Given the
+results of an earlier run as baseline, stages which are slower or need
+more memory than the tolerance allows are reported, and the exit code
+is 1.
+
+Usage:
+  python3 benchmark/throughput.py --lines 100000 1000000 \\
+      --output results.json [--baseline baseline.json] [--tolerance .1]
+  python3 benchmark/throughput.py --input cdx-0000[01].gz \\
+      --output results.json
+Other options are passed to crawlstats.py (e.g. --exact-counts).
+"""
+
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from synthetic_cdx import SyntheticCdx
+
+
+# plot data loaders: module in plot/, class, constructor arguments
+PLOT_LOADERS = (('crawl_size', 'CrawlSizePlot', ()),
+                ('crawler_metrics', 'CrawlerMetrics', ()),
+                ('histogram', 'CrawlHistogram', ()),
+                ('mimetype', 'MimeTypeStats', ()),
+                ('charset', 'CharsetStats', ()),
+                ('language', 'LanguageStats', ()),
+                ('tld', 'TldStats', ()),
+                ('domain', 'DomainStats', ('CC-MAIN-2024-10',)))
+
+
+def read_lines(path):
+    with open(path, 'rb') as f:
+        return f.read().splitlines()
+
+
+def write_lines(path, lines):
+    with open(path, 'wb') as f:
+        for line in lines:
+            f.write(line + b'\n')
+
+
+def reduce_groups(read_line, lines):
+    """Group sorted lines by key, same as Hadoop's shuffle"""
+    for _, group in itertools.groupby(
+            lines, key=lambda line: line.split(b'\t', 1)[0]):
+        key, value = read_line(next(group))
+        yield key, itertools.chain(
+            [value], (read_line(line)[1] for line in group))
+
+
+def count_mapper(job_args, cdx_paths, output_path):
+    from crawlstats import CdxParser
+    from crawlstats_local import LocalCCStatsJob
+    records = 0
+    elapsed = 0.0
+    output = []
+    for cdx_path in cdx_paths:
+        with open(cdx_path, 'rb') as cdx:
+            data = cdx.read()
+        job = LocalCCStatsJob(['--job=count'] + job_args)
+        write_line = job.pick_protocols(0, 'mapper')[1]
+        os.environ['mapreduce_map_input_file'] = cdx_path
+        start = time.perf_counter()
+        job.count_mapper_init()
+        for line in CdxParser.read_lines(BytesReader(data)):
+            records += 1
+            for pair in job.count_mapper(None, line.decode('utf-8')):
+                output.append(write_line(*pair))
+        for pair in job.count_mapper_final():
+            output.append(write_line(*pair))
+        elapsed += time.perf_counter() - start
+    output.sort()
+    write_lines(output_path, output)
+    return records, elapsed
+
+
+class BytesReader:
+    """Minimal stream over bytes (cdx file held in memory)"""
+
+    def __init__(self, data):
+        self.data = memoryview(data)
+        self.offset = 0
+
+    def read(self, size):
+        chunk = self.data[self.offset:self.offset+size]
+        self.offset += len(chunk)
+        return bytes(chunk)
+
+
+def count_reducer(job_args, input_path, output_path):
+    from crawlstats_local import LocalCCStatsJob
+    lines = read_lines(input_path)
+    job = LocalCCStatsJob(['--job=count'] + job_args)
+    read_line, write_line = job.pick_protocols(0, 'reducer')
+    output = []
+    start = time.perf_counter()
+    job.reducer_init()
+    for key, values in reduce_groups(read_line, lines):
+        for pair in job.count_reducer(key, values):
+            output.append(write_line(*pair))
+    for pair in job.reducer_final():
+        output.append(write_line(*pair))
+    elapsed = time.perf_counter() - start
+    write_lines(output_path, output)
+    return len(lines), elapsed
+
+
+def stats_mapper(job_args, input_path, output_path):
+    from crawlstats_local import LocalCCStatsJob
+    lines = read_lines(input_path)
+    job = LocalCCStatsJob(['--job=stats'] + job_args)
+    read_line, write_line = job.pick_protocols(0, 'mapper')
+    output = []
+    start = time.perf_counter()
+    job.stats_mapper_init()
+    for line in lines:
+        for pair in job.stats_mapper(*read_line(line)):
+            output.append(write_line(*pair))
+    for pair in job.stats_mapper_final():
+        output.append(write_line(*pair))
+    elapsed = time.perf_counter() - start
+    output.sort()
+    write_lines(output_path, output)
+    return len(lines), elapsed
+
+
+def stats_reducer(job_args, input_path, output_path):
+    from crawlstats_local import LocalCCStatsJob
+    lines = read_lines(input_path)
+    job = LocalCCStatsJob(['--job=stats'] + job_args)
+    read_line, write_line = job.pick_protocols(0, 'reducer')
+    output = []
+    start = time.perf_counter()
+    job.reducer_init()
+    for key, values in reduce_groups(read_line, lines):
+        for pair in job.stats_reducer(key, values):
+            output.append(write_line(*pair))
+    for pair in job.reducer_final():
+        output.append(write_line(*pair))
+    elapsed = time.perf_counter() - start
+    write_lines(output_path, output)
+    return len(lines), elapsed
+
+
+def plot_loader(loader, input_path, plot_dir):
+    import importlib
+    os.environ['PLOTLIB'] = 'ggplot'  # no plot library needed to load
+    os.environ['PLOTDIR'] = plot_dir
+    sys.path[0:0] = ['plot']
+    module_name, class_name, args = loader
+    plot_class = getattr(importlib.import_module(module_name), class_name)
+    with open(input_path, encoding='utf-8') as f:
+        lines = f.readlines()
+    plot = plot_class(*args)
+    start = time.perf_counter()
+    plot.read_data(lines)
+    return len(lines), time.perf_counter() - start
+
+
+def run_stage(func, *args):
+    """Run a stage in this process, return records, elapsed time and
+    peak RSS (KiB)"""
+    records, elapsed = func(*args)
+    return records, elapsed, resource.getrusage(
+        resource.RUSAGE_SELF).ru_maxrss
+
+
+def run_stages(job_args, cdx_paths, work_dir):
+    """Run all stages, every stage in a new process"""
+    paths = {name: os.path.join(work_dir, name) for name in (
+        'map-output', 'count', 'stats-map-output', 'stats')}
+    stages = [('count mapper', count_mapper,
+               (job_args, cdx_paths, paths['map-output'])),
+              ('count reducer', count_reducer,
+               (job_args, paths['map-output'], paths['count'])),
+              ('stats mapper', stats_mapper,
+               (job_args, paths['count'], paths['stats-map-output'])),
+              ('stats reducer', stats_reducer,
+               (job_args, paths['stats-map-output'], paths['stats']))]
+    for loader in PLOT_LOADERS:
+        stages.append(('plot loader ' + loader[0], plot_loader,
+                       (loader, paths['stats'],
+                        os.path.join(work_dir, 'plots'))))
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    for name, func, args in stages:
+        with context.Pool(1) as pool:
+            records, elapsed, rss = pool.apply(run_stage, (func,) + args)
+        results[name] = {'records': records,
+                         'seconds': round(elapsed, 3),
+                         'records_per_second': round(records / elapsed),
+                         'peak_rss_kib': rss}
+        print('{:<30} {:>12,} records {:>12,} records/s {:>10,} KiB'
+              .format(name, records, results[name]['records_per_second'],
+                      rss))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """List the regressions of results against the baseline"""
+    regressions = []
+    for scale, stages in results['scales'].items():
+        for name, result in stages.items():
+            base = baseline.get('scales', {}).get(scale, {}).get(name)
+            if base is None:
+                continue
+            if (result['records_per_second']
+                    < base['records_per_second'] * (1 - tolerance)):
+                regressions.append('{} ({}): {:,} < {:,} records/s'.format(
+                    name, scale, result['records_per_second'],
+                    base['records_per_second']))
+            if result['peak_rss_kib'] > base['peak_rss_kib'] * (1 + tolerance):
+                regressions.append('{} ({}): {:,} > {:,} KiB'.format(
+                    name, scale, result['peak_rss_kib'],
+                    base['peak_rss_kib']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Throughput benchmark of the count and stats jobs'
+        ' and the plot data loaders',
+        epilog='Other options are passed to crawlstats.py')
+    parser.add_argument('--lines', type=int, nargs='+', default=[100000],
+                        help='Sizes (number of pages) of the synthetic'
+                        ' input, one run per size')
+    parser.add_argument('--files', type=int, default=2,
+                        help='Number of synthetic cdx files')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='Seed of the synthetic cdx generator')
+    parser.add_argument('--input', nargs='+', default=None,
+                        help='cdx files used as input instead of synthetic'
+                        ' cdx files')
+    parser.add_argument('--output', default=None,
+                        help='Write results to JSON file')
+    parser.add_argument('--baseline', default=None,
+                        help='Results of an earlier run (JSON file)')
+    parser.add_argument('--tolerance', type=float, default=.1,
+                        help='Max. relative decrease of records/s or'
+                        ' increase of peak RSS not reported as regression')
+    parser.add_argument('--work-dir', default=None,
+                        help='Directory for temporary files')
+    args, job_args = parser.parse_known_args()
+
+    results = {'python': platform.python_version(),
+               'platform': platform.platform(),
+               'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'seed': args.seed,
+               'job_args': job_args,
+               'scales': {}}
+    work_dir = tempfile.mkdtemp(prefix='throughput-', dir=args.work_dir)
+    try:
+        if args.input:
+            scales = [('input', args.input)]
+        else:
+            scales = []
+            for lines in args.lines:
+                cdx_dir = os.path.join(work_dir, 'cdx-{}'.format(lines))
+                generator = SyntheticCdx(args.seed, lines)
+                scales.append((str(lines),
+                               generator.write(cdx_dir, args.files)))
+        for scale, cdx_paths in scales:
+            print('Input: {} ({} cdx files)'.format(scale, len(cdx_paths)))
+            scale_dir = os.path.join(work_dir, scale)
+            os.makedirs(scale_dir)
+            results['scales'][scale] = run_stages(job_args, cdx_paths,
+                                                  scale_dir)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print('Regression: ' + regression)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
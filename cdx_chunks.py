@@ -0,0 +1,57 @@
+"""Create the list of cdx chunks processed by the count job with the
+option --cdx-chunks, one chunk per line and map task.
+
+The cdx files are split at gzip member boundaries given by the
+cluster.idx, every chunk holds a fixed number of consecutive blocks
+(3000 cdx lines each). Usage:
+  python3 cdx_chunks.py --blocks-per-chunk 500 \\
+      s3://commoncrawl/cc-index/collections/CC-MAIN-2016-26/indexes/cluster.idx \\
+      >chunks.txt
+"""
+
+import argparse
+import io
+import logging
+import sys
+
+from crawlstats import CdxChunk, LOG
+
+
+def read_cluster_idx(path):
+    stream = CdxChunk.open(path, 0)
+    try:
+        for line in io.TextIOWrapper(stream, encoding='utf-8'):
+            yield line
+    finally:
+        stream.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Split cdx files into chunks using the cluster.idx')
+    parser.add_argument('--blocks-per-chunk', type=int, default=500,
+                        help='Number of gzip members (blocks of 3000 cdx'
+                        ' lines) per chunk')
+    parser.add_argument('--cdx-dir', default=None,
+                        help='Location of the cdx files (default: same as'
+                        ' cluster.idx)')
+    parser.add_argument('cluster_idx', help='Path or S3 URL of cluster.idx')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s: [%(levelname)s]: %(message)s')
+    cdx_dir = args.cdx_dir
+    if cdx_dir is None:
+        cdx_dir = '.'
+        if '/' in args.cluster_idx:
+            cdx_dir = args.cluster_idx.rsplit('/', 1)[0]
+    chunks = 0
+    for chunk in CdxChunk.from_cluster_idx(
+            read_cluster_idx(args.cluster_idx), cdx_dir,
+            args.blocks_per_chunk):
+        sys.stdout.write(chunk.to_line() + '\n')
+        chunks += 1
+    LOG.info('Split cdx files into {} chunks'.format(chunks))
+
+
+if __name__ == '__main__':
+    main()
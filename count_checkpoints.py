@@ -0,0 +1,63 @@
+"""List the inputs of a (re)run of the count job with --checkpoint-dir,
+one path per line: cdx files whose partial result (see CountCheckpoint)
+is already stored in the checkpoint directory are replaced by the
+partial result, so that only the remaining cdx files are processed.
+
+Glob patterns in S3 URLs are expanded. Options not known to this script
+are passed to the count job, the options must be the same as those of
+the job run because they are part of the address of partial results.
+Usage:
+  python3 count_checkpoints.py --checkpoint-dir s3://bucket/checkpoint/ \\
+      --no-exact-counts \\
+      's3://commoncrawl/cc-index/collections/CC-MAIN-2016-26/indexes/cdx-*.gz' \\
+      >count-inputs.txt
+"""
+
+import argparse
+import fnmatch
+import glob
+import re
+import sys
+
+from crawlstats import CCStatsJob, CountCheckpoint
+
+
+def expand(pattern):
+    """Expand a glob pattern of local paths or S3 URLs"""
+    if not CountCheckpoint.is_s3(pattern):
+        return sorted(glob.glob(pattern)) or [pattern]
+    scheme = pattern.split('://', 1)[0]
+    client, bucket, key_pattern = CountCheckpoint.s3(pattern)
+    prefix = re.split(r'[*?\[]', key_pattern, 1)[0]
+    if prefix == key_pattern:
+        return [pattern]
+    paths = []
+    paginator = client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            if fnmatch.fnmatchcase(obj['Key'], key_pattern):
+                paths.append('{}://{}/{}'.format(scheme, bucket, obj['Key']))
+    return sorted(paths)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='List cdx files or their stored partial results as'
+        ' input of the count job',
+        epilog='Other options are passed to crawlstats.py --job=count')
+    parser.add_argument('--checkpoint-dir', required=True,
+                        help='Checkpoint directory of the count job')
+    parser.add_argument('input', nargs='+',
+                        help='cdx files or glob patterns')
+    args, job_args = parser.parse_known_args()
+    job = CCStatsJob(['--job=count', '--checkpoint-dir', args.checkpoint_dir]
+                     + job_args)
+    paths = []
+    for pattern in args.input:
+        paths.extend(expand(pattern))
+    for path in job.checkpointed_inputs(paths):
+        sys.stdout.write(path + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+"""Bloom filter of URLs and content digests seen in earlier crawls.
+
+The count job with --seen-filter looks up the fingerprints (see
+crawlhll.hll_hash) of the URLs and digests of every SURT domain in the
+filter and counts the items not seen before (CST.new_items and
+CST.new_items_for). The filter is a directory holding one Bloom filter
+per item type and the list of crawls added:
+  <filter>/url.bloom
+  <filter>/digest.bloom
+  <filter>/crawls.json
+The bit arrays are memory-mapped read-only, so that all mapper processes
+on one machine share the same pages. Items are never missed, but a new
+item is taken for a seen one with the probability given by the error
+rate (if the number of items added does not exceed the capacity), i.e.
+the new-item counts are underestimated by at most this fraction.
+
+Create a filter and add a finished crawl (from cdx files or from the
+fingerprint index, see crawlindex.py):
+  python3 crawlbloom.py --filter seen/ create --capacity 50000000000
+  python3 crawlbloom.py --filter seen/ add --crawl CC-MAIN-2016-26 \\
+      cdx-*.gz
+  python3 crawlbloom.py --filter seen/ add --crawl CC-MAIN-2016-30 \\
+      --index fpindex/
+"""
+
+import argparse
+import glob
+import json
+import logging
+import math
+import os
+import struct
+
+from multiprocessing import Pool
+
+import numpy
+
+
+LOG = logging.getLogger('CrawlBloomFilter')
+
+# item types, same as CST.url.name and CST.digest.name
+ITEM_TYPES = ('url', 'digest')
+
+
+class BloomFilter:
+    """Bloom filter of 64-bit fingerprints, bits stored in a file"""
+
+    MAGIC = b'CCBLOOM1'
+    # header: magic, number of bits, number of hash functions
+    HEADER = struct.Struct('<8sQI')
+
+    def __init__(self, path, writable=False):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic, self.m, self.k = self.HEADER.unpack(
+                f.read(self.HEADER.size))
+        if magic != self.MAGIC:
+            raise ValueError('Not a Bloom filter: {}'.format(path))
+        self.bits = numpy.memmap(path, dtype=numpy.uint8,
+                                 mode=('r+' if writable else 'r'),
+                                 offset=self.HEADER.size,
+                                 shape=((self.m + 7) // 8,))
+
+    @staticmethod
+    def create(path, capacity, error_rate):
+        """Create an empty filter, sized to hold `capacity` items with
+        the given false-positive rate"""
+        m = int(math.ceil(-capacity * math.log(error_rate)
+                          / (math.log(2) ** 2)))
+        k = max(1, int(round(m / capacity * math.log(2))))
+        with open(path, 'wb') as f:
+            f.write(BloomFilter.HEADER.pack(BloomFilter.MAGIC, m, k))
+            f.truncate(BloomFilter.HEADER.size + (m + 7) // 8)
+        LOG.info('Created Bloom filter {} ({} MiB, {} hash functions)'
+                 .format(path, m // 8 // 1024 // 1024, k))
+        return BloomFilter(path, writable=True)
+
+    def positions(self, fingerprints):
+        """Bit positions of fingerprints, one row of k positions per
+        fingerprint (double hashing)"""
+        h1 = numpy.asarray(fingerprints, dtype=numpy.uint64)
+        # second hash: splitmix64 finalizer of the fingerprint
+        h2 = h1 ^ (h1 >> numpy.uint64(30))
+        h2 *= numpy.uint64(0xbf58476d1ce4e5b9)
+        h2 ^= h2 >> numpy.uint64(27)
+        h2 *= numpy.uint64(0x94d049bb133111eb)
+        h2 ^= h2 >> numpy.uint64(31)
+        h2 |= numpy.uint64(1)
+        i = numpy.arange(self.k, dtype=numpy.uint64)
+        return (h1[:, None] + i * h2[:, None]) % numpy.uint64(self.m)
+
+    # max. number of fingerprints added at once (limits memory)
+    BATCH_SIZE = 1 << 20
+
+    def add_hashes(self, fingerprints):
+        if self.bits.mode != 'r+':
+            raise ValueError('Bloom filter not writable: {}'.format(
+                self.path))
+        for i in range(0, len(fingerprints), self.BATCH_SIZE):
+            positions = self.positions(
+                fingerprints[i:i+self.BATCH_SIZE]).ravel()
+            numpy.bitwise_or.at(
+                self.bits, (positions >> numpy.uint64(3)).astype(numpy.intp),
+                (numpy.uint8(1) << (positions & numpy.uint64(7)).astype(
+                    numpy.uint8)))
+
+    def contains_hashes(self, fingerprints):
+        """Boolean array, True for every fingerprint possibly added
+        before"""
+        if len(fingerprints) == 0:
+            return numpy.zeros(0, dtype=bool)
+        positions = self.positions(fingerprints)
+        bits = self.bits[(positions >> numpy.uint64(3)).astype(numpy.intp)]
+        bits >>= (positions & numpy.uint64(7)).astype(numpy.uint8)
+        return (bits & 1).all(axis=1)
+
+    def flush(self):
+        self.bits.flush()
+
+
+class SeenFilter:
+    """Bloom filters of URLs and digests of all crawls added"""
+
+    CRAWLS_FILE = 'crawls.json'
+
+    def __init__(self, path, writable=False):
+        self.path = path
+        self.filters = {}
+        for item_type in ITEM_TYPES:
+            self.filters[item_type] = BloomFilter(
+                self.filter_path(path, item_type), writable)
+        with open(os.path.join(path, self.CRAWLS_FILE)) as f:
+            self.crawls = json.load(f)
+
+    @staticmethod
+    def filter_path(path, item_type):
+        return os.path.join(path, item_type + '.bloom')
+
+    @staticmethod
+    def create(path, capacity, error_rate=.01):
+        os.makedirs(path, exist_ok=True)
+        for item_type in ITEM_TYPES:
+            BloomFilter.create(SeenFilter.filter_path(path, item_type),
+                               capacity, error_rate)
+        with open(os.path.join(path, SeenFilter.CRAWLS_FILE), 'w') as f:
+            json.dump([], f)
+        return SeenFilter(path, writable=True)
+
+    def contains(self, item_type, fingerprints):
+        return self.filters[item_type].contains_hashes(fingerprints)
+
+    def add(self, item_type, fingerprints):
+        self.filters[item_type].add_hashes(fingerprints)
+
+    def add_crawl(self, crawl, fingerprints):
+        """Add a crawl, fingerprints are given as iterator of
+        (item_type, array of fingerprints)"""
+        if crawl in self.crawls:
+            raise ValueError('Crawl {} already added'.format(crawl))
+        for item_type, values in fingerprints:
+            self.add(item_type, values)
+        for bloom in self.filters.values():
+            bloom.flush()
+        self.crawls.append(crawl)
+        with open(os.path.join(self.path, self.CRAWLS_FILE), 'w') as f:
+            json.dump(self.crawls, f)
+
+
+def cdx_files_fingerprints(cdx_files, processes=None):
+    # fingerprints as used in the fingerprint index
+    from crawlindex import cdx_fingerprints
+    with Pool(processes=processes) as pool:
+        for fingerprints in pool.imap_unordered(cdx_fingerprints,
+                                                cdx_files):
+            for item_type, values in zip(ITEM_TYPES, fingerprints):
+                yield item_type, values
+
+
+def index_fingerprints(index_path, crawl):
+    from crawlindex import FingerprintIndex, read_blocks
+    from crawlstats import CST
+    index = FingerprintIndex(index_path)
+    for item_type in ITEM_TYPES:
+        for block in read_blocks(index.file_path(crawl, CST[item_type])):
+            yield item_type, block
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Bloom filter of URLs and digests seen in earlier'
+        ' crawls')
+    parser.add_argument('--filter', required=True,
+                        help='Path to filter directory')
+    commands = parser.add_subparsers(dest='command', required=True)
+    create = commands.add_parser('create', help='Create an empty filter')
+    create.add_argument('--capacity', type=float, required=True,
+                        help='Max. number of items (URLs or digests)')
+    create.add_argument('--error-rate', type=float, default=.01,
+                        help='False-positive rate')
+    add = commands.add_parser('add', help='Add a finished crawl')
+    add.add_argument('--crawl', required=True, help='ID of the crawl')
+    add.add_argument('--index', default=None,
+                     help='Read fingerprints from index (crawlindex.py)'
+                     ' instead of cdx files')
+    add.add_argument('--processes', type=int, default=None,
+                     help='Number of worker processes (default: all CPUs)')
+    add.add_argument('input', nargs='*', help='cdx files or glob patterns')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s: [%(levelname)s]: %(message)s')
+    if args.command == 'create':
+        SeenFilter.create(args.filter, int(args.capacity), args.error_rate)
+    elif args.command == 'add':
+        from crawlstats import MonthlyCrawl
+        MonthlyCrawl.get_by_name(args.crawl)  # fail early if unknown
+        seen = SeenFilter(args.filter, writable=True)
+        if args.index is not None:
+            fingerprints = index_fingerprints(args.index, args.crawl)
+        else:
+            inputs = []
+            for pattern in args.input:
+                inputs.extend(sorted(glob.glob(pattern)) or [pattern])
+            fingerprints = cdx_files_fingerprints(inputs, args.processes)
+        seen.add_crawl(args.crawl, fingerprints)
+        LOG.info('Added {} to {}'.format(args.crawl, args.filter))
+
+
+if __name__ == '__main__':
+    main()
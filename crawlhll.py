@@ -0,0 +1,238 @@
+"""HyperLogLog with NumPy registers.
+
+NumpyHyperLogLog is compatible with hyperloglog.HyperLogLog: same hash
+function, same registers and cardinality estimates, same JSON
+serialization (see CrawlStatsJSONEncoder.json_encode_hyperloglog).
+The registers are held in a NumPy array of 8-bit integers, so that batch
+updates, merges and the cardinality estimation are vectorized.
+"""
+
+import math
+import struct
+
+from hashlib import sha1
+
+import numpy
+
+from hyperloglog import HyperLogLog
+from hyperloglog.hll import estimate_bias, get_alpha, get_treshold
+
+
+def hll_hash(value):
+    """64-bit hash of a string as calculated by HyperLogLog.add(value),
+    also used as fingerprint of URLs and content digests"""
+    return struct.unpack('!Q', sha1(value.encode('utf-8')).digest()[:8])[0]
+
+
+def hll_add_hash(hll, x):
+    """Add an item to a HyperLogLog given the 64-bit hash of the item,
+    equivalent to hll.add(value) if x == hll_hash(value)"""
+    j = x & (hll.m - 1)
+    w = x >> hll.p
+    rho = 64 - hll.p - w.bit_length() + 1
+    if rho > hll.M[j]:
+        hll.M[j] = rho
+
+
+def bit_length(w):
+    """Vectorized int.bit_length() for an array of unsigned 64-bit ints"""
+    n = numpy.zeros(len(w), dtype=numpy.uint8)
+    w = w.copy()
+    for shift in (32, 16, 8, 4, 2, 1):
+        high = w >> numpy.uint64(shift)
+        nonzero = high != 0
+        n[nonzero] += shift
+        w[nonzero] = high[nonzero]
+    n += (w != 0)
+    return n
+
+
+def pack_registers(M):
+    """Pack registers (values < 64) into 6 bits each, 4 registers
+    into 3 bytes. The number of registers must be a multiple of 4."""
+    r = numpy.asarray(M, dtype=numpy.uint32).reshape(-1, 4)
+    v = (r[:, 0] << 18) | (r[:, 1] << 12) | (r[:, 2] << 6) | r[:, 3]
+    packed = numpy.empty((len(v), 3), dtype=numpy.uint8)
+    packed[:, 0] = v >> 16
+    packed[:, 1] = (v >> 8) & 0xff
+    packed[:, 2] = v & 0xff
+    return packed.tobytes()
+
+
+def unpack_registers(data):
+    """Unpack registers packed by pack_registers"""
+    packed = numpy.frombuffer(data, dtype=numpy.uint8).reshape(-1, 3)
+    packed = packed.astype(numpy.uint32)
+    v = (packed[:, 0] << 16) | (packed[:, 1] << 8) | packed[:, 2]
+    M = numpy.empty((len(v), 4), dtype=numpy.uint8)
+    M[:, 0] = v >> 18
+    M[:, 1] = (v >> 12) & 0x3f
+    M[:, 2] = (v >> 6) & 0x3f
+    M[:, 3] = v & 0x3f
+    return M.reshape(-1)
+
+
+class NumpyHyperLogLog(HyperLogLog):
+    """HyperLogLog cardinality counter with NumPy registers"""
+
+    __slots__ = ()
+
+    def __init__(self, error_rate):
+        super(NumpyHyperLogLog, self).__init__(error_rate)
+        self.M = numpy.zeros(self.m, dtype=numpy.uint8)
+
+    @staticmethod
+    def from_hyperloglog(hll):
+        """Convert a HyperLogLog (registers in a list) into
+        a NumpyHyperLogLog"""
+        if isinstance(hll, NumpyHyperLogLog):
+            return hll
+        res = NumpyHyperLogLog.__new__(NumpyHyperLogLog)
+        res.p = hll.p
+        res.m = hll.m
+        res.alpha = hll.alpha
+        res.M = numpy.array(hll.M, dtype=numpy.uint8)
+        return res
+
+    def __getstate__(self):
+        # registers as list, readable by jsonpickle and HyperLogLog
+        return {'alpha': self.alpha, 'p': self.p, 'm': self.m,
+                'M': self.M.tolist()}
+
+    def __setstate__(self, d):
+        for key in d:
+            setattr(self, key, d[key])
+        self.M = numpy.asarray(self.M, dtype=numpy.uint8)
+
+    def add(self, value):
+        hll_add_hash(self, hll_hash(value))
+
+    def add_many(self, values):
+        """Add multiple items (strings)"""
+        hashes = numpy.fromiter(map(hll_hash, values), dtype=numpy.uint64)
+        self.add_hashes(hashes)
+
+    def add_hashes(self, hashes):
+        """Add multiple items given as array of 64-bit hashes
+        (see hll_hash)"""
+        hashes = numpy.asarray(hashes, dtype=numpy.uint64)
+        if len(hashes) == 0:
+            return
+        j = (hashes & numpy.uint64(self.m - 1)).astype(numpy.intp)
+        w = hashes >> numpy.uint64(self.p)
+        rho = (64 - self.p + 1) - bit_length(w)
+        numpy.maximum.at(self.M, j, rho)
+
+    def update(self, *others):
+        for item in others:
+            if self.m != item.m:
+                raise ValueError('Counters precisions should be equal')
+        for item in others:
+            numpy.maximum(self.M, numpy.asarray(item.M, dtype=numpy.uint8),
+                          out=self.M)
+
+    def __eq__(self, other):
+        if self.m != other.m:
+            raise ValueError('Counters precisions should be equal')
+        return numpy.array_equal(self.M, other.M)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def _Ep(self):
+        E = self.alpha * float(self.m ** 2) / float(
+            numpy.ldexp(1.0, -self.M.astype(numpy.int32)).sum())
+        return (E - estimate_bias(E, self.p)) if E <= 5 * self.m else E
+
+    def card(self):
+        V = int(numpy.count_nonzero(self.M == 0))
+        if V > 0:
+            H = self.m * math.log(self.m / float(V))
+            return H if H <= get_treshold(self.p) else self._Ep()
+        return self._Ep()
+
+
+def cardinalities(registers):
+    """Cardinality estimates of HyperLogLogs given as 2-dimensional
+    array, one row of registers per HyperLogLog. Same estimates as
+    HyperLogLog.card() but vectorized over all rows."""
+    registers = numpy.asarray(registers)
+    m = registers.shape[1]
+    p = m.bit_length() - 1
+    alpha = get_alpha(p)
+    E = alpha * float(m ** 2) / numpy.ldexp(
+        1.0, -registers.astype(numpy.int32)).sum(axis=1)
+    res = E.copy()
+    for i in numpy.flatnonzero(E <= 5 * m):
+        res[i] = E[i] - estimate_bias(float(E[i]), p)
+    V = numpy.count_nonzero(registers == 0, axis=1)
+    linear = V > 0
+    H = m * numpy.log(m / numpy.maximum(V, 1))
+    linear &= H <= get_treshold(p)
+    res[linear] = H[linear]
+    return res
+
+
+def union_cardinalities(row, registers):
+    """Cardinality estimates of the unions of one HyperLogLog (registers
+    given as row) with each of multiple HyperLogLogs (2-dimensional array
+    of registers)"""
+    return cardinalities(numpy.maximum(row, registers))
+
+
+class SlidingWindowUnion:
+    """Union of the registers of the last `size` HyperLogLogs pushed,
+    maintained as a two-stack queue: pushed registers are merged into
+    the back aggregate, the front stack holds the unions of the oldest
+    registers (suffix unions, the top is the union of all registers in
+    the front). The front stack is refilled from the back items when it
+    runs empty, so that every push needs only a few merges (amortized).
+    """
+
+    def __init__(self, size, m):
+        self.size = size
+        self.front = []
+        self.back = []
+        self.back_union = numpy.zeros(m, dtype=numpy.uint8)
+
+    def __len__(self):
+        return len(self.front) + len(self.back)
+
+    def push(self, registers):
+        self.back.append(numpy.asarray(registers, dtype=numpy.uint8))
+        numpy.maximum(self.back_union, registers, out=self.back_union)
+        if len(self) > self.size:
+            self.pop()
+
+    def pop(self):
+        if not self.front:
+            union = numpy.zeros_like(self.back_union)
+            for registers in reversed(self.back):
+                union = numpy.maximum(union, registers)
+                self.front.append(union)
+            self.back = []
+            self.back_union[:] = 0
+        self.front.pop()
+
+    def union(self):
+        if not self.front:
+            return self.back_union.copy()
+        return numpy.maximum(self.front[-1], self.back_union)
+
+    def get_state(self):
+        """State as dictionary of arrays"""
+        m = len(self.back_union)
+        return {'front': numpy.array(self.front, dtype=numpy.uint8)
+                .reshape(-1, m),
+                'back': numpy.array(self.back, dtype=numpy.uint8)
+                .reshape(-1, m),
+                'back_union': self.back_union}
+
+    @staticmethod
+    def from_state(size, state):
+        window = SlidingWindowUnion(size, len(state['back_union']))
+        window.front = list(state['front'])
+        window.back = list(state['back'])
+        window.back_union = numpy.array(state['back_union'],
+                                        dtype=numpy.uint8)
+        return window
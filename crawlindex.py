@@ -0,0 +1,358 @@
+"""Persistent index of URL and content digest fingerprints per crawl.
+
+For every crawl the 64-bit fingerprints (see crawlhll.hll_hash) of all
+unique URLs and content digests of successfully fetched pages (same
+items as counted by the count job with --exact-counts) are kept sorted
+in one file per item type:
+  <index>/<crawl>/url.fpi
+  <index>/<crawl>/digest.fpi
+The files are sequences of blocks, every block holds up to 4096
+fingerprints, delta-encoded and bit-packed: the first fingerprint and
+the number of bits of the largest delta are stored in the block header.
+
+The number of new items of a crawl (not seen in any earlier crawl) and
+the exact overlap between two crawls are computed by a streaming
+merge-join of the sorted fingerprints, without processing the cdx files
+of earlier crawls again. Usage:
+  python3 crawlindex.py --index fpindex/ add --crawl CC-MAIN-2016-26 \\
+      --processes 8 cdx-*.gz
+  python3 crawlindex.py --index fpindex/ new-items CC-MAIN-2016-26
+  python3 crawlindex.py --index fpindex/ overlap CC-MAIN-2016-26 \\
+      CC-MAIN-2016-22
+The output of "new-items" is in the format of the stats job output.
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import shutil
+import struct
+import tempfile
+
+from array import array
+from multiprocessing import Pool
+
+import numpy
+import ujson
+
+from crawlhll import hll_hash
+from crawlstats import CST, CdxParser, MonthlyCrawl, SurtDomainCount
+
+
+LOG = logging.getLogger('CrawlFingerprintIndex')
+
+ITEM_TYPES = (CST.url, CST.digest)
+
+# block header: first fingerprint, number of fingerprints, bits per delta
+BLOCK_HEADER = struct.Struct('<QIB')
+
+
+def encode_block(values):
+    """Encode a sorted array of unique 64-bit integers: header (first
+    value, number of values, bits per delta) and bit-packed deltas"""
+    values = numpy.asarray(values, dtype=numpy.uint64)
+    deltas = numpy.diff(values)
+    width = 0
+    if len(deltas) > 0:
+        width = int(deltas.max()).bit_length()
+    header = BLOCK_HEADER.pack(int(values[0]), len(values), width)
+    if width == 0:
+        return header
+    bits = (deltas[:, None] >> numpy.arange(width, dtype=numpy.uint64)) \
+        & numpy.uint64(1)
+    return header + numpy.packbits(bits.astype(numpy.uint8),
+                                   bitorder='little').tobytes()
+
+
+def decode_block(header, data):
+    first, n, width = header
+    values = numpy.empty(n, dtype=numpy.uint64)
+    values[0] = first
+    if n > 1:
+        bits = numpy.unpackbits(numpy.frombuffer(data, dtype=numpy.uint8),
+                                count=(n-1)*width, bitorder='little')
+        bits = bits.reshape(n-1, width).astype(numpy.uint64)
+        deltas = (bits << numpy.arange(width, dtype=numpy.uint64)).sum(
+            axis=1, dtype=numpy.uint64)
+        numpy.cumsum(deltas, out=values[1:])
+        values[1:] += numpy.uint64(first)
+    return values
+
+
+def packed_size(n, width):
+    return ((n - 1) * width + 7) // 8
+
+
+class FingerprintWriter:
+    """Write sorted unique fingerprints into a file of encoded blocks"""
+
+    BLOCK_SIZE = 4096
+
+    def __init__(self, path):
+        self.path = path
+        self.stream = open(path + '.tmp', 'wb')
+        self.buffer = numpy.empty(0, dtype=numpy.uint64)
+        self.count = 0
+
+    def write(self, values):
+        """Add sorted fingerprints, all larger than those written
+        before"""
+        self.buffer = numpy.concatenate(
+            (self.buffer, numpy.asarray(values, dtype=numpy.uint64)))
+        while len(self.buffer) >= self.BLOCK_SIZE:
+            self.write_block(self.buffer[:self.BLOCK_SIZE])
+            self.buffer = self.buffer[self.BLOCK_SIZE:]
+
+    def write_block(self, values):
+        self.stream.write(encode_block(values))
+        self.count += len(values)
+
+    def close(self):
+        if len(self.buffer) > 0:
+            self.write_block(self.buffer)
+        self.stream.close()
+        os.replace(self.path + '.tmp', self.path)
+
+
+def read_blocks(path):
+    """Iterate over the blocks (arrays of fingerprints) of a file"""
+    with open(path, 'rb') as stream:
+        while True:
+            header = stream.read(BLOCK_HEADER.size)
+            if not header:
+                break
+            header = BLOCK_HEADER.unpack(header)
+            data = stream.read(packed_size(header[1], header[2]))
+            yield decode_block(header, data)
+
+
+class SortedStream:
+    """Sorted fingerprints read block by block"""
+
+    def __init__(self, blocks):
+        self.blocks = iter(blocks)
+        self.buffer = numpy.empty(0, dtype=numpy.uint64)
+        self.exhausted = False
+        self.fill()
+
+    def fill(self):
+        while len(self.buffer) == 0 and not self.exhausted:
+            block = next(self.blocks, None)
+            if block is None:
+                self.exhausted = True
+            else:
+                self.buffer = block
+
+    def last(self):
+        """Largest fingerprint in the buffer, None if exhausted"""
+        if len(self.buffer) == 0:
+            return None
+        return self.buffer[-1]
+
+    def take_until(self, value):
+        """Remove and return all fingerprints <= value"""
+        parts = []
+        while len(self.buffer) > 0:
+            i = numpy.searchsorted(self.buffer, value, side='right')
+            parts.append(self.buffer[:i])
+            self.buffer = self.buffer[i:]
+            if len(self.buffer) > 0:
+                break
+            self.fill()
+        if len(parts) == 1:
+            return parts[0]
+        return numpy.concatenate(parts or [self.buffer[:0]])
+
+
+def merge_unique(streams):
+    """Merge sorted streams into blocks of sorted unique fingerprints"""
+    streams = [s for s in streams if s.last() is not None]
+    while streams:
+        threshold = min(s.last() for s in streams)
+        merged = numpy.unique(numpy.concatenate(
+            [s.take_until(threshold) for s in streams]))
+        if len(merged) > 0:
+            yield merged
+        streams = [s for s in streams if s.last() is not None]
+
+
+def count_joined(blocks, others):
+    """Count fingerprints (given as blocks) and how many of them are
+    contained in any of the other sorted streams"""
+    total = 0
+    found = 0
+    for block in blocks:
+        seen = numpy.zeros(len(block), dtype=bool)
+        for other in others:
+            candidates = other.take_until(block[-1])
+            if len(candidates) == 0:
+                continue
+            i = numpy.searchsorted(candidates, block)
+            i[i == len(candidates)] = 0
+            seen |= candidates[i] == block
+        total += len(block)
+        found += int(numpy.count_nonzero(seen))
+    return total, found
+
+
+def cdx_fingerprints(cdx_path):
+    """Sorted unique fingerprints of URLs and content digests of
+    successfully fetched pages in one cdx file"""
+    # unboxed 64-bit integers (8 bytes per fingerprint)
+    urls = array('Q')
+    digests = array('Q')
+    robotstxt = SurtDomainCount.robots_txt_warc_pattern
+    with open(cdx_path, 'rb') as cdx:
+        for line in CdxParser.read_lines(cdx):
+            _, _, json_string = CdxParser.split_line(line.decode('utf-8'))
+            try:
+                metadata = ujson.loads(json_string)
+            except ValueError as e:
+                LOG.error('Failed to parse json: {0} - {1}'.format(
+                    e, json_string))
+                continue
+            if metadata.get('status') != '200':
+                continue
+            if robotstxt.search(metadata['filename']):
+                continue
+            urls.append(hll_hash(metadata['url']))
+            if 'digest' in metadata:
+                digests.append(hll_hash(metadata['digest']))
+    return sorted_unique(urls), sorted_unique(digests)
+
+
+def sorted_unique(values):
+    """Sort an array('Q') of fingerprints in place and return the unique
+    fingerprints, without a copy of all fingerprints"""
+    values = numpy.frombuffer(values, dtype=numpy.uint64)
+    values.sort()
+    unique = numpy.empty(len(values), dtype=bool)
+    unique[:1] = True
+    numpy.not_equal(values[1:], values[:-1], out=unique[1:])
+    return values[unique]
+
+
+def _fingerprint_task(task):
+    cdx_path, run_dir, task_id = task
+    LOG.info('Reading {}'.format(cdx_path))
+    runs = []
+    for item_type, values in zip(ITEM_TYPES, cdx_fingerprints(cdx_path)):
+        path = os.path.join(run_dir, '{}-{:05d}.fpi'.format(
+            item_type.name, task_id))
+        writer = FingerprintWriter(path)
+        writer.write(values)
+        writer.close()
+        runs.append(path)
+    return runs
+
+
+class FingerprintIndex:
+    """Directory of fingerprint files, one subdirectory per crawl"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def file_path(self, crawl, item_type):
+        return os.path.join(self.path, crawl, item_type.name + '.fpi')
+
+    def crawls(self):
+        """Crawls in the index, ordered by date (oldest first). Crawl IDs
+        are not chronological: crawls before CC-MAIN-2014-52 have the
+        IDs 88-99."""
+        if not os.path.isdir(self.path):
+            return []
+        return sorted((d for d in os.listdir(self.path)
+                       if d in MonthlyCrawl.by_name),
+                      key=MonthlyCrawl.date_of)
+
+    def add_crawl(self, crawl, cdx_files, processes=None, tmp_dir=None):
+        """Fingerprint the cdx files of one crawl and add the crawl to the
+        index (replacing it if already present)"""
+        MonthlyCrawl.get_by_name(crawl)  # fail early if unknown
+        run_dir = tempfile.mkdtemp(prefix='crawlindex-', dir=tmp_dir)
+        try:
+            tasks = [(path, run_dir, i) for i, path in enumerate(cdx_files)]
+            with Pool(processes=processes) as pool:
+                runs = pool.map(_fingerprint_task, tasks)
+            os.makedirs(os.path.join(self.path, crawl), exist_ok=True)
+            counts = {}
+            for i, item_type in enumerate(ITEM_TYPES):
+                writer = FingerprintWriter(self.file_path(crawl, item_type))
+                for block in merge_unique(
+                        [SortedStream(read_blocks(r[i])) for r in runs]):
+                    writer.write(block)
+                writer.close()
+                counts[item_type.name] = writer.count
+            LOG.info('Added {} to index: {}'.format(crawl, counts))
+            return counts
+        finally:
+            shutil.rmtree(run_dir, ignore_errors=True)
+
+    def stream(self, crawl, item_type):
+        return SortedStream(read_blocks(self.file_path(crawl, item_type)))
+
+    def new_items(self, crawl, item_type):
+        """Number of items of a crawl not seen in any earlier crawl of the
+        index"""
+        earlier = [c for c in self.crawls()
+                   if MonthlyCrawl.date_of(c) < MonthlyCrawl.date_of(crawl)]
+        others = [self.stream(c, item_type) for c in earlier]
+        total, seen = count_joined(
+            read_blocks(self.file_path(crawl, item_type)), others)
+        return total - seen
+
+    def overlap(self, crawl1, crawl2, item_type):
+        """Number of items contained in both crawls"""
+        _, found = count_joined(
+            read_blocks(self.file_path(crawl1, item_type)),
+            [self.stream(crawl2, item_type)])
+        return found
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Index of URL and digest fingerprints per crawl')
+    parser.add_argument('--index', required=True,
+                        help='Path to index directory')
+    commands = parser.add_subparsers(dest='command', required=True)
+    add = commands.add_parser('add', help='Add a crawl to the index')
+    add.add_argument('--crawl', required=True, help='ID of the crawl')
+    add.add_argument('--processes', type=int, default=None,
+                     help='Number of worker processes (default: all CPUs)')
+    add.add_argument('--tmp-dir', default=None,
+                     help='Directory for temporary files')
+    add.add_argument('input', nargs='+', help='cdx files or glob patterns')
+    new_items = commands.add_parser(
+        'new-items', help='Count new items of crawls, output in the format'
+        ' of the stats job')
+    new_items.add_argument('crawl', nargs='+', help='ID of the crawl')
+    overlap = commands.add_parser(
+        'overlap', help='Count items contained in both crawls')
+    overlap.add_argument('crawl1')
+    overlap.add_argument('crawl2')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s: [%(levelname)s]: %(message)s')
+    index = FingerprintIndex(args.index)
+    if args.command == 'add':
+        inputs = []
+        for pattern in args.input:
+            inputs.extend(sorted(glob.glob(pattern)) or [pattern])
+        index.add_crawl(args.crawl, inputs, processes=args.processes,
+                        tmp_dir=args.tmp_dir)
+    elif args.command == 'new-items':
+        for crawl in args.crawl:
+            for item_type in ITEM_TYPES:
+                key = [CST.new_items.name, item_type.name, crawl]
+                print('{}\t{}'.format(json.dumps(key),
+                                      index.new_items(crawl, item_type)))
+    elif args.command == 'overlap':
+        for item_type in ITEM_TYPES:
+            print('{}\t{}'.format(item_type.name, index.overlap(
+                args.crawl1, args.crawl2, item_type)))
+
+
+if __name__ == '__main__':
+    main()
@@ -54,6 +54,12 @@ class CrawlPlot:
     GGPLOT2_THEME = None
     GGPLOT2_THEME_KWARGS = None
 
+    # types of statistics (CST) read by the plot from the columnar store
+    # (None: all types)
+    CST_TYPES = None
+    # read also stdin if reading from the store (data not in the store)
+    READ_STDIN_WITH_STORE = False
+
     # figure with square aspect ratio : 7 inches * 300 DPI = 2100 pixels
     DEFAULT_FIGSIZE = 7
     DEFAULT_DPI = 300
@@ -273,36 +279,82 @@ class CrawlPlot:
         """Read statistics data from a file argument or stdin.
 
         If a file path is provided as the first command line argument,
-        reads from that file (supports gzip compression). Otherwise,
-        reads from stdin.
+        reads from that file (gzip, bzip2 or zstd compression detected
+        by file name extension). Otherwise,
+        reads from stdin. If the environment variable STATSSTORE
+        points to a columnar store (see crawlstore.py), the data is read
+        from the store instead.
         """
+        store_path = os.environ.get('STATSSTORE')
+        if store_path:
+            # columnar store, see crawlstore.py
+            self.read_from_store(store_path)
+            if self.READ_STDIN_WITH_STORE:
+                self.read_data(sys.stdin)
+            return
         if len(sys.argv) > 1:
             # File provided as argument
             fp = sys.argv[1]
-            compression = ("gzip" if fp.endswith(".gz") else None)
 
-            with fsspec.open(fp, 'r', compression=compression) as f:
+            with fsspec.open(fp, 'r', compression='infer') as f:
                 self.read_data(f)
         else:
             # No argument, use stdin
             self.read_data(sys.stdin)
 
+    def read_from_store(self, store_path, crawls=None):
+        """Read statistics data from a columnar store (see crawlstore.py),
+        only the types listed in CST_TYPES and the given crawls.
+
+        Args:
+            store_path: Path to the store directory
+            crawls: List of crawls to read (default: all crawls)
+        """
+        from crawlstore import StatsStore
+        store = StatsStore(store_path)
+        for key, val in store.records(self.CST_TYPES, crawls):
+            self.add(key, val)
+
     def read_data(self, stream):
         """Parse tab-separated JSON key-value pairs from a stream.
 
         Args:
             stream: Input stream containing lines of tab-separated JSON data.
                    Each line should have format: JSON_KEY<tab>JSON_VALUE
+                   Compact keys (crawlstats.py --compact-keys) are decoded
+                   by decode_compact_key.
         """
         for line in stream:
             keyval = line.split('\t')
             if len(keyval) == 2:
-                key = json.loads(keyval[0])
+                if keyval[0].startswith('['):
+                    key = json.loads(keyval[0])
+                else:
+                    key = self.decode_compact_key(keyval[0])
                 val = json.loads(keyval[1])
                 self.add(key, val)
             else:
                 logging.error("Not a key-value pair: {}".find(line))
 
+    @staticmethod
+    def decode_compact_key(raw_key):
+        """Decode a compact key (see crawlstats.CompactKeyProtocol).
+
+        Args:
+            raw_key: Key in compact format, e.g. "0200e:www.example.com"
+
+        Returns:
+            Key as list, the type and the crawl given by name, e.g.
+            ["host", "www.example.com", "CC-MAIN-2016-26"]
+        """
+        from crawlstats import CST, CompactKeyProtocol, MonthlyCrawl
+        key = CompactKeyProtocol.decode_key(raw_key.encode('utf-8'))
+        i = CompactKeyProtocol.crawl_index(key[0], len(key))
+        if i is not None:
+            key[i] = MonthlyCrawl.to_name(key[i])
+        key[0] = CST(key[0]).name
+        return key
+
     def line_plot_with_ggplot(
         self,
         data,
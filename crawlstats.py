@@ -1,29 +1,64 @@
+import atexit
+import base64
+import glob
+import gzip
+import hashlib
 import heapq
+import itertools
 import json
 import logging
 import os
 import re
+import shutil
+import sys
+import tempfile
+import zlib
 
+from array import array
 from collections import defaultdict, Counter
 from datetime import date
 from enum import Enum
+from time import perf_counter
 from urllib.parse import urlparse
 
 import mrjob.util
-import tldextract
+import numpy
 import ujson
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from crawlbloom import SeenFilter
+from crawlhll import NumpyHyperLogLog, hll_hash
+from crawlhll import pack_registers, unpack_registers
 from hyperloglog import HyperLogLog
+from hyperloglog.hll import get_alpha
 from isoweek import Week
 from mrjob.job import MRJob, MRStep
 from mrjob.protocol import JSONProtocol, RawValueProtocol
+from public_suffix import PublicSuffixResolver
 
 
 HYPERLOGLOG_ERROR = .01
 
+# type of serialized HyperLogLogs: registers as list or packed
+HLL_TYPE = 'HyperLogLog'
+HLL_PACKED_TYPE = 'HyperLogLog/2'
+
 # threshold when to add a HyperLogLog for SURT domains
 MIN_SURT_HLL_SIZE = 50000
 
+# compression codecs of the job output: Hadoop codec class and extension
+# of the output files
+OUTPUT_CODECS = {
+    'gzip': ('org.apache.hadoop.io.compress.GzipCodec', '.gz'),
+    'bzip2': ('org.apache.hadoop.io.compress.BZip2Codec', '.bz2'),
+    'zstd': ('org.apache.hadoop.io.compress.ZStandardCodec', '.zst'),
+    'none': (None, ''),
+}
+
 LOGGING_FORMAT = '%(asctime)s: [%(levelname)s]: %(message)s'
 LOGGING_LEVEL = logging.INFO
 LOG = logging.getLogger('CCStatsJob')
@@ -363,15 +398,33 @@ class CST(Enum):
      <<size_estimate_for, per_item_type, per_item, item_type, crawl>, hll>"""
     size_robotstxt = 93
     """number of robots.txt fetches"""
+    new_items_for = 94
+    """new items (URLs, content digests) per TLD or SURT domain
+    - only with --seen-filter, see new_items
+    - digests are unique per SURT domain, the counts per TLD are sums
+      over SURT domains
+    format:
+     <<new_items_for, per_item_type, per_item, item_type, crawl>, count>"""
     new_items = 95
     """new items (URLs, content digests) for a given crawl
     - first seen in this crawl, not observed in previous crawls
     - only with exact counts for all crawls
-    - could be estimated by HyperLogLog set operations otherwise"""
+    - could be estimated by HyperLogLog set operations otherwise
+    - new URLs are counted approximately (Bloom filter of URLs of previous
+      crawls, see crawlbloom.py) with --seen-filter"""
     histogram = 96
     """frequency of item counts per page or URL
     format:
       <<type, item_type, crawl, counted_per, count>, frequency>"""
+    top_estimate = 97
+    """most frequent hosts, domains and SURT domains by number of pages
+    - estimated by Space-Saving sketches (see SpaceSaving) in the count
+      job with --top-estimate-size, the true page count of an item lies
+      in [pages - error, pages]
+    format (count job, see SpaceSaving.to_json):
+      <<top_estimate, item_type, crawl>, [capacity, floor, items]>
+    format (stats job, items limited by --max-top-hosts-domains):
+      <<top_estimate, item_type, crawl>, [[item, pages, error], ...]>"""
 
 
 class MultiCount(defaultdict):
@@ -434,6 +487,63 @@ class MultiCount(defaultdict):
         else:
             return counts
 
+    # min. number of values summed by numpy in sum_values_batched, fewer
+    # values are summed faster by sum_values
+    MIN_BATCH_SIZE = 128
+
+    # max. number of compressed lists decoded into matrices at once
+    MAX_BATCH_SIZE = 1 << 16
+
+    @staticmethod
+    def sum_values_batched(values, compress=True):
+        """Same as sum_values, but vectorized for keys with many values:
+        compressed lists are decoded in batches into int64 matrices (one
+        per list length) and summed per column by numpy. Shorter lists,
+        compressed integers and column sums are padded by their last
+        count, same as in sum_values."""
+        values = iter(values)
+        head = list(itertools.islice(values, MultiCount.MIN_BATCH_SIZE))
+        if len(head) < MultiCount.MIN_BATCH_SIZE:
+            return MultiCount.sum_values(head, compress)
+        counts = numpy.zeros(1, dtype=numpy.int64)
+        int_sum = 0
+        rows = defaultdict(list)
+        batched = 0
+        for val in itertools.chain(head, values):
+            if isinstance(val, int):
+                int_sum += val
+                continue
+            rows[len(val)].append(val)
+            batched += 1
+            if batched == MultiCount.MAX_BATCH_SIZE:
+                counts = MultiCount.add_columns(counts, rows)
+                rows.clear()
+                batched = 0
+        counts = MultiCount.add_columns(counts, rows)
+        counts += int_sum
+        size = len(counts)
+        counts = counts.tolist()
+        if compress:
+            return MultiCount.compress(size, counts)
+        return counts
+
+    @staticmethod
+    def add_columns(counts, rows):
+        """Add column sums of compressed lists (grouped by length) to the
+        counts (numpy array), padded to the length of the longest list"""
+        size = max(max(rows, default=0), len(counts))
+        if size > len(counts):
+            counts = numpy.concatenate((counts, numpy.full(
+                size - len(counts), counts[-1], dtype=numpy.int64)))
+        for length, lists in rows.items():
+            matrix = numpy.fromiter(itertools.chain.from_iterable(lists),
+                                    dtype=numpy.int64,
+                                    count=len(lists)*length)
+            sums = matrix.reshape(len(lists), length).sum(axis=0)
+            counts[:length] += sums
+            counts[length:] += sums[-1]
+        return counts
+
 
 class CrawlStatsJSONEncoder(json.JSONEncoder):
 
@@ -445,10 +555,32 @@ class CrawlStatsJSONEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, o)
 
     @staticmethod
-    def json_encode_hyperloglog(o):
-        return {'__type__': 'HyperLogLog',
-                'card': o.card(),
-                'p': o.p, 'M': o.M, 'm': o.m, 'alpha': o.alpha}
+    def json_encode_hyperloglog(o, encoding='list'):
+        """Encode a HyperLogLog as dictionary. The registers are stored
+        - as list of integers (encoding='list', default)
+        - as base64-encoded string of registers packed into 6 bits
+          (encoding='packed')
+        - same but additionally compressed by zlib ('packed-zlib')
+        """
+        if encoding == 'list':
+            M = o.M
+            if isinstance(o, NumpyHyperLogLog):
+                M = M.tolist()
+            return {'__type__': HLL_TYPE,
+                    'card': o.card(),
+                    'p': o.p, 'M': M, 'm': o.m, 'alpha': o.alpha}
+        packed = pack_registers(o.M)
+        res = {'__type__': HLL_PACKED_TYPE,
+               'card': o.card(),
+               'p': o.p}
+        if encoding == 'packed-zlib':
+            packed = zlib.compress(packed)
+            res['codec'] = 'zlib'
+        elif encoding != 'packed':
+            raise ValueError(
+                'Unknown HyperLogLog encoding: {}'.format(encoding))
+        res['M'] = base64.b64encode(packed).decode('ascii')
+        return res
 
 
 class CrawlStatsJSONDecoder(json.JSONDecoder):
@@ -460,7 +592,7 @@ class CrawlStatsJSONDecoder(json.JSONDecoder):
     def dict_to_object(self, dic):
         if '__type__' not in dic:
             return dic
-        if dic['__type__'] == 'HyperLogLog':
+        if dic['__type__'] in (HLL_TYPE, HLL_PACKED_TYPE):
             try:
                 return CrawlStatsJSONDecoder.json_decode_hyperloglog(dic)
             except Exception as e:
@@ -471,54 +603,267 @@ class CrawlStatsJSONDecoder(json.JSONDecoder):
 
     @staticmethod
     def json_decode_hyperloglog(dic):
-        hll = HyperLogLog(HYPERLOGLOG_ERROR)
-        hll.p = dic['p']
-        hll.m = dic['m']
-        hll.alpha = dic['alpha']
-        hll.M = dic['M']
+        """Decode a HyperLogLog from a dictionary, registers either
+        as list or packed (see json_encode_hyperloglog)"""
+        hll = NumpyHyperLogLog.__new__(NumpyHyperLogLog)
+        if dic['__type__'] == HLL_PACKED_TYPE:
+            packed = base64.b64decode(dic['M'])
+            if dic.get('codec') == 'zlib':
+                packed = zlib.decompress(packed)
+            p = dic['p']
+            hll.__setstate__({'p': p, 'm': 1 << p, 'alpha': get_alpha(p),
+                              'M': unpack_registers(packed)})
+            return hll
+        hll.__setstate__({'p': dic['p'], 'm': dic['m'],
+                          'alpha': dic['alpha'], 'M': dic['M']})
         return hll
 
 
+class FastJSONProtocol:
+    """JSON protocol (key and value separated by a tab) using orjson,
+    byte-compatible with mrjob's JSONProtocol (ujson): forward slashes
+    are escaped, and values which orjson would encode differently
+    (non-ASCII characters, floats with exponent or smaller than 1e-4,
+    infinity and NaN) or cannot encode (e.g. integers larger than 64 bit)
+    are encoded by ujson. Lines with integers which may not fit into 64
+    bit (decoded as float by orjson) are decoded by ujson. The last
+    decoded key is cached, same as JSONProtocol does. Requires the module
+    orjson."""
+
+    # floats orjson encodes differently than ujson (may also match
+    # strings, these are then encoded by ujson as well):
+    #   1e16    (orjson) vs. 1e+16    (ujson)
+    #   0.00001 (orjson) vs. 1e-5     (ujson)
+    #   null    (orjson) vs. Infinity (ujson), also -Infinity and NaN
+    ujson_float_pattern = re.compile(rb'\de\d|0\.0000|null')
+    # 19 digits or more: integer may be outside the 64-bit range
+    long_integer_pattern = re.compile(rb'\d{19}')
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError('FastJSONProtocol requires the module orjson')
+        self.last_key_encoded = None
+        self.last_key_decoded = None
+
+    @staticmethod
+    def loads(data):
+        if FastJSONProtocol.long_integer_pattern.search(data):
+            return ujson.loads(data)
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            return ujson.loads(data)
+
+    @staticmethod
+    def dumps(value):
+        try:
+            data = orjson.dumps(value)
+        except TypeError:
+            data = None
+        if (data is None or not data.isascii()
+                or FastJSONProtocol.ujson_float_pattern.search(data)):
+            return FastJSONProtocol.ujson_dumps(value)
+        return data.replace(b'/', b'\\/')
+
+    @staticmethod
+    def ujson_dumps(value):
+        return ujson.dumps(value).encode('utf-8')
+
+    def read(self, line):
+        raw_key, raw_value = line.split(b'\t', 1)
+        if raw_key != self.last_key_encoded:
+            self.last_key_encoded = raw_key
+            self.last_key_decoded = self.loads(raw_key)
+        return self.last_key_decoded, self.loads(raw_value)
+
+    def write(self, key, value):
+        try:
+            line = orjson.dumps(key) + b'\t' + orjson.dumps(value)
+        except TypeError:
+            line = None
+        if (line is None or not line.isascii()
+                or self.ujson_float_pattern.search(line)):
+            return self.ujson_dumps(key) + b'\t' + self.ujson_dumps(value)
+        return line.replace(b'/', b'\\/')
+
+
+class CompactKeyProtocol:
+    """Protocol with compact keys, values are JSON-encoded. Instead of a
+    JSON list ([2,"www.example.com",14]) the key consists of a fixed-width
+    prefix holding the type (2 hex digits) and the crawl (3 hex digits,
+    omitted for types without crawl in the key), followed by the remaining
+    key elements, either strings (":" and the JSON-escaped strings without
+    quotes, separated by the ASCII unit separator \\x1f) or a JSON list:
+      [2,"www.example.com",14]          -> 0200e:www.example.com
+      [0,"com,example","http://..."]    -> 00:com,example\\x1fhttp:\\/\\/...
+      [92,5,"com,example",0,14]         -> 5c00e[5,"com,example",0]
+      [96,0,14,8,1]                     -> 6000e[0,8,1]
+    Keys stay text without tabs or line breaks, i.e. the (whole) key is
+    sorted and partitioned by the default comparator and partitioner of
+    Hadoop streaming. Keys not starting with a numeric type (stats job)
+    are written as JSON, lines with JSON keys are also read."""
+
+    SEPARATOR = '\x1f'
+
+    def __init__(self, fast_json=False):
+        self.last_key_encoded = None
+        self.last_key_decoded = None
+        if fast_json:
+            if orjson is None:
+                raise ImportError(
+                    'CompactKeyProtocol(fast_json=True) requires the module'
+                    ' orjson')
+            self.loads = FastJSONProtocol.loads
+            self.dumps = FastJSONProtocol.dumps
+        else:
+            self.loads = ujson.loads
+            self.dumps = FastJSONProtocol.ujson_dumps
+
+    @staticmethod
+    def crawl_index(key_type, length):
+        """Position of the crawl in a key of given type and length"""
+        if key_type in (CST.url.value, CST.digest.value):
+            return None
+        if key_type == CST.histogram.value:
+            return 2
+        return length - 1
+
+    @staticmethod
+    def encode_key(key):
+        key = list(key)
+        if not isinstance(key[0], int):
+            # not a key of the count job (type names used by the stats job)
+            return FastJSONProtocol.ujson_dumps(key)
+        i = CompactKeyProtocol.crawl_index(key[0], len(key))
+        if i is None:
+            prefix = '{:02x}'.format(key[0])
+            rest = key[1:]
+        else:
+            prefix = '{:02x}{:03x}'.format(key[0], key[i])
+            rest = key[1:i] + key[i+1:]
+        if rest and all(isinstance(item, str) for item in rest):
+            return (prefix + ':' + CompactKeyProtocol.SEPARATOR.join(
+                ujson.dumps(item)[1:-1] for item in rest)).encode('utf-8')
+        return (prefix + ujson.dumps(rest)).encode('utf-8')
+
+    @staticmethod
+    def decode_key(raw_key):
+        key_type = int(raw_key[:2], 16)
+        has_crawl = key_type not in (CST.url.value, CST.digest.value)
+        start = 5 if has_crawl else 2
+        if raw_key[start:start+1] == b':':
+            key = [key_type]
+            for item in raw_key[start+1:].split(b'\x1f'):
+                key.append(ujson.loads(b'"' + item + b'"'))
+        else:
+            key = [key_type] + ujson.loads(raw_key[start:])
+        if has_crawl:
+            key.insert(CompactKeyProtocol.crawl_index(key_type, len(key) + 1),
+                       int(raw_key[2:5], 16))
+        return key
+
+    @staticmethod
+    def is_compact(raw_key):
+        return not raw_key.startswith(b'[')
+
+    def read(self, line):
+        raw_key, raw_value = line.split(b'\t', 1)
+        if raw_key != self.last_key_encoded:
+            self.last_key_encoded = raw_key
+            if self.is_compact(raw_key):
+                self.last_key_decoded = self.decode_key(raw_key)
+            else:
+                self.last_key_decoded = self.loads(raw_key)
+        return self.last_key_decoded, self.loads(raw_value)
+
+    def write(self, key, value):
+        return self.encode_key(key) + b'\t' + self.dumps(value)
+
+
 class HostDomainCount:
     """Counts requiring URL parsing (host, domain, TLD, scheme).
     For each item both total pages and unique URLs are counted.
+    If PhaseCounters are given, URL parsing and the resolution of
+    registered domains and public suffixes (TLDs) are measured. With
+    PrecomputedHosts, host names, domains and suffixes are taken from
+    the input instead.
     """
 
-    IPpattern = re.compile(r'^\d{1,3}.\d{1,3}.\d{1,3}.\d{1,3}$')
+    # host name prefix (subdomains) with lower-case ASCII labels
+    plain_host_prefix = re.compile(r'[a-z0-9_-]+(?:\.[a-z0-9_-]+)*\.')
 
-    def __init__(self):
+    fast_schemes = frozenset(('http', 'https'))
+
+    def __init__(self, surt_domain=None, perf=None, precomputed=None):
         self.hosts = MultiCount(2)
         self.schemes = MultiCount(2)
-
-    def add(self, url, count):
+        # host name of the SURT domain ("com,example" -> "example.com")
+        self.surt_host = None
+        if surt_domain and ':' not in surt_domain:
+            self.surt_host = '.'.join(reversed(surt_domain.split(',')))
+        self.precomputed = precomputed
+        if precomputed is not None:
+            self.scheme_host = self.precomputed_scheme_host
+        self.perf = perf
+        if perf is not None:
+            self.scheme_host = perf.timed_function('url-parse',
+                                                   self.scheme_host)
+
+    def add(self, url, count, unique=1):
+        scheme, host = self.scheme_host(url)
+        if host is not None:
+            self.hosts.incr(host, count, unique)
+        self.schemes.incr(scheme, count, unique)
+
+    def scheme_host(self, url):
+        """Scheme and host name (lower-cased, without leading and trailing
+        dots) of a URL. URLs of the SURT domain of plain http(s) form are
+        split by a simple scanner, others by urllib.parse.urlparse."""
+        surt_host = self.surt_host
+        if surt_host is not None:
+            i = url.find('://')
+            scheme = url[:i]
+            if i > 0 and scheme in self.fast_schemes:
+                j = url.find('/', i + 3)
+                if j < 0:
+                    j = len(url)
+                host = url[i+3:j]
+                if host == surt_host:
+                    return scheme, host
+                k = len(host) - len(surt_host)
+                if k > 0 and host.endswith(surt_host) and (
+                        host.startswith('www.') and k == 4
+                        or self.plain_host_prefix.fullmatch(host, 0, k)):
+                    return scheme, host
         uri = urlparse(url)
         host = uri.hostname
         if host is not None:
             host = host.lower().strip('.')
-            self.hosts.incr(host, count, 1)
-        self.schemes.incr(uri.scheme, count, 1)
+        return uri.scheme, host
+
+    def precomputed_scheme_host(self, url):
+        """Scheme and host name of a URL given by the input, parsed if
+        not given"""
+        scheme_host = self.precomputed.scheme_host(url)
+        if scheme_host is None:
+            return HostDomainCount.scheme_host(self, url)
+        return scheme_host
 
     def output(self, crawl):
         domains = MultiCount(3)  # pages, URLs, hosts
         tlds = MultiCount(4)     # pages, URLs, hosts, domains
+        resolve = PublicSuffixResolver.default().resolve
+        if self.precomputed is not None:
+            resolve = self.precomputed.resolve_with(resolve)
+        if self.perf is not None:
+            resolve = self.perf.timed_function('tld', resolve)
         for scheme, counts in self.schemes.items():
             yield (CST.scheme.value, scheme, crawl), counts
         for host, counts in self.hosts.items():
             yield (CST.host.value, host, crawl), counts
-            try:
-                parsedhost = tldextract.extract(host)
-                hosttld = parsedhost.suffix
-            except TypeError as e:
-                LOG.error('Failed to parse host {}: {}'.format(host, e))
-                hosttld = None
-            if hosttld is None:
-                hostdomain = '(invalid)'
-            elif hosttld == '':
-                hostdomain = parsedhost.domain
-                if self.IPpattern.match(host):
-                    hosttld = '(ip address)'
-            else:
-                hostdomain = '.'.join([parsedhost.domain, parsedhost.suffix])
+            hostdomain, hosttld, is_ip = resolve(host)
+            if is_ip:
+                hosttld = '(ip address)'
             domains.incr((hostdomain, hosttld),
                          counts[0], counts[1], 1)
         for dom, counts in domains.items():
@@ -528,13 +873,62 @@ class HostDomainCount:
             yield (CST.tld.value, tld, crawl), counts
 
 
+class PrecomputedHosts:
+    """Host names, registered domains and public suffixes of the URLs of
+    one SURT domain as given by the columnar index, used by
+    HostDomainCount instead of URL parsing and public suffix resolution.
+    Hosts are looked up by the URL prefix up to the path ("scheme://"
+    and network location), there are only few such prefixes per SURT
+    domain."""
+
+    __slots__ = ('netlocs', 'domains')
+
+    def __init__(self):
+        self.netlocs = {}
+        self.domains = {}
+
+    @staticmethod
+    def netloc_prefix(url):
+        i = url.find('/', url.find('://') + 3)
+        if i < 0:
+            return url
+        return url[:i]
+
+    def add(self, url, scheme, host, domain, suffix):
+        prefix = self.netloc_prefix(url)
+        if prefix in self.netlocs or not host:
+            return
+        host = host.lower().strip('.')
+        self.netlocs[prefix] = (scheme, host)
+        if domain and suffix:
+            self.domains[host] = (domain, suffix, False)
+
+    def scheme_host(self, url):
+        """Scheme and host name, None if not known"""
+        return self.netlocs.get(self.netloc_prefix(url))
+
+    def resolve_with(self, resolve):
+        """Resolve host names into (domain, suffix, is_ip), using the
+        `resolve` function for hosts not given (incl. IP addresses)"""
+        domains = self.domains
+
+        def resolve_host(host):
+            result = domains.get(host)
+            if result is None:
+                return resolve(host)
+            return result
+        return resolve_host
+
+
 class SurtDomainCount:
     """Counters for one single SURT prefix/domain."""
 
     robots_txt_warc_pattern = re.compile(r'/robotstxt/')
 
-    def __init__(self, surt_domain):
+    def __init__(self, surt_domain, perf=None, hosts=None):
         self.surt_domain = surt_domain
+        self.perf = perf
+        self.hosts = hosts
         self.pages = 0
         self.url = defaultdict(int)
         self.digest = defaultdict(lambda: [0, 0])
@@ -550,11 +944,13 @@ class SurtDomainCount:
         status = -1
         if 'status' in metadata:
             status = int(metadata['status'])
+        url = metadata['url']
         if self.robots_txt_warc_pattern.search(metadata['filename']):
-            self.robotstxt_status[status][0] += 1
-            if metadata['url'] not in self.robotstxt_url:
-                self.robotstxt_status[status][1] += 1
-            self.robotstxt_url[metadata['url']] += 1
+            robotstxt_status = self.robotstxt_status[status]
+            robotstxt_status[0] += 1
+            if url not in self.robotstxt_url:
+                robotstxt_status[1] += 1
+            self.robotstxt_url[url] += 1
             # do not count robots.txt responses as "ordinary" pages
             return
         self.http_status[status] += 1
@@ -562,55 +958,79 @@ class SurtDomainCount:
             # skip content-related metrics for non-200 responses
             return
         self.pages += 1
-        mime = 'unk'
-        if 'mime' in metadata:
-            mime = metadata['mime']
-        self.mime[mime][0] += 1
-        mime_detected = None
+        new_url = url not in self.url
+        mime = metadata.get('mime', 'unk')
+        mime_counts = self.mime[mime]
+        mime_counts[0] += 1
+        if new_url:
+            mime_counts[1] += 1
         if 'mime-detected' in metadata:
-            mime_detected = metadata['mime-detected']
-            self.mime_detected[mime_detected][0] += 1
-        charset = None
+            counts = self.mime_detected[metadata['mime-detected']]
+            counts[0] += 1
+            if new_url and metadata['mime-detected']:
+                counts[1] += 1
         if 'charset' in metadata:
-            charset = metadata['charset']
-            self.charset[charset][0] += 1
-        languages = None
+            counts = self.charset[metadata['charset']]
+            counts[0] += 1
+            if new_url and metadata['charset']:
+                counts[1] += 1
         if 'languages' in metadata:
-            languages = metadata['languages']
-            self.languages[languages][0] += 1
-        digest = None
+            counts = self.languages[metadata['languages']]
+            counts[0] += 1
+            if new_url and metadata['languages']:
+                counts[1] += 1
         if 'digest' in metadata:
-            digest = metadata['digest']
-            self.digest[digest][0] += 1
-        if metadata['url'] not in self.url:
-            if digest:
-                self.digest[digest][1] += 1
-            self.mime[mime][1] += 1
-            if mime_detected:
-                self.mime_detected[mime_detected][1] += 1
-            if languages:
-                self.languages[languages][1] += 1
-            if charset:
-                self.charset[charset][1] += 1
-        self.url[metadata['url']] += 1
+            counts = self.digest[metadata['digest']]
+            counts[0] += 1
+            if new_url and metadata['digest']:
+                counts[1] += 1
+        self.url[url] += 1
 
     def unique_urls(self):
         return len(self.url)
 
-    def output(self, crawl, exact_count=True, min_surt_hll_size=50000):
+    def url_items(self):
+        return self.url.items()
+
+    def digest_items(self):
+        return self.digest.items()
+
+    def url_fingerprints(self):
+        """64-bit fingerprints (hll_hash) of the unique URLs"""
+        return numpy.fromiter((hll_hash(url) for url, _ in self.url_items()),
+                              dtype=numpy.uint64)
+
+    def digest_fingerprints(self):
+        return numpy.fromiter(
+            (hll_hash(digest) for digest, _ in self.digest_items()),
+            dtype=numpy.uint64)
+
+    def update_totals(self, urls_hll, digest_hll, url_histogram):
+        """Add URLs and digests to the HyperLogLogs and the URL counts
+        to the histogram of the whole crawl"""
+        urls = []
+        for url, cnt in self.url_items():
+            urls.append(url)
+            url_histogram[cnt] += 1
+        urls_hll.add_many(urls)
+        digest_hll.add_many(digest for digest, _counts in self.digest_items())
+
+    def output(self, crawl, exact_count=True, min_surt_hll_size=50000,
+               hll_encoding='list'):
         counts = (self.pages, self.unique_urls())
-        host_domain_count = HostDomainCount()
+        host_domain_count = HostDomainCount(self.surt_domain, self.perf,
+                                            self.hosts)
         surt_hll = None
         if self.unique_urls() >= min_surt_hll_size:
-            surt_hll = HyperLogLog(HYPERLOGLOG_ERROR)
-        for url, count in self.url.items():
+            surt_hll = NumpyHyperLogLog(HYPERLOGLOG_ERROR)
+        for url, count in self.url_items():
             host_domain_count.add(url, count)
             if exact_count:
                 yield (CST.url.value, self.surt_domain, url), (crawl, count)
-            if surt_hll is not None:
-                surt_hll.add(url)
+        if surt_hll is not None:
+            surt_hll.add_many(url for url, _count in self.url_items())
         if exact_count:
-            for digest, counts in self.digest.items():
+            for digest, counts in self.digest_items():
                 yield (CST.digest.value, digest), (crawl, counts)
         for mime, counts in self.mime.items():
             yield (CST.mimetype.value, mime, crawl), counts
@@ -631,7 +1051,8 @@ class SurtDomainCount:
             yield((CST.size_estimate_for.value, CST.surt_domain.value,
                    self.surt_domain, CST.url.value, crawl),
                   (self.unique_urls(),
-                   CrawlStatsJSONEncoder.json_encode_hyperloglog(surt_hll)))
+                   CrawlStatsJSONEncoder.json_encode_hyperloglog(
+                       surt_hll, hll_encoding)))
         for status, counts in self.http_status.items():
             yield (CST.http_status.value, status, crawl), counts
         for url, count in self.robotstxt_url.items():
@@ -641,6 +1062,1051 @@ class SurtDomainCount:
             yield (CST.robotstxt_status.value, status, crawl), counts
 
 
+class SpillingSurtDomainCount(SurtDomainCount):
+    """Counters for one single SURT prefix/domain with bounded memory:
+    if the URL and digest tables exceed max_items entries, they are
+    written as sorted runs to temporary files and merged when the counts
+    are output.
+
+    The cdx input is sorted by SURT URL, all captures of one URL share the
+    same SURT path. Tables are spilled only when the SURT path changes, so
+    that the captures of a URL never span two runs and the counts of new
+    URLs per MIME type, charset, language and digest remain exact."""
+
+    # estimated memory per URL or digest held in memory (bytes),
+    # see benchmark/surt_domain_count_memory.py
+    BYTES_PER_ITEM = 200
+
+    def __init__(self, surt_domain, max_items, tmp_dir=None, perf=None,
+                 hosts=None):
+        super(SpillingSurtDomainCount, self).__init__(surt_domain, perf,
+                                                      hosts)
+        self.max_items = max_items
+        self.tmp_dir = tmp_dir
+        self.path = None
+        self.url_runs = []
+        self.digest_runs = []
+        self.merged_urls = None
+        self.merged_digests = None
+        self.unique_url_count = 0
+
+    def add(self, path, metadata):
+        if path != self.path:
+            if len(self.url) + len(self.digest) >= self.max_items:
+                self.spill()
+            self.path = path
+        super(SpillingSurtDomainCount, self).add(path, metadata)
+
+    def write_run(self, items):
+        run = tempfile.TemporaryFile(mode='w+', dir=self.tmp_dir)
+        for key, value in sorted(items):
+            run.write(ujson.dumps([key, value]))
+            run.write('\n')
+        run.seek(0)
+        return run
+
+    def spill(self):
+        LOG.info('Spilling {} URLs and {} digests of {}'.format(
+            len(self.url), len(self.digest), self.surt_domain))
+        self.url_runs.append(self.write_run(self.url.items()))
+        self.digest_runs.append(self.write_run(self.digest.items()))
+        self.url = defaultdict(int)
+        self.digest = defaultdict(lambda: [0, 0])
+
+    @staticmethod
+    def read_run(run):
+        run.seek(0)
+        for line in run:
+            yield tuple(ujson.loads(line))
+
+    def merge_runs(self, runs, items, sum_values):
+        """Merge sorted runs and the in-memory table into one run"""
+        runs.append(self.write_run(items))
+        merged = heapq.merge(*map(self.read_run, runs),
+                             key=lambda item: item[0])
+        result = tempfile.TemporaryFile(mode='w+', dir=self.tmp_dir)
+        n = 0
+        for key, group in itertools.groupby(merged, key=lambda item: item[0]):
+            result.write(ujson.dumps([key, sum_values(v for _, v in group)]))
+            result.write('\n')
+            n += 1
+        for run in runs:
+            run.close()
+        return result, n
+
+    def merge(self):
+        if self.merged_urls is not None:
+            return
+        self.merged_urls, self.unique_url_count = self.merge_runs(
+            self.url_runs, self.url.items(), sum)
+        self.merged_digests, _ = self.merge_runs(
+            self.digest_runs, self.digest.items(),
+            lambda counts: [sum(c) for c in zip(*counts)])
+        self.url_runs = []
+        self.digest_runs = []
+        self.url = defaultdict(int)
+        self.digest = defaultdict(lambda: [0, 0])
+
+    def unique_urls(self):
+        if not self.url_runs and self.merged_urls is None:
+            return len(self.url)
+        self.merge()
+        return self.unique_url_count
+
+    def url_items(self):
+        if not self.url_runs and self.merged_urls is None:
+            return self.url.items()
+        self.merge()
+        return self.read_run(self.merged_urls)
+
+    def digest_items(self):
+        if not self.digest_runs and self.merged_digests is None:
+            return self.digest.items()
+        self.merge()
+        return self.read_run(self.merged_digests)
+
+    def close(self):
+        for run in (self.url_runs + self.digest_runs
+                    + [self.merged_urls, self.merged_digests]):
+            if run is not None:
+                run.close()
+
+
+class HashCounts:
+    """Counts of 64-bit hashes (e.g., of URLs, see hll_hash) held in an
+    open-addressing hash table of two arrays (12-16 bytes per slot, at
+    least half of the slots are empty), a dict with Python int keys needs
+    about 100 bytes per key. Zero marks empty slots, so the hash value
+    zero is counted as one."""
+
+    __slots__ = ('keys', 'counts', 'size', 'mask')
+
+    def __init__(self, capacity=16, typecode='Q'):
+        self.keys = array('Q', bytes(8 * capacity))
+        self.counts = array(typecode, bytes(
+            array(typecode).itemsize * capacity))
+        self.size = 0
+        self.mask = capacity - 1
+
+    def _slot(self, key):
+        keys = self.keys
+        i = key & self.mask
+        while keys[i] != key and keys[i] != 0:
+            i = (i + 1) & self.mask
+        return i
+
+    def _resize(self):
+        keys, counts = self.keys, self.counts
+        capacity = 2 * len(keys)
+        self.keys = array('Q', bytes(8 * capacity))
+        self.counts = array(counts.typecode, bytes(
+            counts.itemsize * capacity))
+        self.mask = capacity - 1
+        for j, key in enumerate(keys):
+            if key != 0:
+                i = self._slot(key)
+                self.keys[i] = key
+                self.counts[i] = counts[j]
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, key):
+        return self.keys[self._slot(key or 1)] != 0
+
+    def __iter__(self):
+        for key in self.keys:
+            if key != 0:
+                yield key
+
+    def get(self, key, default=None):
+        i = self._slot(key or 1)
+        if self.keys[i] == 0:
+            return default
+        return self.counts[i]
+
+    def __setitem__(self, key, count):
+        key = key or 1
+        i = self._slot(key)
+        if self.keys[i] == 0:
+            if 2 * (self.size + 1) > len(self.keys):
+                self._resize()
+                i = self._slot(key)
+            self.keys[i] = key
+            self.size += 1
+        self.counts[i] = count
+
+    def items(self):
+        for i, key in enumerate(self.keys):
+            if key != 0:
+                yield key, self.counts[i]
+
+    def hashes(self):
+        """All keys as NumPy array"""
+        keys = numpy.frombuffer(self.keys, dtype=numpy.uint64)
+        return keys[keys != 0]
+
+
+class CompactSurtDomainCount:
+    """Memory-efficient counters for one single SURT prefix/domain,
+    same counts and output as SurtDomainCount:
+    - MIME types, charsets, languages and HTTP status codes are interned
+      to small integer ids (shared by all instances), the page and URL
+      counts per id are held in array columns
+    - page and URL counts per content digest are packed into one integer
+    - optionally (url_hashes=True), URLs and content digests are held as
+      64-bit hashes (see hll_hash) in HashCounts tables. Hosts and schemes
+      are then counted when a URL is added first, and the hashes are
+      added to the HyperLogLogs directly. URLs and digests cannot be
+      output, so this does not work with exact counts."""
+
+    __slots__ = ('surt_domain', 'pages', 'url_hashes', 'url', 'digest',
+                 'value_ids', 'value_pages', 'value_urls', 'robotstxt_url',
+                 'host_domain_count', 'perf', 'hosts')
+
+    # fields of interned values
+    MIME, MIME_DETECTED, CHARSET, LANGUAGES, HTTP_STATUS, ROBOTSTXT_STATUS \
+        = range(6)
+
+    # (field, value) -> id and id -> (field, value)
+    interned_ids = {}
+    interned_values = []
+
+    # URL count in packed digest counts: pages + (urls << URL_COUNT_SHIFT)
+    URL_COUNT_SHIFT = 32
+    URL_COUNT = 1 << URL_COUNT_SHIFT
+    PAGE_COUNT_MASK = URL_COUNT - 1
+
+    robots_txt_warc_pattern = SurtDomainCount.robots_txt_warc_pattern
+
+    def __init__(self, surt_domain, url_hashes=False, perf=None,
+                 hosts=None):
+        self.surt_domain = surt_domain
+        self.perf = perf
+        self.hosts = hosts
+        self.pages = 0
+        self.url_hashes = url_hashes
+        self.url = {}
+        self.digest = {}
+        self.value_ids = array('l')
+        self.value_pages = array('q')
+        self.value_urls = array('q')
+        self.robotstxt_url = {}
+        self.host_domain_count = None
+        if url_hashes:
+            self.url = HashCounts(typecode='I')
+            self.digest = HashCounts()
+            self.robotstxt_url = HashCounts(typecode='I')
+            self.host_domain_count = HostDomainCount(surt_domain, perf,
+                                                     hosts)
+
+    @staticmethod
+    def intern(field, value):
+        key = (field, value)
+        value_id = CompactSurtDomainCount.interned_ids.get(key)
+        if value_id is None:
+            value_id = len(CompactSurtDomainCount.interned_values)
+            CompactSurtDomainCount.interned_ids[key] = value_id
+            CompactSurtDomainCount.interned_values.append(key)
+        return value_id
+
+    def incr(self, field, value, page_count, url_count):
+        value_id = self.interned_ids.get((field, value))
+        if value_id is None:
+            value_id = self.intern(field, value)
+        try:
+            i = self.value_ids.index(value_id)
+        except ValueError:
+            i = len(self.value_ids)
+            self.value_ids.append(value_id)
+            self.value_pages.append(0)
+            self.value_urls.append(0)
+        self.value_pages[i] += page_count
+        self.value_urls[i] += url_count
+
+    def value_counts(self, field):
+        """Yield (value, [pages, urls]) for all values of a field"""
+        for i, value_id in enumerate(self.value_ids):
+            (value_field, value) = self.interned_values[value_id]
+            if value_field == field:
+                yield value, [self.value_pages[i], self.value_urls[i]]
+
+    def add(self, _path, metadata):
+        status = -1
+        if 'status' in metadata:
+            status = int(metadata['status'])
+        url = metadata['url']
+        if self.url_hashes:
+            url = hll_hash(url)
+        if self.robots_txt_warc_pattern.search(metadata['filename']):
+            new_url = url not in self.robotstxt_url
+            self.incr(self.ROBOTSTXT_STATUS, status, 1, int(new_url))
+            self.robotstxt_url[url] = self.robotstxt_url.get(url, 0) + 1
+            # do not count robots.txt responses as "ordinary" pages
+            return
+        self.incr(self.HTTP_STATUS, status, 1, 0)
+        if status != 200:
+            # skip content-related metrics for non-200 responses
+            return
+        self.pages += 1
+        new_url = url not in self.url
+        self.incr(self.MIME, metadata.get('mime', 'unk'), 1, int(new_url))
+        if 'mime-detected' in metadata:
+            mime_detected = metadata['mime-detected']
+            self.incr(self.MIME_DETECTED, mime_detected, 1,
+                      int(new_url and bool(mime_detected)))
+        if 'charset' in metadata:
+            charset = metadata['charset']
+            self.incr(self.CHARSET, charset, 1,
+                      int(new_url and bool(charset)))
+        if 'languages' in metadata:
+            languages = metadata['languages']
+            self.incr(self.LANGUAGES, languages, 1,
+                      int(new_url and bool(languages)))
+        if 'digest' in metadata:
+            digest = metadata['digest']
+            counts = 1
+            if new_url and digest:
+                counts += self.URL_COUNT
+            if self.url_hashes:
+                digest = hll_hash(digest)
+            self.digest[digest] = self.digest.get(digest, 0) + counts
+        if self.url_hashes:
+            self.host_domain_count.add(metadata['url'], 1, int(new_url))
+        self.url[url] = self.url.get(url, 0) + 1
+
+    def unique_urls(self):
+        return len(self.url)
+
+    def url_fingerprints(self):
+        """64-bit fingerprints (hll_hash) of the unique URLs"""
+        if self.url_hashes:
+            return self.url.hashes()
+        return numpy.fromiter(map(hll_hash, self.url), dtype=numpy.uint64)
+
+    def digest_fingerprints(self):
+        if self.url_hashes:
+            return self.digest.hashes()
+        return numpy.fromiter(map(hll_hash, self.digest),
+                              dtype=numpy.uint64)
+
+    def update_totals(self, urls_hll, digest_hll, url_histogram):
+        """Add URLs and digests to the HyperLogLogs and the URL counts
+        to the histogram of the whole crawl"""
+        url_histogram.update(cnt for _url, cnt in self.url.items())
+        if self.url_hashes:
+            urls_hll.add_hashes(self.url.hashes())
+            digest_hll.add_hashes(self.digest.hashes())
+        else:
+            urls_hll.add_many(self.url)
+            digest_hll.add_many(self.digest)
+
+    def output(self, crawl, exact_count=True, min_surt_hll_size=50000,
+               hll_encoding='list'):
+        if exact_count and self.url_hashes:
+            raise ValueError('Exact counts require URLs, not URL hashes')
+        host_domain_count = self.host_domain_count
+        if host_domain_count is None:
+            host_domain_count = HostDomainCount(self.surt_domain, self.perf,
+                                                self.hosts)
+        surt_hll = None
+        if self.unique_urls() >= min_surt_hll_size:
+            surt_hll = NumpyHyperLogLog(HYPERLOGLOG_ERROR)
+            if self.url_hashes:
+                surt_hll.add_hashes(self.url.hashes())
+            else:
+                surt_hll.add_many(self.url)
+        if not self.url_hashes:
+            for url, count in self.url.items():
+                host_domain_count.add(url, count)
+                if exact_count:
+                    yield((CST.url.value, self.surt_domain, url),
+                          (crawl, count))
+        if exact_count:
+            for digest, counts in self.digest.items():
+                yield((CST.digest.value, digest),
+                      (crawl, [counts & self.PAGE_COUNT_MASK,
+                               counts >> self.URL_COUNT_SHIFT]))
+        for mime, counts in self.value_counts(self.MIME):
+            yield (CST.mimetype.value, mime, crawl), counts
+        for mime, counts in self.value_counts(self.MIME_DETECTED):
+            yield (CST.mimetype_detected.value, mime, crawl), counts
+        for charset, counts in self.value_counts(self.CHARSET):
+            yield (CST.charset.value, charset, crawl), counts
+        for languages, counts in self.value_counts(self.LANGUAGES):
+            yield (CST.languages.value, languages, crawl), counts
+            # yield primary language
+            prim_l = languages.split(',')[0]
+            yield (CST.primary_language.value, prim_l, crawl), counts
+        for key, val in host_domain_count.output(crawl):
+            yield key, val
+        yield((CST.surt_domain.value, self.surt_domain, crawl),
+              (self.pages, self.unique_urls(), len(host_domain_count.hosts)))
+        if surt_hll is not None:
+            yield((CST.size_estimate_for.value, CST.surt_domain.value,
+                   self.surt_domain, CST.url.value, crawl),
+                  (self.unique_urls(),
+                   CrawlStatsJSONEncoder.json_encode_hyperloglog(
+                       surt_hll, hll_encoding)))
+        for status, counts in self.value_counts(self.HTTP_STATUS):
+            yield (CST.http_status.value, status, crawl), counts[0]
+        for url, count in self.robotstxt_url.items():
+            yield (CST.size_robotstxt.value, CST.url.value, crawl), 1
+            yield (CST.size_robotstxt.value, CST.page.value, crawl), count
+        for status, counts in self.value_counts(self.ROBOTSTXT_STATUS):
+            yield (CST.robotstxt_status.value, status, crawl), counts
+
+
+class CdxParser:
+    """Decoding of cdx files and lines:
+      <SURT URL> <timestamp> <JSON metadata>
+    where the SURT URL is split into the SURT domain and path at the
+    first closing parenthesis."""
+
+    # size of compressed blocks read and decompressed at once, larger
+    # blocks (1 MiB) are slower because the decompressed data (about
+    # 10 times the size) does not fit into the CPU cache
+    BLOCK_SIZE = 1 << 16
+
+    @staticmethod
+    def split_line(line):
+        """Split a cdx line into SURT domain, path and the JSON string
+        holding the metadata. The JSON string is a slice of the line,
+        there is no need to split all the JSON and join it again."""
+        surt_end = line.find(' ')
+        if surt_end < 0:
+            surt_end = len(line)
+        surt_domain, path = line[:surt_end].split(')', 1)
+        json_start = line.find(' ', surt_end + 1)
+        if json_start < 0:
+            return surt_domain, path, ''
+        return surt_domain, path, line[json_start + 1:]
+
+    @staticmethod
+    def read_lines(stream, block_size=BLOCK_SIZE):
+        """Read lines (bytes, without line break) from a stream of one or
+        more concatenated gzip members (cdx files consist of many gzip
+        members). Large blocks are decompressed and split into lines at
+        once which is significantly faster than reading line by line from
+        a gzip.GzipFile."""
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        rest = b''
+        while True:
+            data = stream.read(block_size)
+            if not data:
+                break
+            while data:
+                block = decompressor.decompress(data)
+                data = decompressor.unused_data
+                if decompressor.eof:
+                    # next gzip member
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                if block:
+                    lines = block.split(b'\n')
+                    lines[0] = rest + lines[0]
+                    rest = lines.pop()
+                    yield from lines
+        if rest:
+            yield rest
+
+
+class CdxChunk:
+    """Byte range of a cdx file (a sequence of gzip members) processed by
+    one map task, see --cdx-chunks. Chunks are created from the
+    cluster.idx which lists the offset and length of every gzip member
+    (block of 3000 cdx lines) of all cdx files.
+
+    SURT domains crossing chunk boundaries are processed by the chunk
+    where they start: a chunk skips leading lines of the SURT domain the
+    previous block ends with, and continues reading after its end until
+    the last SURT domain is finished. Every SURT domain is counted
+    exactly once and the per-domain counts are the same as if the entire
+    cdx file is processed by one task."""
+
+    __slots__ = ('path', 'offset', 'end', 'prev_offset', 'last')
+
+    # S3 client, created on demand
+    s3_client = None
+
+    def __init__(self, path, offset, end, prev_offset=-1, last=True):
+        self.path = path
+        self.offset = offset
+        self.end = end
+        self.prev_offset = prev_offset
+        self.last = last
+
+    @property
+    def first(self):
+        return self.prev_offset < 0
+
+    def to_line(self):
+        return '\t'.join([self.path, str(self.offset), str(self.end),
+                          str(self.prev_offset), str(int(self.last))])
+
+    @staticmethod
+    def from_line(line):
+        # the last five fields, Hadoop may prepend the line offset as key
+        path, offset, end, prev_offset, last = \
+            line.rstrip('\r\n').split('\t')[-5:]
+        return CdxChunk(path, int(offset), int(end), int(prev_offset),
+                        last == '1')
+
+    @staticmethod
+    def from_cluster_idx(lines, cdx_dir, blocks_per_chunk):
+        """Split cdx files into chunks of consecutive blocks, given the
+        lines of the cluster.idx:
+          <SURT URL> <timestamp>\\t<cdx file>\\t<offset>\\t<length>\\t...
+        """
+        blocks = []
+        for line in lines:
+            fields = line.rstrip('\r\n').split('\t')
+            if len(fields) < 4:
+                continue
+            blocks.append((fields[1], int(fields[2]), int(fields[3])))
+        for cdx_file, file_blocks in itertools.groupby(
+                blocks, key=lambda b: b[0]):
+            file_blocks = list(file_blocks)
+            path = cdx_dir.rstrip('/') + '/' + cdx_file
+            for i in range(0, len(file_blocks), blocks_per_chunk):
+                chunk_blocks = file_blocks[i:i+blocks_per_chunk]
+                prev_offset = -1
+                if i > 0:
+                    prev_offset = file_blocks[i-1][1]
+                yield CdxChunk(path, chunk_blocks[0][1],
+                               chunk_blocks[-1][1] + chunk_blocks[-1][2],
+                               prev_offset,
+                               (i + blocks_per_chunk) >= len(file_blocks))
+
+    @staticmethod
+    def open(path, offset, end=None):
+        """Open a byte range of a local file or an object on S3"""
+        if path.startswith(('s3://', 's3a://')):
+            if CdxChunk.s3_client is None:
+                # boto3 is only required to read chunks from S3
+                import boto3
+                CdxChunk.s3_client = boto3.client('s3')
+            bucket, key = path.split('/', 3)[2:]
+            byte_range = 'bytes={}-'.format(offset)
+            if end is not None:
+                byte_range += str(end - 1)
+            return CdxChunk.s3_client.get_object(
+                Bucket=bucket, Key=key, Range=byte_range)['Body']
+        stream = open(path, 'rb')
+        stream.seek(offset)
+        if end is None:
+            return stream
+        return ByteRangeReader(stream, end - offset)
+
+    def read_lines(self, offset, end=None):
+        stream = CdxChunk.open(self.path, offset, end)
+        try:
+            for line in CdxParser.read_lines(stream):
+                yield line.decode('utf-8')
+        finally:
+            stream.close()
+
+    def skip_surt_domain(self):
+        """SURT domain (with closing parenthesis) of the last line in the
+        block before the chunk, None for the first chunk"""
+        if self.first:
+            return None
+        last_line = None
+        for last_line in self.read_lines(self.prev_offset, self.offset):
+            pass
+        if last_line is None:
+            return None
+        return last_line[:last_line.find(')') + 1]
+
+    def lines(self):
+        """Lines of the chunk, without the leading lines of a SURT domain
+        starting before the chunk"""
+        skip_domain = self.skip_surt_domain()
+        for line in self.read_lines(self.offset, self.end):
+            if skip_domain is not None:
+                if line.startswith(skip_domain):
+                    continue
+                skip_domain = None
+            yield line
+
+    def continuation(self, surt_domain):
+        """Lines of a SURT domain continuing after the end of the chunk"""
+        if self.last:
+            return
+        prefix = surt_domain + ')'
+        for line in self.read_lines(self.end):
+            if not line.startswith(prefix):
+                break
+            yield line
+
+
+class ByteRangeReader:
+    """Read at most `length` bytes from a stream"""
+
+    __slots__ = ('stream', 'remaining')
+
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.stream.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.stream.close()
+
+
+class ParquetIndexReader:
+    """Read the captures of one Parquet file of Common Crawl's columnar
+    index (cc-index table), only the columns needed by the count job, in
+    batches of rows. The files are sorted by SURT URL, same as the cdx
+    files. Host names, registered domains and public suffixes are taken
+    from the precomputed columns (see PrecomputedHosts)."""
+
+    COLUMNS = ('url_surtkey', 'url', 'fetch_status', 'content_mime_type',
+               'content_mime_detected', 'content_charset',
+               'content_languages', 'content_digest', 'warc_filename',
+               'url_protocol', 'url_host_name',
+               'url_host_registered_domain', 'url_host_registered_suffix')
+
+    # optional columns and the corresponding fields of the cdx metadata
+    METADATA_FIELDS = (('fetch_status', 'status'),
+                       ('content_mime_type', 'mime'),
+                       ('content_mime_detected', 'mime-detected'),
+                       ('content_charset', 'charset'),
+                       ('content_languages', 'languages'),
+                       ('content_digest', 'digest'))
+
+    BATCH_SIZE = 1 << 16
+
+    def __init__(self, path, batch_size=BATCH_SIZE):
+        self.path = path
+        self.batch_size = batch_size
+
+    def open(self):
+        import pyarrow.fs
+        if '://' in self.path:
+            filesystem, path = pyarrow.fs.FileSystem.from_uri(self.path)
+            return filesystem.open_input_file(path)
+        return open(self.path, 'rb')
+
+    def records(self):
+        """Yield (SURT URL, metadata, scheme, host, domain, suffix) per
+        capture, the metadata holds the same fields as the JSON of a cdx
+        line"""
+        import pyarrow.parquet
+        fields = [field for _, field in self.METADATA_FIELDS]
+        with self.open() as stream:
+            parquet = pyarrow.parquet.ParquetFile(stream)
+            for batch in parquet.iter_batches(batch_size=self.batch_size,
+                                              columns=list(self.COLUMNS)):
+                columns = [batch.column(name).to_pylist()
+                           for name in self.COLUMNS]
+                for row in zip(*columns):
+                    metadata = {'url': row[1], 'filename': row[8]}
+                    for field, value in zip(fields, row[2:8]):
+                        if value is not None:
+                            metadata[field] = value
+                    yield (row[0], metadata) + row[9:]
+
+
+class CountCheckpoint:
+    """Partial result of the count job for one cdx file: map output and
+    counters of the map task, stored in a checkpoint directory (local or
+    S3) under a content address, the SHA-1 of input path, size, version
+    (mtime or ETag) and of the options which change the map output.
+
+    The map output is written to <address>.partial.gz, the info (input,
+    counters) to <address>.partial.json when the map task has finished.
+    Only partial results with info are complete. A rerun of the job takes
+    the partial results as input instead of the cdx files (see
+    CCStatsJob.checkpointed_inputs), the map tasks then pass the stored
+    map output on to the reducers."""
+
+    # options (dest) which change the map output
+    OPTIONS = ('crawl', 'top_estimate_size',
+               'surt_domain_counter', 'hyperloglog_encoding',
+               'compact_keys', 'seen_filter')
+
+    # format version, part of the address
+    VERSION = 1
+
+    SUFFIX = '.partial.gz'
+    INFO_SUFFIX = '.partial.json'
+    partial_pattern = re.compile(r'^[0-9a-f]{40}\.partial\.gz$')
+
+    s3_client = None
+
+    def __init__(self, checkpoint_dir, input_path, options):
+        if not CountCheckpoint.is_s3(checkpoint_dir):
+            checkpoint_dir = CountCheckpoint.local_path(checkpoint_dir)
+        self.checkpoint_dir = checkpoint_dir.rstrip('/')
+        input_id, size, version = CountCheckpoint.fingerprint(input_path)
+        job_options = {option: getattr(options, option)
+                       for option in self.OPTIONS}
+        # not given (None) is the same as --no-exact-counts
+        job_options['exact_counts'] = bool(options.exact_counts)
+        self.info = {'input': input_path, 'size': size, 'version': version,
+                     'options': job_options}
+        address = json.dumps([self.VERSION, input_id, size, version,
+                              self.info['options']], sort_keys=True)
+        self.address = hashlib.sha1(address.encode('utf-8')).hexdigest()
+        self.path = self.checkpoint_dir + '/' + self.address + self.SUFFIX
+        self.info_path = CountCheckpoint.info_path_of(self.path)
+        self.counters = Counter()
+        self.records = 0
+        self.output = None
+
+    @staticmethod
+    def is_partial(path):
+        """Whether an input path is a partial result"""
+        name = path.rsplit('/', 1)[-1]
+        return CountCheckpoint.partial_pattern.match(name) is not None
+
+    @staticmethod
+    def info_path_of(path):
+        return (path[:-len(CountCheckpoint.SUFFIX)]
+                + CountCheckpoint.INFO_SUFFIX)
+
+    @staticmethod
+    def s3(path=None):
+        """S3 client and, if a path is given, its bucket and key"""
+        if CountCheckpoint.s3_client is None:
+            # boto3 is only required for checkpoints or inputs on S3
+            import boto3
+            CountCheckpoint.s3_client = boto3.client('s3')
+        if path is None:
+            return CountCheckpoint.s3_client
+        return (CountCheckpoint.s3_client,) + tuple(path.split('/', 3)[2:])
+
+    @staticmethod
+    def is_s3(path):
+        return path.startswith(('s3://', 's3a://'))
+
+    @staticmethod
+    def fingerprint(path):
+        """Identity (independent of the URL scheme), size and version
+        (mtime or ETag) of an input file"""
+        if CountCheckpoint.is_s3(path):
+            client, bucket, key = CountCheckpoint.s3(path)
+            head = client.head_object(Bucket=bucket, Key=key)
+            return bucket + '/' + key, head['ContentLength'], head['ETag']
+        path = os.path.abspath(CountCheckpoint.local_path(path))
+        stat = os.stat(path)
+        return path, stat.st_size, stat.st_mtime_ns
+
+    @staticmethod
+    def local_path(path):
+        if path.startswith('file://'):
+            return path[len('file://'):]
+        if '://' in path:
+            raise InputError(
+                "Checkpoints require local or S3 files: {}".format(path))
+        return path
+
+    def exists(self):
+        """Whether the partial result is complete"""
+        if CountCheckpoint.is_s3(self.info_path):
+            client, bucket, key = CountCheckpoint.s3(self.info_path)
+            return client.list_objects_v2(
+                Bucket=bucket, Prefix=key, MaxKeys=1)['KeyCount'] > 0
+        return os.path.exists(self.info_path)
+
+    def open(self, write_line):
+        """Start writing the map output, serialized by write_line"""
+        tmp_dir = None
+        if not CountCheckpoint.is_s3(self.path):
+            # same file system, to move the temporary file in place
+            os.makedirs(self.checkpoint_dir, exist_ok=True)
+            tmp_dir = self.checkpoint_dir
+        fd, self.tmp_path = tempfile.mkstemp(prefix='tmp-', dir=tmp_dir)
+        os.close(fd)
+        self.output = gzip.open(self.tmp_path, 'wb', compresslevel=1)
+        self.write_line = write_line
+
+    def write(self, key, value):
+        self.output.write(self.write_line(key, value) + b'\n')
+        self.records += 1
+
+    def count(self, group, counter, amount):
+        self.counters[(group, counter)] += amount
+
+    def commit(self):
+        """Store the map output, then the info to mark the partial result
+        as complete"""
+        self.output.close()
+        self.store(self.tmp_path, self.path)
+        info = dict(self.info, records=self.records,
+                    counters=[[group, counter, amount] for (group, counter),
+                              amount in sorted(self.counters.items())])
+        fd, tmp_path = tempfile.mkstemp(prefix='tmp-', dir=os.path.dirname(
+            self.tmp_path))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(info, f, sort_keys=True)
+        self.store(tmp_path, self.info_path)
+        LOG.info('Stored partial result of {}: {}'.format(
+            self.info['input'], self.path))
+
+    @staticmethod
+    def store(local_path, path):
+        if CountCheckpoint.is_s3(path):
+            client, bucket, key = CountCheckpoint.s3(path)
+            client.upload_file(local_path, bucket, key)
+            os.remove(local_path)
+        else:
+            os.replace(local_path, path)
+
+    @staticmethod
+    def read_info(path):
+        """Info of the partial result given by its path"""
+        info_path = CountCheckpoint.info_path_of(path)
+        if CountCheckpoint.is_s3(info_path):
+            client, bucket, key = CountCheckpoint.s3(info_path)
+            stream = client.get_object(Bucket=bucket, Key=key)['Body']
+        else:
+            stream = open(CountCheckpoint.local_path(info_path), 'rb')
+        with stream:
+            return json.loads(stream.read())
+
+
+class CountCombiner:
+    """In-mapper aggregation of counts for item types of low cardinality
+    (MIME types, charsets, languages, etc.) which are otherwise emitted
+    once per SURT domain. The counts are summed per key and emitted if
+    the number of keys exceeds the limit or when the mapper is finished.
+    """
+
+    combined_types = frozenset((CST.mimetype.value,
+                                CST.mimetype_detected.value,
+                                CST.charset.value,
+                                CST.languages.value,
+                                CST.primary_language.value,
+                                CST.scheme.value,
+                                CST.tld.value,
+                                CST.http_status.value,
+                                CST.robotstxt_status.value,
+                                CST.size_robotstxt.value))
+
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self.counts = {}
+        self.records_in = 0
+        self.records_out = 0
+
+    def add(self, key, value):
+        """Add count to combined counts, return False if the type of
+        the key is not combined"""
+        if self.max_keys <= 0 or key[0] not in self.combined_types:
+            return False
+        self.records_in += 1
+        if key in self.counts:
+            self.counts[key] = MultiCount.sum_values(
+                (self.counts[key], value), compress=False)
+        else:
+            self.counts[key] = value
+        return True
+
+    def is_full(self):
+        return len(self.counts) >= self.max_keys
+
+    def flush(self):
+        for key, value in self.counts.items():
+            if isinstance(value, list):
+                value = MultiCount.compress(len(value), value)
+            yield key, value
+        self.records_out += len(self.counts)
+        self.counts = {}
+
+
+class PhaseCounters:
+    """Instrumentation of the count mapper: cumulative wall time, number
+    of calls and net number of allocated memory blocks (see
+    sys.getallocatedblocks) per phase. To keep the overhead low, only
+    every n-th unit (SURT domain) is sampled: phases are measured only
+    while a sampled unit is processed. Phases may be nested (e.g.
+    `url-parse` and `tld` within `add` and `output`): time and blocks of
+    inner phases are excluded from the outer phase, the time including
+    inner phases is kept as total time."""
+
+    def __init__(self, sample=1):
+        self.sample = max(1, sample)
+        self.time = defaultdict(float)
+        self.total_time = defaultdict(float)
+        self.calls = Counter()
+        self.blocks = Counter()
+        self.units = 0
+        self.sampled_units = 0
+        self.active = False
+        # time and blocks of inner phases, per open measurement
+        self.nested = []
+
+    def next_unit(self):
+        """Start a new unit, return True if it is sampled"""
+        self.active = (self.units % self.sample) == 0
+        self.units += 1
+        if self.active:
+            self.sampled_units += 1
+        return self.active
+
+    def start(self):
+        self.nested.append([0.0, 0])
+        return perf_counter(), sys.getallocatedblocks()
+
+    def stop(self, phase, start, calls=1):
+        elapsed = perf_counter() - start[0]
+        blocks = sys.getallocatedblocks() - start[1]
+        inner_time, inner_blocks = self.nested.pop()
+        self.time[phase] += elapsed - inner_time
+        self.total_time[phase] += elapsed
+        self.blocks[phase] += blocks - inner_blocks
+        self.calls[phase] += calls
+        if self.nested:
+            self.nested[-1][0] += elapsed
+            self.nested[-1][1] += blocks
+
+    def timed(self, phase, iterable):
+        """Iterate over items, the time spent producing an item (but not
+        the time spent by the consumer) is added to the phase"""
+        iterator = iter(iterable)
+        while True:
+            start = self.start() if self.active else None
+            try:
+                item = next(iterator)
+            except StopIteration:
+                if start is not None:
+                    self.stop(phase, start, calls=0)
+                return
+            if start is not None:
+                self.stop(phase, start)
+            yield item
+
+    def timed_function(self, phase, func):
+        """Wrap a function, every call is measured"""
+        def timed(*args):
+            start = self.start()
+            try:
+                return func(*args)
+            finally:
+                self.stop(phase, start)
+        return timed
+
+    def counters(self):
+        """Counters (name, amount) per phase, time in microseconds"""
+        for phase in sorted(self.calls):
+            yield '{} calls'.format(phase), self.calls[phase]
+            yield '{} time (us)'.format(phase), \
+                int(self.time[phase] * 1000000)
+            yield '{} total time (us)'.format(phase), \
+                int(self.total_time[phase] * 1000000)
+            yield '{} allocated blocks'.format(phase), self.blocks[phase]
+
+    def report(self):
+        return {'sample': self.sample,
+                'units': self.units,
+                'sampled_units': self.sampled_units,
+                'phases': {phase: {'calls': self.calls[phase],
+                                   'time': self.time[phase],
+                                   'total_time': self.total_time[phase],
+                                   'allocated_blocks': self.blocks[phase]}
+                           for phase in sorted(self.calls)}}
+
+
+class SpaceSaving:
+    """Space-Saving sketch of heavy hitters (Metwally et al., 2005) with
+    weighted updates: holds at most `capacity` items with an estimated
+    count and its max. overestimation (error), i.e. the true count of an
+    item lies in [count - error, count]. Items not held have a true count
+    not larger than `floor`. Every item with a true count larger than
+    total / capacity is held. Sketches are merged following Agarwal et al.
+    (2012), "Mergeable Summaries"."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.counts = {}
+        self.errors = {}
+        self.floor = 0
+        # min-heap of (count, item), entries are outdated if the count
+        # of the item has changed meanwhile
+        self.heap = []
+
+    def __len__(self):
+        return len(self.counts)
+
+    def update(self, item, count):
+        counts = self.counts
+        if item in counts:
+            counts[item] += count
+        elif len(counts) < self.capacity:
+            counts[item] = self.floor + count
+            self.errors[item] = self.floor
+        else:
+            min_count, min_item = self.pop_min()
+            del counts[min_item]
+            del self.errors[min_item]
+            self.floor = max(self.floor, min_count)
+            counts[item] = min_count + count
+            self.errors[item] = min_count
+        heapq.heappush(self.heap, (counts[item], item))
+        if len(self.heap) > 4 * self.capacity:
+            self.heap = [(c, i) for i, c in counts.items()]
+            heapq.heapify(self.heap)
+
+    def pop_min(self):
+        while True:
+            count, item = heapq.heappop(self.heap)
+            if self.counts.get(item) == count:
+                return count, item
+
+    def top(self, n=None):
+        """Items as (item, count, error), most frequent first"""
+        items = sorted(self.counts.items(), key=lambda c: (-c[1], c[0]))
+        if n is not None:
+            items = items[:n]
+        return [(item, count, self.errors[item]) for item, count in items]
+
+    def merge(self, other):
+        """Merge another sketch into this one"""
+        counts = {}
+        errors = {}
+        for item in self.counts.keys() | other.counts.keys():
+            counts[item] = (self.counts.get(item, self.floor)
+                            + other.counts.get(item, other.floor))
+            errors[item] = (self.errors.get(item, self.floor)
+                            + other.errors.get(item, other.floor))
+        floor = self.floor + other.floor
+        capacity = max(self.capacity, other.capacity)
+        if len(counts) > capacity:
+            items = sorted(counts.items(), key=lambda c: (-c[1], c[0]))
+            floor = max(floor, items[capacity][1])
+            for item, _ in items[capacity:]:
+                del counts[item]
+                del errors[item]
+        self.capacity = capacity
+        self.counts = counts
+        self.errors = errors
+        self.floor = floor
+        self.heap = [(c, i) for i, c in counts.items()]
+        heapq.heapify(self.heap)
+
+    def to_json(self):
+        return (self.capacity, self.floor, self.top())
+
+    @staticmethod
+    def from_json(value):
+        capacity, floor, items = value
+        sketch = SpaceSaving(capacity)
+        sketch.floor = floor
+        for item, count, error in items:
+            sketch.counts[item] = count
+            sketch.errors[item] = error
+        sketch.heap = [(c, i) for i, c in sketch.counts.items()]
+        heapq.heapify(sketch.heap)
+        return sketch
+
+
 class UnhandledTypeError(Exception):
     def __init__(self, outputType):
         self.message = 'Unhandled type {}\n'.format(outputType)
@@ -673,6 +2139,17 @@ class CCStatsJob(MRJob):
     gzpattern = re.compile(r'\.gz$')
     crawlpattern = re.compile(r'(CC-MAIN-2\d{3}-\d{2})')
 
+    # item types of sketches of most frequent items (--top-estimate-size)
+    top_estimate_types = (CST.host.value, CST.domain.value,
+                          CST.surt_domain.value)
+
+    # key of the partial heaps of most frequent hosts and domains passed
+    # from sharded stats reducers to the merge step
+    MOSTFREQUENT = 'mostfrequent'
+
+    # partial result written by the count map task (--checkpoint-dir)
+    checkpoint = None
+
     def configure_args(self):
         """Custom command line options for common crawl index statistics"""
         super(CCStatsJob, self).configure_args()
@@ -700,72 +2177,372 @@ class CCStatsJob(MRJob):
             type=int, default=1,
             help='''Min. number of URLs required per host or domain shown
                     in final statistics (cf. --max-top-hosts-domains).''')
+        self.add_passthru_arg(
+            '--top-estimate-size', dest='top_estimate_size',
+            type=int, default=0,
+            help='''Size of the Space-Saving sketches used by the count job
+                    to estimate the most frequent hosts, domains and SURT
+                    domains (by number of pages) with error bounds, see
+                    CST.top_estimate. Should be a multiple of
+                    --max-top-hosts-domains. Default: 0 (disabled)''')
+        self.add_passthru_arg(
+            '--top-hosts-domains-from-estimate', dest='top_from_estimate',
+            action='store_true', default=False,
+            help='''Stats job: take the most frequent hosts and domains
+                    from the estimates of the count job (requires
+                    --top-estimate-size) instead of ranking all hosts and
+                    domains in the reducer. Host and domain records are
+                    only counted for sizes and histograms in the mapper
+                    and are not contained in the output.''')
+        self.add_passthru_arg(
+            '--stats-reducers', dest='stats_reducers',
+            type=int, default=1,
+            help='''Number of reducers of the stats job. If greater than 1
+                    every reducer keeps partial counters and heaps of the
+                    most frequent hosts and domains which are merged into
+                    a single output file by an additional step.''')
         self.add_passthru_arg(
             '--min-lang-comb-freq', dest='min_lang_comb_freq',
             type=int, default=1,
             help='''Min. number of pages required for a combination of detected
                     languages to be shown in final statistics.''')
+        self.add_passthru_arg(
+            '--mapper-combine-max-keys', dest='mapper_combine_max_keys',
+            type=int, default=50000,
+            help='''Max. number of keys held in memory by the count mapper
+                    to sum up counts of MIME types, languages, TLDs, etc.
+                    before these are emitted (0 disables the in-mapper
+                    combiner)''')
+        self.add_passthru_arg(
+            '--surt-domain-counter', dest='surt_domain_counter',
+            default='dict', choices=['dict', 'compact', 'compact-hashed'],
+            help='''Counters per SURT domain in the count mapper: "dict"
+                    (default), "compact" (array-backed, less memory) or
+                    "compact-hashed" (keeps 64-bit hashes instead of URL
+                    strings, requires --no-exact-counts)''')
+        self.add_passthru_arg(
+            '--surt-domain-max-memory', dest='surt_domain_max_memory',
+            type=int, default=0,
+            help='''Max. memory (MiB, estimated) used to hold the URLs and
+                    digests of a single SURT domain in the count mapper.
+                    If exceeded, URLs and digests are spilled to sorted runs
+                    in temporary files which are merged when the domain
+                    is finished. Default: 0 (no limit). Requires
+                    --surt-domain-counter=dict''')
+        self.add_passthru_arg(
+            '--hyperloglog-encoding', dest='hyperloglog_encoding',
+            default='list', choices=['list', 'packed', 'packed-zlib'],
+            help='''Encoding of HyperLogLog registers in the output: "list"
+                    (default, JSON list of integers), "packed" (base64,
+                    6 bits per register) or "packed-zlib" (base64, packed
+                    and zlib-compressed). All encodings are readable as
+                    input.''')
+        self.add_passthru_arg(
+            '--count-output-codec', dest='count_output_codec',
+            default='bzip2', choices=list(OUTPUT_CODECS),
+            help='''Compression codec of the count job output (default:
+                    bzip2). The codec of input files is detected by the
+                    file name extension (.gz, .bz2, .zst).''')
+        self.add_passthru_arg(
+            '--stats-output-codec', dest='stats_output_codec',
+            default='gzip', choices=list(OUTPUT_CODECS),
+            help='''Compression codec of the stats job output (default:
+                    gzip)''')
+        self.add_passthru_arg(
+            '--json-protocol', dest='json_protocol',
+            default='ujson', choices=['ujson', 'orjson'],
+            help='''JSON library used to encode and decode the records
+                    passed between and written by the steps of the job
+                    (count or stats): "ujson" (default, mrjob's
+                    JSONProtocol) or "orjson" (FastJSONProtocol, faster,
+                    same output, requires the Python module orjson)''')
+        self.add_passthru_arg(
+            '--compact-keys', dest='compact_keys',
+            action='store_true', default=False,
+            help='''Write the keys of the count job in a compact format
+                    (see CompactKeyProtocol) instead of JSON to reduce the
+                    amount of data shuffled and stored. The stats job reads
+                    both formats.''')
         self.add_passthru_arg(
             '--crawl', dest='crawl', default=None,
             help='''ID/name of the crawl analyzed (if not given detected
                     from input path)''')
+        self.add_passthru_arg(
+            '--seen-filter', dest='seen_filter', default=None,
+            help='''Directory holding Bloom filters of URLs and digests
+                    seen in previous crawls (see crawlbloom.py), must be
+                    available on every node. The count mapper outputs the
+                    number of new items per crawl, TLD and SURT domain.
+                    Requires --no-exact-counts''')
+        self.add_passthru_arg(
+            '--cdx-chunks', dest='cdx_chunks',
+            action='store_true', default=False,
+            help='''Input are lists of cdx chunks (one chunk per line,
+                    created by cdx_chunks.py from the cluster.idx) instead
+                    of cdx files. Every chunk is processed by one map task
+                    which allows for more parallelism than one task per
+                    cdx file.''')
+        self.add_passthru_arg(
+            '--parquet-input', dest='parquet_input',
+            action='store_true', default=False,
+            help='''Input are lists of Parquet files of the columnar index
+                    (cc-index table, one file path or URL per line)
+                    instead of cdx files. Every file is processed by one
+                    map task which reads only the needed columns and
+                    takes host names, registered domains and public
+                    suffixes from the precomputed columns. Requires
+                    pyarrow.''')
+        self.add_passthru_arg(
+            '--checkpoint-dir', dest='checkpoint_dir', default=None,
+            help='''Directory (local, shared by all nodes, or on S3) to
+                    store the map output of the count job per cdx file as
+                    partial result (see CountCheckpoint). Partial results
+                    already stored are taken as input instead of the cdx
+                    files by the local runner, for Hadoop see
+                    count_checkpoints.py. Requires cdx files as input.''')
+        self.add_passthru_arg(
+            '--cdx-perf', dest='cdx_perf',
+            action='store_true', default=False,
+            help='''Instrument the count mapper: measure time and
+                    allocated memory blocks per phase (reading, parsing,
+                    counting, output, URL parsing, TLD resolution,
+                    HyperLogLog adds), reported as counters of the group
+                    "cdx-perf" and as JSON report per input''')
+        self.add_passthru_arg(
+            '--cdx-perf-sample', dest='cdx_perf_sample',
+            type=int, default=1,
+            help='''Instrument only every n-th SURT domain to reduce the
+                    overhead of --cdx-perf (default: 1, all SURT
+                    domains)''')
+        self.add_passthru_arg(
+            '--cdx-perf-report-dir', dest='cdx_perf_report_dir',
+            default=None,
+            help='''Local directory to write the JSON reports of
+                    --cdx-perf, one per cdx file, cdx chunk
+                    (<file name>.<offset>-<end>.perf.json) or Parquet
+                    file (<file name>.perf.json). Reports are always
+                    logged.''')
+
+    def make_runner(self):
+        if (self.options.job_to_run == 'stats'
+                and (self.options.runner or 'inline') in ('inline', 'local')):
+            self.options.args = self.decompress_zstd_inputs(self.options.args)
+        return super(CCStatsJob, self).make_runner()
+
+    @staticmethod
+    def decompress_zstd_inputs(paths):
+        """mrjob's local and inline runners decompress only .gz and .bz2
+        input: decompress zstd-compressed count output (*.zst files, see
+        --count-output-codec) to a temporary directory and replace the
+        input paths by the decompressed files"""
+        inputs = []
+        tmp_dir = None
+        for path in paths:
+            if os.path.isdir(path):
+                files = sorted(
+                    os.path.join(path, name) for name in os.listdir(path)
+                    if not name.startswith(('_', '.')))
+            else:
+                files = sorted(glob.glob(path))
+            if not any(f.endswith('.zst') for f in files):
+                inputs.append(path)
+                continue
+            for f in files:
+                if not f.endswith('.zst'):
+                    inputs.append(f)
+                    continue
+                if tmp_dir is None:
+                    import zstandard
+                    tmp_dir = tempfile.mkdtemp(prefix='crawlstats-zstd-')
+                    atexit.register(shutil.rmtree, tmp_dir, True)
+                output = os.path.join(tmp_dir, '{:05d}-{}'.format(
+                    len(inputs), os.path.basename(f)[:-len('.zst')]))
+                LOG.info('Decompressing {}'.format(f))
+                with zstandard.open(f, 'rb') as src, \
+                        open(output, 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+                inputs.append(output)
+        return inputs
 
     def input_protocol(self):
         if self.options.job_to_run != 'stats':
             LOG.debug('Reading text input from cdx files')
             return RawValueProtocol()
         LOG.debug('Reading JSON input from count job')
+        # count job output with JSON or compact keys
+        return CompactKeyProtocol(self.fast_json())
+
+    def internal_protocol(self):
+        return self.json_protocol()
+
+    def output_protocol(self):
+        return self.json_protocol()
+
+    def fast_json(self):
+        if self.options.json_protocol == 'orjson':
+            if orjson is None:
+                raise InputError(
+                    "--json-protocol=orjson requires the module orjson")
+            return True
+        return False
+
+    def json_protocol(self):
+        if self.options.compact_keys:
+            return CompactKeyProtocol(self.fast_json())
+        if self.fast_json():
+            return FastJSONProtocol()
         return JSONProtocol()
 
     def hadoop_input_format(self):
         input_format = self.HADOOP_INPUT_FORMAT
         if self.options.job_to_run != 'stats':
             input_format = 'org.apache.hadoop.mapred.TextInputFormat'
+            if self.options.cdx_chunks or self.options.parquet_input:
+                # one line (cdx chunk or Parquet file) per map task
+                input_format = 'org.apache.hadoop.mapred.lib.NLineInputFormat'
         LOG.info("Setting input format for {} job: {}".format(
             self.options.job_to_run, input_format))
         return input_format
 
+    def increment_counter(self, group, counter, amount=1):
+        if self.checkpoint is not None:
+            self.checkpoint.count(group, counter, amount)
+        super(CCStatsJob, self).increment_counter(group, counter, amount)
+
+    def map_pairs(self, pairs, step_num=0):
+        """Run one map task, with --checkpoint-dir the output of the count
+        mapper is also written to the partial result of the cdx file"""
+        for key, value in super(CCStatsJob, self).map_pairs(pairs, step_num):
+            if self.checkpoint is not None:
+                self.checkpoint.write(key, value)
+            yield key, value
+        if self.checkpoint is not None:
+            self.checkpoint.commit()
+            self.checkpoint = None
+
+    def checkpointed_inputs(self, paths):
+        """Replace the cdx files of the count job by their partial results
+        if these are complete (see CountCheckpoint)"""
+        inputs = []
+        restored = 0
+        for path in paths:
+            checkpoint = CountCheckpoint(self.options.checkpoint_dir, path,
+                                         self.options)
+            if checkpoint.exists():
+                path = checkpoint.path
+                restored += 1
+            inputs.append(path)
+        LOG.info('Partial results of {} of {} cdx files stored in {}'.format(
+            restored, len(paths), self.options.checkpoint_dir))
+        return inputs
+
     def count_mapper_init(self):
         """Because cdx.gz files cannot be split and
         mapreduce.input.fileinputformat.split.minsize is set to a value larger
         than any cdx.gz file, the mapper is guaranteed to process the content
         of a single cdx file. Input lines of a cdx file are sorted by SURT URL
         which allows to aggregate URL counts for one SURT domain in memory.
+        For SURT domains with many millions of URLs, the memory can be
+        bounded by --surt-domain-max-memory (see SpillingSurtDomainCount).
         It may happen that one SURT domain spans over multiple cdx files.
         In this case (and without --exact-counts) the count of unique URLs
         and the URL histograms may be slightly off in case the same URL occurs
         also in a second cdx file. However, this problem is negligible because
-        there are only 300 cdx files."""
+        there are only 300 cdx files. With --cdx-chunks every map task
+        processes one or more chunks of cdx files, SURT domains crossing
+        chunk boundaries are stitched together (see CdxChunk)."""
         self.counters = Counter()
         self.cdx_path = os.environ['mapreduce_map_input_file']
         LOG.info('Reading {0}'.format(self.cdx_path))
-        self.crawl_name = None
         self.crawl = None
-        if self.options.crawl is not None:
-            self.crawl_name = self.options.crawl
-        else:
-            crawl_name_match = self.crawlpattern.search(self.cdx_path)
-            if crawl_name_match is not None:
-                self.crawl_name = crawl_name_match.group(1)
-            else:
-                raise InputError(
-                    "Cannot determine ID of monthly crawl from input path {}"
-                    .format(self.cdx_path))
-        if self.crawl_name is None:
-            raise InputError("Name of crawl not given")
-        self.crawl = MonthlyCrawl.get_by_name(self.crawl_name)
+        if self.options.cdx_chunks and self.options.parquet_input:
+            raise InputError(
+                "--cdx-chunks and --parquet-input are mutually exclusive")
+        self.restored = False
+        if self.options.checkpoint_dir is not None:
+            self.init_checkpoint()
+            if self.restored:
+                self.perf = None
+                return
+        if not (self.options.cdx_chunks or self.options.parquet_input):
+            self.crawl = self.crawl_of(self.cdx_path)
+        if (self.options.exact_counts
+                and self.options.surt_domain_counter == 'compact-hashed'):
+            raise InputError(
+                "--surt-domain-counter=compact-hashed requires"
+                " --no-exact-counts")
+        if (self.options.surt_domain_max_memory > 0
+                and self.options.surt_domain_counter != 'dict'):
+            raise InputError(
+                "--surt-domain-max-memory requires --surt-domain-counter=dict")
+        self.seen_filter = None
+        if self.options.seen_filter is not None:
+            if self.options.exact_counts:
+                raise InputError("--seen-filter requires --no-exact-counts")
+            self.seen_filter = SeenFilter(self.options.seen_filter)
+            self.seen_crawls = set(map(MonthlyCrawl.get_by_name,
+                                       self.seen_filter.crawls))
+            self.new_items = Counter()
         self.fetches_total = 0
         self.pages_total = 0
         self.urls_total = 0
-        self.urls_hll = HyperLogLog(HYPERLOGLOG_ERROR)
-        self.digest_hll = HyperLogLog(HYPERLOGLOG_ERROR)
+        self.urls_hll = NumpyHyperLogLog(HYPERLOGLOG_ERROR)
+        self.digest_hll = NumpyHyperLogLog(HYPERLOGLOG_ERROR)
         self.url_histogram = Counter()
         self.count = None
+        self.combiner = CountCombiner(self.options.mapper_combine_max_keys)
+        self.top_estimates = {}
+        if self.options.top_estimate_size > 0:
+            for item_type in self.top_estimate_types:
+                self.top_estimates[item_type] = SpaceSaving(
+                    self.options.top_estimate_size)
+        self.perf = None
+        if self.options.cdx_perf:
+            self.perf = PhaseCounters(self.options.cdx_perf_sample)
         # first and last SURT may continue in previous/next cdx
         self.min_surt_hll_size = 1
-        self.increment_counter('cdx-stats', 'cdx files processed', 1)
+        if not (self.options.cdx_chunks or self.options.parquet_input):
+            self.increment_counter('cdx-stats', 'cdx files processed', 1)
+
+    def init_checkpoint(self):
+        """Restore the partial result given as input or start to write
+        the partial result of the cdx file (see CountCheckpoint)"""
+        if self.options.cdx_chunks or self.options.parquet_input:
+            raise InputError("--checkpoint-dir requires cdx files as input")
+        if CountCheckpoint.is_partial(self.cdx_path):
+            info = CountCheckpoint.read_info(self.cdx_path)
+            LOG.info('Restoring partial result of {}'.format(info['input']))
+            for group, counter, amount in info['counters']:
+                self.increment_counter(group, counter, amount)
+            self.increment_counter('cdx-stats',
+                                   'cdx files restored from checkpoint', 1)
+            self.restored = True
+            self.read_partial_line = self.internal_protocol().read
+            return
+        checkpoint = CountCheckpoint(self.options.checkpoint_dir,
+                                     self.cdx_path, self.options)
+        checkpoint.open(self.internal_protocol().write)
+        self.checkpoint = checkpoint
+
+    def crawl_of(self, cdx_path):
+        """Crawl (ID) of the cdx file, given by --crawl or detected from
+        the path"""
+        crawl_name = None
+        if self.options.crawl is not None:
+            crawl_name = self.options.crawl
+        else:
+            crawl_name_match = self.crawlpattern.search(cdx_path)
+            if crawl_name_match is not None:
+                crawl_name = crawl_name_match.group(1)
+            else:
+                raise InputError(
+                    "Cannot determine ID of monthly crawl from input path {}"
+                    .format(cdx_path))
+        if crawl_name is None:
+            raise InputError("Name of crawl not given")
+        return MonthlyCrawl.get_by_name(crawl_name)
 
-    def count_mapper(self, _, line):
+    def count_fetch(self):
         self.fetches_total += 1
         if (self.fetches_total % 1000) == 0:
             self.increment_counter('cdx-stats', 'cdx lines read', 1000)
@@ -773,47 +2550,242 @@ class CCStatsJob(MRJob):
                 LOG.info('Read {0} cdx lines'.format(self.fetches_total))
             else:
                 LOG.debug('Read {0} cdx lines'.format(self.fetches_total))
-        parts = line.split(' ')
-        [surt_domain, path] = parts[0].split(')', 1)
+
+    def count_mapper(self, _, line):
+        if self.restored:
+            # map output stored in a partial result
+            yield self.read_partial_line(line.encode('utf-8'))
+            return
+        self.count_fetch()
+        perf = self.perf
+        if perf is not None and perf.active:
+            start = perf.start()
+            surt_domain, path, json_string = CdxParser.split_line(line)
+            perf.stop('split', start)
+        else:
+            surt_domain, path, json_string = CdxParser.split_line(line)
         if self.count is None:
-            self.count = SurtDomainCount(surt_domain)
+            self.count = self.surt_domain_count(surt_domain)
         if surt_domain != self.count.surt_domain:
             # output accumulated statistics for one SURT domain
-            for pair in self.count.output(self.crawl,
-                                          self.options.exact_counts,
-                                          self.min_surt_hll_size):
+            for pair in self.output_surt_domain(self.min_surt_hll_size):
                 yield pair
-            self.urls_total += self.count.unique_urls()
-            for url, cnt in self.count.url.items():
-                self.urls_hll.add(url)
-                self.url_histogram[cnt] += 1
-            for digest in self.count.digest:
-                self.digest_hll.add(digest)
-            self.pages_total += self.count.pages
-            self.count = SurtDomainCount(surt_domain)
+            self.count = self.surt_domain_count(surt_domain)
             self.min_surt_hll_size = MIN_SURT_HLL_SIZE
-        json_string = ' '.join(parts[2:])
         try:
-            metadata = ujson.loads(json_string)
-            self.count.add(path, metadata)
+            if perf is not None and perf.active:
+                start = perf.start()
+                metadata = ujson.loads(json_string)
+                perf.stop('json', start)
+                start = perf.start()
+                self.count.add(path, metadata)
+                perf.stop('add', start)
+            else:
+                metadata = ujson.loads(json_string)
+                self.count.add(path, metadata)
         except ValueError as e:
             LOG.error('Failed to parse json: {0} - {1}'.format(
                 e, json_string))
 
+    def count_chunk_mapper(self, _, line):
+        """Count the lines of one cdx chunk (see CdxChunk), the SURT
+        domains are finished at the end of the chunk"""
+        chunk = CdxChunk.from_line(line)
+        LOG.info('Reading chunk {} (bytes {}-{})'.format(
+            chunk.path, chunk.offset, chunk.end))
+        self.set_crawl(chunk.path)
+        fetches = self.fetches_total
+        # the first SURT domain may continue in the previous cdx file,
+        # but not in the previous chunk of the same file
+        self.min_surt_hll_size = 1 if chunk.first else MIN_SURT_HLL_SIZE
+        for cdx_line in self.timed_read(chunk.lines()):
+            for pair in self.count_mapper(None, cdx_line):
+                yield pair
+        if self.count is not None:
+            for cdx_line in self.timed_read(
+                    chunk.continuation(self.count.surt_domain)):
+                for pair in self.count_mapper(None, cdx_line):
+                    yield pair
+            for pair in self.output_surt_domain(
+                    1 if chunk.last else self.min_surt_hll_size):
+                yield pair
+            self.count = None
+            self.increment_counter('cdx-stats', 'cdx chunks processed', 1)
+        if self.perf is not None:
+            self.report_perf(chunk.path, self.fetches_total - fetches,
+                             (chunk.offset, chunk.end))
+
+    def count_parquet_mapper(self, _, line):
+        """Count the captures of one Parquet file of the columnar index
+        (see ParquetIndexReader), the SURT domains are finished at the
+        end of the file"""
+        path = line.strip()
+        LOG.info('Reading {}'.format(path))
+        self.set_crawl(path)
+        fetches = self.fetches_total
+        # first and last SURT domain may continue in previous/next file
+        self.min_surt_hll_size = 1
+        perf = self.perf
+        for surt_url, metadata, scheme, host, domain, suffix in \
+                self.timed_read(ParquetIndexReader(path).records()):
+            self.count_fetch()
+            surt_domain, surt_path = surt_url.split(')', 1)
+            if self.count is None:
+                self.count = self.surt_domain_count(surt_domain)
+            if surt_domain != self.count.surt_domain:
+                for pair in self.output_surt_domain(self.min_surt_hll_size):
+                    yield pair
+                self.count = self.surt_domain_count(surt_domain)
+                self.min_surt_hll_size = MIN_SURT_HLL_SIZE
+            self.count.hosts.add(metadata['url'], scheme, host, domain,
+                                 suffix)
+            if perf is not None and perf.active:
+                start = perf.start()
+                self.count.add(surt_path, metadata)
+                perf.stop('add', start)
+            else:
+                self.count.add(surt_path, metadata)
+        if self.count is not None:
+            for pair in self.output_surt_domain(1):
+                yield pair
+            self.count = None
+            self.increment_counter('cdx-stats', 'parquet files processed',
+                                   1)
+        if self.perf is not None:
+            self.report_perf(path, self.fetches_total - fetches)
+
+    def set_crawl(self, path):
+        """Set the crawl of the map task from the path of an input
+        (chunk or file) given in the map input"""
+        crawl = self.crawl_of(path)
+        if self.crawl is None:
+            self.crawl = crawl
+        elif crawl != self.crawl:
+            raise InputError(
+                "Inputs of different crawls in one map task: {}"
+                .format(path))
+
+    def timed_read(self, lines):
+        """Measure reading and decompression of cdx lines (--cdx-perf)"""
+        if self.perf is None:
+            return lines
+        return self.perf.timed('read', lines)
+
+    def surt_domain_count(self, surt_domain):
+        perf = None
+        if self.perf is not None and self.perf.next_unit():
+            perf = self.perf
+        hosts = None
+        if self.options.parquet_input:
+            hosts = PrecomputedHosts()
+        if self.options.surt_domain_counter == 'compact':
+            return CompactSurtDomainCount(surt_domain, perf=perf,
+                                          hosts=hosts)
+        if self.options.surt_domain_counter == 'compact-hashed':
+            return CompactSurtDomainCount(surt_domain, url_hashes=True,
+                                          perf=perf, hosts=hosts)
+        if self.options.surt_domain_max_memory > 0:
+            max_items = (self.options.surt_domain_max_memory * 1024 * 1024
+                         // SpillingSurtDomainCount.BYTES_PER_ITEM)
+            return SpillingSurtDomainCount(surt_domain, max_items, perf=perf,
+                                           hosts=hosts)
+        return SurtDomainCount(surt_domain, perf, hosts)
+
+    def output_surt_domain(self, min_surt_hll_size):
+        """Output counts of current SURT domain and add them
+        to the totals of the cdx file"""
+        perf = self.count.perf
+        pairs = self.count.output(
+            self.crawl, self.options.exact_counts, min_surt_hll_size,
+            self.options.hyperloglog_encoding)
+        if perf is not None:
+            pairs = perf.timed('output', pairs)
+        if self.top_estimates:
+            pairs = self.update_top_estimates(pairs)
+        for pair in self.combine(pairs):
+            yield pair
+        self.urls_total += self.count.unique_urls()
+        if perf is not None:
+            start = perf.start()
+        self.count.update_totals(self.urls_hll, self.digest_hll,
+                                 self.url_histogram)
+        if perf is not None:
+            perf.stop('hll', start)
+        self.pages_total += self.count.pages
+        if self.seen_filter is not None:
+            if perf is not None:
+                pairs = perf.timed('new-items', self.count_new_items())
+            else:
+                pairs = self.count_new_items()
+            for pair in pairs:
+                yield pair
+        if isinstance(self.count, SpillingSurtDomainCount):
+            self.count.close()
+
+    def count_new_items(self):
+        """Look up URLs and digests of the current SURT domain in the
+        filter of items seen before, output the number of new items"""
+        surt_domain = self.count.surt_domain
+        if self.crawl in self.seen_crawls:
+            raise InputError(
+                "Crawl {} already added to --seen-filter".format(
+                    MonthlyCrawl.to_name(self.crawl)))
+        tld = PublicSuffixResolver.default().resolve('.'.join(
+            reversed(surt_domain.split(':')[0].split(','))))
+        tld = '(ip address)' if tld[2] else tld[1]
+        for item_type, fingerprints in (
+                (CST.url, self.count.url_fingerprints()),
+                (CST.digest, self.count.digest_fingerprints())):
+            new = int(numpy.count_nonzero(
+                ~self.seen_filter.contains(item_type.name, fingerprints)))
+            if new == 0:
+                continue
+            if item_type == CST.url:
+                self.new_items[(CST.new_items.value, item_type.value,
+                                self.crawl)] += new
+            self.new_items[(CST.new_items_for.value, CST.tld.value, tld,
+                            item_type.value, self.crawl)] += new
+            yield((CST.new_items_for.value, CST.surt_domain.value,
+                   surt_domain, item_type.value, self.crawl), new)
+
+    def update_top_estimates(self, pairs):
+        """Add the page counts of hosts, domains and SURT domains to the
+        sketches of most frequent items"""
+        for key, value in pairs:
+            if key[0] in self.top_estimates:
+                self.top_estimates[key[0]].update(
+                    key[1], MultiCount.get_count(0, value))
+            yield key, value
+
+    def combine(self, pairs):
+        """Pass key-value pairs through the in-mapper combiner"""
+        for key, value in pairs:
+            if not self.combiner.add(key, value):
+                yield key, value
+        if self.combiner.is_full():
+            for pair in self.combiner.flush():
+                yield pair
+
     def count_mapper_final(self):
+        if self.restored:
+            return
         self.increment_counter('cdx-stats',
                                'cdx lines read', self.fetches_total % 1000)
-        if self.count is None:
+        if self.count is not None:
+            for pair in self.output_surt_domain(1):
+                yield pair
+        if self.fetches_total == 0:
             return
-        for pair in self.count.output(self.crawl, self.options.exact_counts, 1):
+        for pair in self.combiner.flush():
             yield pair
-        self.urls_total += self.count.unique_urls()
-        for url, cnt in self.count.url.items():
-            self.urls_hll.add(url)
-            self.url_histogram[cnt] += 1
-        for digest in self.count.digest:
-            self.digest_hll.add(digest)
-        self.pages_total += self.count.pages
+        if self.combiner.records_in > 0:
+            LOG.info('Combined {} records into {} ({:.1f}x reduction)'.format(
+                self.combiner.records_in, self.combiner.records_out,
+                self.combiner.records_in / self.combiner.records_out))
+            self.increment_counter('cdx-stats', 'combiner records in',
+                                   self.combiner.records_in)
+            self.increment_counter('cdx-stats', 'combiner records out',
+                                   self.combiner.records_out)
         if not self.options.exact_counts:
             for count, frequency in self.url_histogram.items():
                 yield((CST.histogram.value, CST.url.value, self.crawl,
@@ -823,18 +2795,59 @@ class CCStatsJob(MRJob):
         if not self.options.exact_counts:
             yield (CST.size.value, CST.url.value, self.crawl), self.urls_total
         yield((CST.size_estimate.value, CST.url.value, self.crawl),
-              CrawlStatsJSONEncoder.json_encode_hyperloglog(self.urls_hll))
+              self.encode_hyperloglog(self.urls_hll))
         yield((CST.size_estimate.value, CST.digest.value, self.crawl),
-              CrawlStatsJSONEncoder.json_encode_hyperloglog(self.digest_hll))
+              self.encode_hyperloglog(self.digest_hll))
+        if self.seen_filter is not None:
+            for key, count in self.new_items.items():
+                yield key, count
+        for item_type, sketch in self.top_estimates.items():
+            if len(sketch) > 0:
+                yield((CST.top_estimate.value, item_type, self.crawl),
+                      sketch.to_json())
+        if self.perf is not None and not (self.options.cdx_chunks
+                                          or self.options.parquet_input):
+            # chunks and Parquet files are reported by the mapper
+            self.report_perf(self.cdx_path, self.fetches_total)
         self.increment_counter('cdx-stats', 'cdx files finished', 1)
 
+    def report_perf(self, input_path, cdx_lines, byte_range=None):
+        """Export the measurements of --cdx-perf for one input (cdx file,
+        byte range of a cdx chunk or Parquet file) as counters and JSON
+        report, and start new measurements for the next input"""
+        self.increment_counter('cdx-perf', 'sampled surt domains',
+                               self.perf.sampled_units)
+        for counter, amount in self.perf.counters():
+            self.increment_counter('cdx-perf', counter, amount)
+        report = self.perf.report()
+        report['input'] = input_path
+        report_name = os.path.basename(input_path)
+        if byte_range is not None:
+            report['byte_range'] = list(byte_range)
+            report_name += '.{}-{}'.format(*byte_range)
+        report['cdx_lines'] = cdx_lines
+        report = json.dumps(report, sort_keys=True)
+        LOG.info('cdx-perf report: {}'.format(report))
+        if self.options.cdx_perf_report_dir is not None:
+            os.makedirs(self.options.cdx_perf_report_dir, exist_ok=True)
+            path = os.path.join(self.options.cdx_perf_report_dir,
+                                report_name + '.perf.json')
+            with open(path, 'w') as f:
+                f.write(report + '\n')
+        self.perf = PhaseCounters(self.options.cdx_perf_sample)
+
+    def encode_hyperloglog(self, hll):
+        return CrawlStatsJSONEncoder.json_encode_hyperloglog(
+            hll, self.options.hyperloglog_encoding)
+
     def reducer_init(self):
         self.counters = Counter()
         self.mostfrequent = defaultdict(list)
 
     def count_reducer(self, key, values):
         outputType = key[0]
-        if outputType in (CST.size.value, CST.size_robotstxt.value):
+        if outputType in (CST.size.value, CST.size_robotstxt.value,
+                          CST.new_items.value, CST.new_items_for.value):
             yield key, sum(values)
         elif outputType == CST.histogram.value:
             yield key, sum(values)
@@ -876,19 +2889,28 @@ class CCStatsJob(MRJob):
                             CST.primary_language.value,
                             CST.scheme.value,
                             CST.tld.value,
-                            CST.domain.value,
-                            CST.surt_domain.value,
-                            CST.host.value,
                             CST.http_status.value,
                             CST.robotstxt_status.value):
+            # few keys with many values
+            yield key, MultiCount.sum_values_batched(values)
+        elif outputType in (CST.domain.value,
+                            CST.surt_domain.value,
+                            CST.host.value):
             yield key, MultiCount.sum_values(values)
+        elif outputType == CST.top_estimate.value:
+            sketch = None
+            for val in values:
+                if sketch is None:
+                    sketch = SpaceSaving.from_json(val)
+                else:
+                    sketch.merge(SpaceSaving.from_json(val))
+            yield key, sketch.to_json()
         elif outputType == CST.size_estimate.value:
-            hll = HyperLogLog(HYPERLOGLOG_ERROR)
+            hll = NumpyHyperLogLog(HYPERLOGLOG_ERROR)
             for val in values:
                 hll.update(
                     CrawlStatsJSONDecoder.json_decode_hyperloglog(val))
-            yield(key,
-                  CrawlStatsJSONEncoder.json_encode_hyperloglog(hll))
+            yield key, self.encode_hyperloglog(hll)
         elif outputType == CST.size_estimate_for.value:
             res = None
             hll = None
@@ -903,7 +2925,7 @@ class CCStatsJob(MRJob):
                 else:
                     res = val
             if hll is not None and cnt >= MIN_SURT_HLL_SIZE:
-                yield(key, (cnt, CrawlStatsJSONEncoder.json_encode_hyperloglog(hll)))
+                yield(key, (cnt, self.encode_hyperloglog(hll)))
             elif res[0] >= MIN_SURT_HLL_SIZE:
                 yield(key, res)
         else:
@@ -916,7 +2938,11 @@ class CCStatsJob(MRJob):
         if key[0] in (CST.url.value, CST.digest.value,
                       CST.size_estimate_for.value):
             return
-        if ((self.options.min_domain_frequency > 1) and
+        if (key[0] == CST.new_items_for.value
+                and key[1] == CST.surt_domain.value):
+            return
+        if ((self.options.min_domain_frequency > 1
+             or self.options.top_from_estimate) and
             (key[0] in (CST.host.value, CST.domain.value,
                         CST.surt_domain.value))):
             # quick skip of infrequent host and domains,
@@ -932,7 +2958,8 @@ class CCStatsJob(MRJob):
                 host_count = MultiCount.get_count(2, value)
                 self.counters[(CST.histogram.value, key[0],
                                key[2], CST.host.value, host_count)] += 1
-            if url_count < self.options.min_domain_frequency:
+            if (url_count < self.options.min_domain_frequency
+                    or self.options.top_from_estimate):
                 return
         if key[0] == CST.languages.value:
             # yield only frequent language combinations (if configured)
@@ -949,8 +2976,18 @@ class CCStatsJob(MRJob):
 
     def stats_reducer(self, key, values):
         outputType = CST(key[0])
+        if outputType == CST.new_items_for:
+            yield((outputType.name, CST(key[1]).name, key[2],
+                   CST(key[3]).name, MonthlyCrawl.to_name(key[4])),
+                  sum(values))
+            return
         item = key[1]
         crawl = MonthlyCrawl.to_name(key[2])
+        if outputType == CST.top_estimate:
+            for val in values:
+                yield((outputType.name, CST(item).name, crawl),
+                      val[2][:self.options.max_hosts])
+            return
         if outputType in (CST.size, CST.new_items,
                           CST.size_estimate, CST.size_robotstxt):
             verbose_key = (outputType.name, CST(item).name, crawl)
@@ -976,7 +3013,8 @@ class CCStatsJob(MRJob):
                 url_count = MultiCount.get_count(1, counts)
                 if outputType in (CST.domain, CST.surt_domain, CST.tld):
                     host_count = MultiCount.get_count(2, counts)
-                if (self.options.min_domain_frequency <= 1 or
+                if ((self.options.min_domain_frequency <= 1
+                     and not self.options.top_from_estimate) or
                     outputType not in (CST.host, CST.domain,
                                        CST.surt_domain)):
                     self.counters[(CST.size.name, outputType.name, crawl)] += 1
@@ -996,16 +3034,43 @@ class CCStatsJob(MRJob):
                     outVal = (page_count, url_count, item)
                     if outputType in (CST.domain, CST.surt_domain):
                         outVal = (page_count, url_count, host_count, item)
-                    # take most common
-                    if len(self.mostfrequent[outKey]) < self.options.max_hosts:
-                        heapq.heappush(self.mostfrequent[outKey], outVal)
-                    else:
-                        heapq.heappushpop(self.mostfrequent[outKey], outVal)
+                    self.add_mostfrequent(outKey, outVal)
                 else:
                     yield((outputType.name, item, crawl), counts)
         else:
             raise UnhandledTypeError(outputType)
 
+    def add_mostfrequent(self, key, value):
+        # take most common
+        if len(self.mostfrequent[key]) < self.options.max_hosts:
+            heapq.heappush(self.mostfrequent[key], value)
+        else:
+            heapq.heappushpop(self.mostfrequent[key], value)
+
+    def stats_shard_reducer_final(self):
+        """Output partial counters and the local heaps of most frequent
+        hosts and domains of one of multiple stats reducers, combined
+        by stats_merge_reducer"""
+        for (counter, count) in self.counters.items():
+            yield counter, count
+        for (outputType, crawl), mostfrequent in self.mostfrequent.items():
+            yield (self.MOSTFREQUENT, outputType, crawl), mostfrequent
+
+    def stats_merge_reducer(self, key, values):
+        """Merge the output of multiple stats reducers: sum up partial
+        counters and select the most frequent hosts and domains from the
+        local heaps"""
+        if key[0] == self.MOSTFREQUENT:
+            for mostfrequent in values:
+                for value in mostfrequent:
+                    self.add_mostfrequent((key[1], key[2]), tuple(value))
+        elif key[0] in (CST.size.name, CST.size_robotstxt.name,
+                        CST.histogram.name):
+            yield key, sum(values)
+        else:
+            for value in values:
+                yield key, value
+
     def reducer_final(self):
         for (counter, count) in self.counters.items():
             yield counter, count
@@ -1020,6 +3085,15 @@ class CCStatsJob(MRJob):
                     yield((outputType, item, crawl),
                           MultiCount.compress(2, [pages, urls]))
 
+    @staticmethod
+    def output_codec_jobconf(codec):
+        codec_class, _ = OUTPUT_CODECS[codec]
+        if codec_class is None:
+            return {'mapreduce.output.fileoutputformat.compress': "false"}
+        return {'mapreduce.output.fileoutputformat.compress': "true",
+                'mapreduce.output.fileoutputformat.compress.codec':
+                    codec_class}
+
     def steps(self):
         reduces = 10
         cdxminsplitsize = 2**32  # do not split cdx map input files
@@ -1027,20 +3101,31 @@ class CCStatsJob(MRJob):
             # with exact counts need many reducers to aggregate the counts
             # in reasonable time and to get not too large partitions
             reduces = 200
+        count_mapper = self.count_mapper
+        count_jobconf = {'mapreduce.job.reduces': reduces}
+        count_jobconf.update(
+            self.output_codec_jobconf(self.options.count_output_codec))
+        if self.options.cdx_chunks or self.options.parquet_input:
+            if self.options.cdx_chunks:
+                count_mapper = self.count_chunk_mapper
+            else:
+                count_mapper = self.count_parquet_mapper
+            count_jobconf['mapreduce.input.lineinputformat.linespermap'] = 1
+            count_jobconf['stream.map.input.ignoreKey'] = "true"
+        else:
+            count_jobconf['mapreduce.input.fileinputformat.split.minsize'] = \
+                cdxminsplitsize
         count_job = \
             MRStep(mapper_init=self.count_mapper_init,
-                   mapper=self.count_mapper,
+                   mapper=count_mapper,
                    mapper_final=self.count_mapper_final,
                    reducer_init=self.reducer_init,
                    reducer=self.count_reducer,
                    reducer_final=self.reducer_final,
-                   jobconf={'mapreduce.job.reduces': reduces,
-                            'mapreduce.input.fileinputformat.split.minsize':
-                                cdxminsplitsize,
-                            'mapreduce.output.fileoutputformat.compress':
-                                "true",
-                            'mapreduce.output.fileoutputformat.compress.codec':
-                                'org.apache.hadoop.io.compress.BZip2Codec'})
+                   jobconf=count_jobconf)
+        stats_jobconf = {'mapreduce.job.reduces': 1}
+        stats_jobconf.update(
+            self.output_codec_jobconf(self.options.stats_output_codec))
         stats_job = \
             MRStep(mapper_init=self.stats_mapper_init,
                    mapper=self.stats_mapper,
@@ -1048,16 +3133,31 @@ class CCStatsJob(MRJob):
                    reducer_init=self.reducer_init,
                    reducer=self.stats_reducer,
                    reducer_final=self.reducer_final,
-                   jobconf={'mapreduce.job.reduces': 1,
-                            'mapreduce.output.fileoutputformat.compress':
-                                "true",
-                            'mapreduce.output.fileoutputformat.compress.codec':
-                                'org.apache.hadoop.io.compress.GzipCodec'})
+                   jobconf=stats_jobconf)
+        stats_jobs = [stats_job]
+        if self.options.stats_reducers > 1:
+            # sharded: multiple reducers keep partial counters and heaps,
+            # merged into a single output file by the last step
+            stats_job = \
+                MRStep(mapper_init=self.stats_mapper_init,
+                       mapper=self.stats_mapper,
+                       mapper_final=self.stats_mapper_final,
+                       reducer_init=self.reducer_init,
+                       reducer=self.stats_reducer,
+                       reducer_final=self.stats_shard_reducer_final,
+                       jobconf={'mapreduce.job.reduces':
+                                self.options.stats_reducers})
+            merge_job = \
+                MRStep(reducer_init=self.reducer_init,
+                       reducer=self.stats_merge_reducer,
+                       reducer_final=self.reducer_final,
+                       jobconf=stats_jobconf)
+            stats_jobs = [stats_job, merge_job]
         if self.options.job_to_run == 'count':
             return [count_job]
         if self.options.job_to_run == 'stats':
-            return [stats_job]
-        return [count_job, stats_job]
+            return stats_jobs
+        return [count_job] + stats_jobs
 
 
 if __name__ == '__main__':
@@ -0,0 +1,257 @@
+"""Run the count step of CCStatsJob on a single multi-core machine.
+
+The cdx files are distributed over a process pool, one cdx file per map
+task, so that the per-file assumptions of the count mapper (input sorted
+by SURT, see CCStatsJob.count_mapper_init) still hold. Every map task
+partitions its output by a hash of the serialized key and writes sorted
+runs, one per partition. The partitions are then reduced in parallel by
+merging the sorted runs, and every reduce task writes one part file
+(part-00000.bz2, ...) in the same format as the Hadoop count job,
+compressed by the codec given by --count-output-codec.
+
+Options not known to the local runner are passed to CCStatsJob, e.g.
+  python3 crawlstats_local.py --processes 64 --output-dir count/ \\
+          --no-exact-counts cdx-*.gz
+With --parquet-input, the inputs are Parquet files of the columnar index
+(one file per map task) instead of cdx files. With --checkpoint-dir=DIR,
+the map output of every cdx file is stored as partial result, cdx files
+with a stored partial result are skipped when the runner is started again
+(see crawlstats.CountCheckpoint).
+"""
+
+import argparse
+import bz2
+import glob
+import gzip
+import heapq
+import itertools
+import os
+import shutil
+import tempfile
+import zlib
+
+from collections import Counter
+from multiprocessing import Pool
+
+from crawlstats import CCStatsJob, CdxChunk, CdxParser, LOG
+from crawlstats import OUTPUT_CODECS
+
+
+class LocalCCStatsJob(CCStatsJob):
+    """CCStatsJob collecting counters in memory instead of writing them
+    to stderr in the Hadoop streaming format"""
+
+    def __init__(self, args=None):
+        super(LocalCCStatsJob, self).__init__(args)
+        self.local_counters = Counter()
+
+    def increment_counter(self, group, counter, amount=1):
+        if self.checkpoint is not None:
+            self.checkpoint.count(group, counter, amount)
+        self.local_counters[(group, counter)] += amount
+
+
+class LocalCountRunner:
+    """Process pool based runner for the count step"""
+
+    # max. size of buffered map output (bytes) before a sorted run
+    # is written to disk
+    DEFAULT_MAP_BUFFER_SIZE = 256 * 1024 * 1024
+
+    def __init__(self, job_args, output_dir, processes=None, reducers=None,
+                 tmp_dir=None, map_buffer_size=DEFAULT_MAP_BUFFER_SIZE):
+        self.job_args = ['--job=count'] + list(job_args)
+        self.output_dir = output_dir
+        self.processes = processes or os.cpu_count()
+        self.reducers = reducers
+        job = LocalCCStatsJob(self.job_args)
+        if self.reducers is None:
+            # same number of partitions as the Hadoop job
+            self.reducers = int(
+                job.steps()[0]['jobconf']['mapreduce.job.reduces'])
+        self.output_codec = job.options.count_output_codec
+        self.job = job
+        self.tmp_dir = tmp_dir
+        self.map_buffer_size = map_buffer_size
+        self.counters = Counter()
+
+    def run(self, inputs):
+        os.makedirs(self.output_dir, exist_ok=True)
+        if self.job.options.checkpoint_dir is not None:
+            inputs = self.job.checkpointed_inputs(inputs)
+        work_dir = tempfile.mkdtemp(prefix='crawlstats-local-',
+                                    dir=self.tmp_dir)
+        try:
+            map_tasks = [(self.job_args, path, work_dir, task_id,
+                          self.reducers, self.map_buffer_size)
+                         for task_id, path in enumerate(inputs)]
+            LOG.info('Running {} map tasks in {} processes'.format(
+                len(map_tasks), self.processes))
+            with Pool(processes=self.processes) as pool:
+                runs = [[] for _ in range(self.reducers)]
+                for counters, task_runs in pool.imap_unordered(
+                        _map_task, map_tasks):
+                    self.counters.update(counters)
+                    for partition, run in task_runs:
+                        runs[partition].append(run)
+                extension = OUTPUT_CODECS[self.output_codec][1]
+                reduce_tasks = [(self.job_args, runs[partition],
+                                 os.path.join(self.output_dir,
+                                              'part-{:05d}{}'.format(
+                                                  partition, extension)),
+                                 self.output_codec)
+                                for partition in range(self.reducers)]
+                LOG.info('Running {} reduce tasks'.format(len(reduce_tasks)))
+                for counters in pool.imap_unordered(_reduce_task,
+                                                    reduce_tasks):
+                    self.counters.update(counters)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        self.log_counters()
+        return self.counters
+
+    def log_counters(self):
+        LOG.info('Counters: {}'.format(len(self.counters)))
+        for group, counters in itertools.groupby(sorted(self.counters),
+                                                 key=lambda c: c[0]):
+            LOG.info('\t{}'.format(group))
+            for counter in counters:
+                LOG.info('\t\t{}={}'.format(counter[1],
+                                            self.counters[counter]))
+
+
+def partition_of(raw_key, num_partitions):
+    """Partition of a serialized key, stable across processes (unlike
+    Python's randomized string hash)"""
+    return zlib.crc32(raw_key) % num_partitions
+
+
+def open_output(path, codec):
+    """Open an output file for writing, compressed by the codec (see
+    crawlstats.OUTPUT_CODECS)"""
+    if codec == 'gzip':
+        return gzip.open(path, 'wb')
+    if codec == 'bzip2':
+        return bz2.open(path, 'wb')
+    if codec == 'zstd':
+        import zstandard
+        return zstandard.open(path, 'wb')
+    return open(path, 'wb')
+
+
+def _write_run(lines, path):
+    lines.sort()
+    with gzip.open(path, 'wb', compresslevel=1) as run:
+        run.writelines(lines)
+
+
+def _map_task(task):
+    (job_args, cdx_path, work_dir, task_id,
+     num_partitions, map_buffer_size) = task
+    job = LocalCCStatsJob(job_args)
+    read_line, write_line = job.pick_protocols(0, 'mapper')
+    os.environ['mapreduce_map_input_file'] = cdx_path
+    buffers = [[] for _ in range(num_partitions)]
+    buffered = 0
+    runs = []
+
+    def spill():
+        for partition, lines in enumerate(buffers):
+            if not lines:
+                continue
+            run = os.path.join(work_dir, 'map-{:05d}-{:05d}-{:03d}.gz'.format(
+                task_id, partition, len(runs)))
+            _write_run(lines, run)
+            runs.append((partition, run))
+            buffers[partition] = []
+
+    def emit(pairs):
+        nonlocal buffered
+        for key, value in pairs:
+            line = write_line(key, value) + b'\n'
+            raw_key = line.split(b'\t', 1)[0]
+            buffers[partition_of(raw_key, num_partitions)].append(line)
+            buffered += len(line)
+            if buffered > map_buffer_size:
+                spill()
+                buffered = 0
+
+    def read_input():
+        # read lazily, after the mapper is initialized by map_pairs
+        cdx = CdxChunk.open(cdx_path, 0)
+        try:
+            for line in job.timed_read(CdxParser.read_lines(cdx)):
+                yield read_line(line.rstrip(b'\r'))
+        finally:
+            cdx.close()
+
+    if job.options.parquet_input:
+        # input file is a Parquet file, not a list of files
+        emit(job.map_pairs([(None, cdx_path)]))
+    else:
+        emit(job.map_pairs(read_input()))
+    spill()
+    return job.local_counters, runs
+
+
+def _reduce_task(task):
+    job_args, runs, output_path, codec = task
+    job = LocalCCStatsJob(job_args)
+    read_line, write_line = job.pick_protocols(0, 'reducer')
+    job.reducer_init()
+    inputs = [gzip.open(run, 'rb') for run in runs]
+    try:
+        with open_output(output_path, codec) as output:
+            merged = heapq.merge(*inputs)
+            for _, lines in itertools.groupby(
+                    merged, key=lambda line: line.split(b'\t', 1)[0]):
+                line = next(lines)
+                key, value = read_line(line.rstrip(b'\n'))
+                values = itertools.chain(
+                    [value],
+                    (read_line(line.rstrip(b'\n'))[1]
+                     for line in lines))
+                for pair in job.count_reducer(key, values):
+                    output.write(write_line(*pair) + b'\n')
+            for pair in job.reducer_final():
+                output.write(write_line(*pair) + b'\n')
+    finally:
+        for run in inputs:
+            run.close()
+    return job.local_counters
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run the count job on a single machine',
+        epilog='Other options are passed to crawlstats.py --job=count')
+    parser.add_argument('--output-dir', required=True,
+                        help='Output directory (part-* files)')
+    parser.add_argument('--processes', type=int, default=None,
+                        help='Number of worker processes (default: all CPUs)')
+    parser.add_argument('--reducers', type=int, default=None,
+                        help='Number of reduce partitions / output files'
+                        ' (default: same as Hadoop job)')
+    parser.add_argument('--tmp-dir', default=None,
+                        help='Directory for temporary map output')
+    parser.add_argument('--map-buffer-mb', type=int,
+                        default=(LocalCountRunner.DEFAULT_MAP_BUFFER_SIZE
+                                 // 1024 // 1024),
+                        help='Max. size of buffered output per map task'
+                        ' before sorted runs are written to disk')
+    parser.add_argument('input', nargs='+',
+                        help='cdx files or glob patterns')
+    args, job_args = parser.parse_known_args()
+    inputs = []
+    for pattern in args.input:
+        inputs.extend(sorted(glob.glob(pattern)) or [pattern])
+    runner = LocalCountRunner(job_args, args.output_dir,
+                              processes=args.processes,
+                              reducers=args.reducers,
+                              tmp_dir=args.tmp_dir,
+                              map_buffer_size=args.map_buffer_mb*1024*1024)
+    runner.run(inputs)
+
+
+if __name__ == '__main__':
+    main()
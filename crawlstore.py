@@ -0,0 +1,274 @@
+"""Columnar store of aggregated crawl statistics.
+
+The output of the stats job (one compressed file per crawl, lines of
+tab-separated JSON key and value) is converted once into Parquet files,
+partitioned by statistics type (CST) and crawl:
+  <store>/cst=<type>/crawl=<crawl>/data.parquet
+
+Every record keeps its key and value as JSON text (so that plots read
+exactly the same data as from the stats files), together with typed
+columns for direct use in queries:
+  item        second element of the key (MIME type, TLD, etc.)
+  count       value if the value is a number, otherwise the first count
+              (pages) of a list of counts
+  url_count   second count (unique URLs), if the value is a list
+  host_count  third count (hosts), if the value is a list of three counts
+  typed       key and value are given by type, crawl and the typed
+              columns, plots read such records without JSON decoding
+              (see StatsStore.records)
+
+New crawls are added incrementally: a stats file is ingested again only
+if its size or modification time has changed. Usage:
+  python3 crawlstore.py --store stats/store stats/CC-MAIN-*
+"""
+
+import argparse
+import glob
+import json
+import logging
+import os
+import re
+import shutil
+
+from collections import defaultdict
+
+import fsspec
+import pyarrow
+import pyarrow.parquet
+
+
+LOG = logging.getLogger('CrawlStatsStore')
+
+
+class StatsStore:
+    """Parquet store of crawl statistics, partitioned by type and crawl"""
+
+    SCHEMA = pyarrow.schema([
+        ('key', pyarrow.string()),
+        ('value', pyarrow.string()),
+        ('item', pyarrow.string()),
+        ('count', pyarrow.int64()),
+        ('url_count', pyarrow.int64()),
+        ('host_count', pyarrow.int64()),
+        ('typed', pyarrow.bool_()),
+    ])
+
+    TYPED_COLUMNS = ['item', 'count', 'url_count', 'host_count']
+
+    SOURCES_FILE = '_sources.json'
+
+    crawl_pattern = re.compile(r'(CC-MAIN-\d+(?:-\d+)?)')
+
+    def __init__(self, path):
+        self.path = path
+
+    @staticmethod
+    def type_name(cst):
+        """Name of a statistics type, given as CST or string"""
+        return getattr(cst, 'name', cst)
+
+    def partition_path(self, cst, crawl):
+        return os.path.join(self.path, 'cst=' + self.type_name(cst),
+                            'crawl=' + crawl, 'data.parquet')
+
+    def read_sources(self):
+        sources_file = os.path.join(self.path, self.SOURCES_FILE)
+        if not os.path.exists(sources_file):
+            return {}
+        with open(sources_file) as f:
+            return json.load(f)
+
+    def write_sources(self, sources):
+        os.makedirs(self.path, exist_ok=True)
+        with open(os.path.join(self.path, self.SOURCES_FILE), 'w') as f:
+            json.dump(sources, f, indent=1, sort_keys=True)
+
+    def types(self):
+        """Statistics types held in the store"""
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(d[4:] for d in os.listdir(self.path)
+                      if d.startswith('cst='))
+
+    def crawls(self, cst):
+        """Crawls held in the store for one statistics type"""
+        type_path = os.path.join(self.path, 'cst=' + self.type_name(cst))
+        if not os.path.isdir(type_path):
+            return []
+        return sorted(d[6:] for d in os.listdir(type_path)
+                      if d.startswith('crawl='))
+
+    def ingest(self, stats_files, force=False):
+        """Add stats files (one per crawl) to the store, skip files
+        already ingested and not modified since"""
+        sources = self.read_sources()
+        for stats_file in stats_files:
+            stat = os.stat(stats_file)
+            source = {'file': os.path.abspath(stats_file),
+                      'size': stat.st_size, 'mtime': stat.st_mtime}
+            file_crawl = self.crawl_pattern.search(
+                os.path.basename(stats_file))
+            if file_crawl is not None and not force:
+                if sources.get(file_crawl.group(1)) == source:
+                    LOG.info('Skipping {}, already ingested'.format(
+                        stats_file))
+                    continue
+            LOG.info('Ingesting {}'.format(stats_file))
+            for crawl in self.ingest_file(stats_file):
+                sources[crawl] = source
+            self.write_sources(sources)
+
+    def ingest_file(self, stats_file):
+        records = defaultdict(lambda: defaultdict(list))
+        with fsspec.open(stats_file, 'rt', encoding='utf-8',
+                         compression='infer') as stream:
+            for line in stream:
+                keyval = line.rstrip('\n').split('\t')
+                if len(keyval) != 2:
+                    LOG.error('Not a key-value pair: {}'.format(line))
+                    continue
+                key = json.loads(keyval[0])
+                val = json.loads(keyval[1])
+                records[key[0]][key[2]].append(
+                    self.record(keyval[0], keyval[1], key, val))
+        crawls = set()
+        for cst in records:
+            for crawl in records[cst]:
+                crawls.add(crawl)
+        for crawl in crawls:
+            # replace data of previous ingestion
+            for cst in self.types():
+                partition = os.path.dirname(self.partition_path(cst, crawl))
+                if os.path.exists(partition):
+                    shutil.rmtree(partition)
+        for cst in records:
+            for crawl, rows in records[cst].items():
+                path = self.partition_path(cst, crawl)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                table = pyarrow.Table.from_pylist(rows, schema=self.SCHEMA)
+                pyarrow.parquet.write_table(table, path)
+        return sorted(crawls)
+
+    @staticmethod
+    def record(key_json, val_json, key, val):
+        counts = [None, None, None]
+        if isinstance(val, int):
+            counts[0] = val
+        elif (isinstance(val, list) and len(val) <= 3
+              and all(isinstance(c, int) for c in val)):
+            counts[0:len(val)] = val
+        item = key[1] if len(key) > 1 else None
+        # key [type, item, crawl] with string item and value restored
+        # exactly from the typed columns
+        typed = (len(key) == 3 and (item is None or isinstance(item, str))
+                 and counts[0] is not None
+                 and StatsStore.typed_value(*counts) == val)
+        if item is not None:
+            item = str(item)
+        return {'key': key_json, 'value': val_json, 'item': item,
+                'count': counts[0], 'url_count': counts[1],
+                'host_count': counts[2], 'typed': typed}
+
+    @staticmethod
+    def typed_value(count, url_count, host_count):
+        """Value (count or list of counts) of a typed record"""
+        if url_count is None:
+            return count
+        if host_count is None:
+            return [count, url_count]
+        return [count, url_count, host_count]
+
+    def read_table(self, types=None, crawls=None, columns=None):
+        """Read records of the given statistics types and crawls (default:
+        all) as one Arrow table"""
+        tables = []
+        for path in self.partitions(types, crawls):
+            tables.append(pyarrow.parquet.read_table(path, columns=columns))
+        if not tables:
+            return self.SCHEMA.empty_table().select(
+                columns or self.SCHEMA.names)
+        return pyarrow.concat_tables(tables)
+
+    def partitions(self, types=None, crawls=None):
+        """Paths of partitions, ordered by crawl and type (same order as
+        the stats files)"""
+        for crawl, cst in self.partition_keys(types, crawls):
+            yield self.partition_path(cst, crawl)
+
+    def partition_keys(self, types=None, crawls=None):
+        """Crawl and type of partitions, ordered by crawl and type"""
+        if types is None:
+            types = self.types()
+        types = sorted(set(map(self.type_name, types)))
+        partitions = []
+        for cst in types:
+            for crawl in self.crawls(cst):
+                if crawls is None or crawl in crawls:
+                    partitions.append((crawl, cst))
+        return sorted(partitions)
+
+    def lines(self, types=None, crawls=None):
+        """Records as lines (tab-separated JSON key and value), same as
+        read from the stats files"""
+        for path in self.partitions(types, crawls):
+            table = pyarrow.parquet.read_table(path, columns=['key', 'value'])
+            for key, value in zip(table.column('key').to_pylist(),
+                                  table.column('value').to_pylist()):
+                yield key + '\t' + value + '\n'
+
+    def records(self, types=None, crawls=None):
+        """Records as (key, value), same as decoded from the stats files.
+        Typed records are built from the typed columns, only the JSON key
+        and value of other records (histograms, HyperLogLogs, etc.) and of
+        stores written without typed column are decoded."""
+        for crawl, cst in self.partition_keys(types, crawls):
+            path = self.partition_path(cst, crawl)
+            columns = {}
+            if 'typed' in pyarrow.parquet.read_schema(path).names:
+                columns = self.read_columns(path,
+                                            self.TYPED_COLUMNS + ['typed'])
+            if not all(columns.get('typed', [False])):
+                columns.update(self.read_columns(path, ['key', 'value']))
+            keys = columns.get('key')
+            values = columns.get('value')
+            typed = columns.get('typed', [False] * len(keys or ()))
+            items = columns.get('item')
+            counts = columns.get('count')
+            url_counts = columns.get('url_count')
+            host_counts = columns.get('host_count')
+            for i, is_typed in enumerate(typed):
+                if is_typed:
+                    yield ([cst, items[i], crawl],
+                           self.typed_value(counts[i], url_counts[i],
+                                            host_counts[i]))
+                else:
+                    yield json.loads(keys[i]), json.loads(values[i])
+
+    @staticmethod
+    def read_columns(path, columns):
+        table = pyarrow.parquet.read_table(path, columns=columns)
+        return {name: table.column(name).to_pylist() for name in columns}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Add crawl statistics (output of the stats job) to a'
+        ' columnar store')
+    parser.add_argument('--store', required=True,
+                        help='Path to store directory')
+    parser.add_argument('--force', action='store_true',
+                        help='Ingest files again even if not modified')
+    parser.add_argument('input', nargs='+',
+                        help='Stats files (CC-MAIN-*.gz, .bz2, .zst) or'
+                        ' glob patterns')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO,
+                        format='%(asctime)s: [%(levelname)s]: %(message)s')
+    inputs = []
+    for pattern in args.input:
+        inputs.extend(sorted(glob.glob(pattern)) or [pattern])
+    StatsStore(args.store).ingest(inputs, force=args.force)
+
+
+if __name__ == '__main__':
+    main()
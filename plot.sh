@@ -4,7 +4,8 @@ N_CRAWLS=$(python3 -c 'from crawlstats import MonthlyCrawl; print(len(MonthlyCra
 LATEST_CRAWL=$(python3 -c 'from crawlstats import MonthlyCrawl; print(sorted(MonthlyCrawl.by_name.keys())[-1])')
 
 # verify that all stats files are downloaded, cf. get_stats.sh
-N_CRAWLS_STATS_FILES=$(ls stats/CC-MAIN-*.gz | wc -l)
+# (gzip-compressed by default, see crawlstats.py --stats-output-codec)
+N_CRAWLS_STATS_FILES=$(ls -d stats/CC-MAIN-* | wc -l)
 if [[ $N_CRAWLS -ne $N_CRAWLS_STATS_FILES ]]; then
     echo "Number of crawls registered in crawlstats.py ($N_CRAWLS) and"
     echo "the number of statistics files in stats/ ($N_CRAWLS_STATS_FILES) are not equal."
@@ -25,17 +26,29 @@ set -exo pipefail
 sed -i 's@^latest_crawl:.*@latest_crawl: '$LATEST_CRAWL'@' _config.yml
 
 
+function decompress() {
+    # output content of (compressed) files, codec detected by file name extension
+    for f in "$@"; do
+        case "$f" in
+            *.gz )  zcat "$f" ;;
+            *.bz2 ) bzcat "$f" ;;
+            *.zst ) zstdcat "$f" ;;
+            * )     cat "$f" ;;
+        esac
+    done
+}
+
 function update_excerpt() {
     regex="$1"
     excerpt="$2"
     if [ -e "$excerpt" ]; then
         # short-cut for monthy update plots: only add data from latest crawl
-        if ! zgrep -qF "$LATEST_CRAWL" $excerpt; then
+        if ! decompress $excerpt | grep -F "$LATEST_CRAWL" >/dev/null; then
             echo "Updating excerpt $excerpt with latest crawl $LATEST_CRAWL"
-            zgrep -Eh "$regex" stats/$LATEST_CRAWL.gz | gzip >>$excerpt
+            decompress stats/$LATEST_CRAWL.* | grep -Eh "$regex" | gzip >>$excerpt
         fi
         # sanity check: are all crawls excerpted?
-        N_CRAWLS_EXCERPTED=$(zcat $excerpt | cut -f1 | jq -r '.[2]' | uniq | sort -u | wc -l)
+        N_CRAWLS_EXCERPTED=$(decompress $excerpt | cut -f1 | jq -r '.[2]' | uniq | sort -u | wc -l)
         if [[ $N_CRAWLS_EXCERPTED -eq $N_CRAWLS ]]; then
             echo "Excerpt $excerpt includes $N_CRAWLS crawls as expected."
         else
@@ -46,57 +59,75 @@ function update_excerpt() {
     fi
     if ! [ -e "$excerpt" ]; then
         echo "Rebuilding excerpt $excerpt"
-        zcat stats/CC-MAIN-*.gz | grep -Eh "$regex" | gzip  >$excerpt
+        decompress stats/CC-MAIN-* | grep -Eh "$regex" | gzip  >$excerpt
     fi
 }
 
-# filter data to speed-up reading while plotting
-mkdir -p stats/excerpt
-update_excerpt '^\["size'                               stats/excerpt/size.json.gz
-update_excerpt '^\["histogram"'                         stats/excerpt/histogram.json.gz
-update_excerpt '^\["tld"'                               stats/excerpt/tld.json.gz
-update_excerpt '^\["(size|domain)"'                     stats/excerpt/domain.json.gz
-update_excerpt '^\["(size", *"page|mimetype)"'          stats/excerpt/mimetype.json.gz
-update_excerpt '^\["(size", *"page|mimetype_detected)"' stats/excerpt/mimetype_detected.json.gz
-update_excerpt '^\["(size", *"page|charset)"'           stats/excerpt/charset.json.gz
-update_excerpt '^\["(size", *"page|primary_language|languages)"' stats/excerpt/language.json.gz
-update_excerpt '^\["scheme"'                            stats/excerpt/url_protocol.json.gz
+function excerpt() {
+    # output excerpt (optionally filtered by regex $2),
+    # nothing if the data is read from the columnar store
+    if [ -n "$STATSSTORE" ]; then
+        return
+    fi
+    if [ -n "$2" ]; then
+        decompress "$1" | grep "$2"
+    else
+        decompress "$1"
+    fi
+}
+
+if [ -n "$STATSSTORE" ]; then
+    # read data from columnar store (see crawlstore.py), add new crawls
+    python3 crawlstore.py --store "$STATSSTORE" stats/CC-MAIN-*
+else
+    # filter data to speed-up reading while plotting
+    mkdir -p stats/excerpt
+    update_excerpt '^\["(size|new_items)'                   stats/excerpt/size.json.gz
+    update_excerpt '^\["histogram"'                         stats/excerpt/histogram.json.gz
+    update_excerpt '^\["tld"'                               stats/excerpt/tld.json.gz
+    update_excerpt '^\["(size|domain)"'                     stats/excerpt/domain.json.gz
+    update_excerpt '^\["(size", *"page|mimetype)"'          stats/excerpt/mimetype.json.gz
+    update_excerpt '^\["(size", *"page|mimetype_detected)"' stats/excerpt/mimetype_detected.json.gz
+    update_excerpt '^\["(size", *"page|charset)"'           stats/excerpt/charset.json.gz
+    update_excerpt '^\["(size", *"page|primary_language|languages)"' stats/excerpt/language.json.gz
+    update_excerpt '^\["scheme"'                            stats/excerpt/url_protocol.json.gz
+fi
 
 mkdir -p data
 
-zcat stats/excerpt/size.json.gz \
+excerpt stats/excerpt/size.json.gz \
      | python3 plot/crawl_size.py
 
-zcat stats/excerpt/size.json.gz \
+excerpt stats/excerpt/size.json.gz \
      | python3 plot/overlap.py
 
 # zcat stats/excerpt/histogram.json.gz \
 #     | python3 plot/histogram.py "$LATEST_CRAWL"
 
 (cat stats/crawler/CC-MAIN-*.json;
- zcat stats/excerpt/size.json.gz | grep '^\["size"';
- zcat stats/excerpt/url_protocol.json.gz) \
+ excerpt stats/excerpt/size.json.gz '^\["size"';
+ excerpt stats/excerpt/url_protocol.json.gz) \
 	| python3 plot/crawler_metrics.py
 
-zcat stats/excerpt/tld.json.gz \
+excerpt stats/excerpt/tld.json.gz \
     | python3 plot/tld.py CC-MAIN-2008-2009 CC-MAIN-2012 CC-MAIN-2014-10 \
               CC-MAIN-2016-30 CC-MAIN-2019-09 CC-MAIN-2022-49 $LATEST_CRAWL
-zcat stats/excerpt/tld.json.gz \
+excerpt stats/excerpt/tld.json.gz \
     | python3 plot/tld_by_continent.py
 
-zcat stats/excerpt/mimetype.json.gz \
+excerpt stats/excerpt/mimetype.json.gz \
     | python3 plot/mimetype.py
 
-zcat stats/excerpt/mimetype_detected.json.gz \
+excerpt stats/excerpt/mimetype_detected.json.gz \
     | python3 plot/mimetype_detected.py
 
-zcat stats/excerpt/charset.json.gz \
+excerpt stats/excerpt/charset.json.gz \
     | python3 plot/charset.py
 
-zcat stats/excerpt/language.json.gz \
+excerpt stats/excerpt/language.json.gz \
     | python3 plot/language.py
 
-zcat stats/excerpt/domain.json.gz \
+excerpt stats/excerpt/domain.json.gz \
     | python3 plot/domain.py
 
 echo -e "\n\nAll crawl statistics plotted\n"
\ No newline at end of file
@@ -6,6 +6,8 @@ from crawlstats import CST, MonthlyCrawl
 
 class CharsetStats(TabularStats):
 
+    CST_TYPES = (CST.size, CST.charset)
+
     MIN_AVERAGE_COUNT = 500
     MAX_CHARSETS = 100
 
@@ -11,16 +11,19 @@ This module generates visualizations of crawl size statistics including:
 The plots show the growth and evolution of the Common Crawl archive.
 """
 
+import hashlib
+import json
 import os
 import re
 import types
 from collections import defaultdict
 
+import numpy
 import pandas
-from hyperloglog import HyperLogLog
 
+from crawlhll import SlidingWindowUnion, cardinalities
 from crawlplot import CrawlPlot
-from crawlstats import CST, CrawlStatsJSONDecoder, HYPERLOGLOG_ERROR, MonthlyCrawl
+from crawlstats import CST, CrawlStatsJSONDecoder, MonthlyCrawl
 
 
 class CrawlSizePlot(CrawlPlot):
@@ -31,6 +34,11 @@ class CrawlSizePlot(CrawlPlot):
     Uses HyperLogLog for efficient cardinality estimation.
     """
 
+    CST_TYPES = (CST.size, CST.size_estimate, CST.new_items)
+
+    # state of incremental computation of cumulative sizes, per item type
+    CUMUL_STATE_FILE = 'data/crawlsize_cumul_{}.npz'
+
     def __init__(self):
         super().__init__()
 
@@ -44,14 +52,20 @@ class CrawlSizePlot(CrawlPlot):
         self.sum_counts = False
 
     def add(self, key, val):
-        """Process a size or size_estimate record from statistics data."""
+        """Process a size, size_estimate or new_items record from
+        statistics data."""
         cst = CST[key[0]]
-        if cst not in (CST.size, CST.size_estimate):
+        if cst not in self.CST_TYPES:
             return
         item_type = key[1]
         crawl = key[2]
         count = 0
-        if cst == CST.size_estimate:
+        if cst == CST.new_items:
+            # counted with exact counts or with a Bloom filter
+            # (--seen-filter), more precise than the HLL estimates
+            item_type = ' '.join([item_type, 'new'])
+            count = val
+        elif cst == CST.size_estimate:
             item_type = ' '.join([item_type, 'estim.'])
             hll = CrawlStatsJSONDecoder.json_decode_hyperloglog(val)
             count = len(hll)
@@ -99,40 +113,21 @@ class CrawlSizePlot(CrawlPlot):
         for item_type in self.hll.keys():
             item_type_cumul = ' '.join([item_type, 'cumul.'])
             item_type_new = ' '.join([item_type, 'new'])
-            cumul_hll = HyperLogLog(HYPERLOGLOG_ERROR)
-            n = 0
-            hlls = []
+            sizes = self.cumulative_hll_sizes(item_type,
+                                              latest_n_crawls_cumul)
             for crawl in sorted(self.hll[item_type]):
-                n += 1
-                hll = self.hll[item_type][crawl]
-                last_cumul_hll_len = len(cumul_hll)
-                cumul_hll.update(hll)
+                cumul_size, unseen, last_n_sizes = sizes[crawl]
                 # cumulative size
-                self.add_by_type(crawl, item_type_cumul, len(cumul_hll))
+                self.add_by_type(crawl, item_type_cumul, cumul_size)
                 # new unseen items this crawl (since the first analyzed crawl)
-                unseen = (len(cumul_hll) - last_cumul_hll_len)
-                if unseen > len(hll):
-                    # 1% error rate for cumulative HLLs is large in comparison
-                    # to crawl size, adjust to size of items in this crawl
-                    # (there can be no more new items than the size of the crawl)
-                    unseen = len(hll)
                 self.add_by_type(crawl, item_type_new, unseen)
-                hlls.append(hll)
                 # cumulative size for last N crawls
                 for n_crawls in latest_n_crawls_cumul:
                     item_type_n_crawls = '{} cumul. last {} crawls'.format(
                         item_type, n_crawls)
-                    if n_crawls <= len(hlls):
-                        cum_hll = HyperLogLog(HYPERLOGLOG_ERROR)
-                        for i in range(1, (n_crawls+1)):
-                            if i > len(hlls):
-                                break
-                            cum_hll.update(hlls[-i])
-                        size_last_n = len(cum_hll)
-                        if item_type == 'url estim.':
-                            urls_cumul[crawl][str(n_crawls)] = size_last_n
-                    else:
-                        size_last_n = 'nan'
+                    size_last_n = last_n_sizes[str(n_crawls)]
+                    if size_last_n != 'nan' and item_type == 'url estim.':
+                        urls_cumul[crawl][str(n_crawls)] = size_last_n
                     self.add_by_type(crawl, item_type_n_crawls, size_last_n)
         for n, crawl in enumerate(sorted_crawls):
             for n_crawls in latest_n_crawls_cumul:
@@ -154,6 +149,88 @@ class CrawlSizePlot(CrawlPlot):
                                  'URLs/pages last {} crawls'.format(n_crawls),
                                  urls_cumul[crawl][n_crawls])
 
+    def cumulative_hll_sizes(self, item_type, latest_n_crawls_cumul):
+        """Sizes of the union of all crawls (up to and including a crawl),
+        of new items and of the union of the last N crawls, for every crawl
+        of an item type.
+
+        The computation is incremental: the union of all crawls and the
+        unions of the last N crawls (see SlidingWindowUnion) are kept
+        in a state file together with the sizes of the crawls already
+        processed. If crawls are added, only the new crawls are merged
+        into the unions. The state is rebuilt if any of the crawls seen
+        before has been removed or its HyperLogLog has changed.
+        """
+        crawls = sorted(self.hll[item_type])
+        digests = [hashlib.sha1(self.hll[item_type][crawl].M.tobytes())
+                   .hexdigest() for crawl in crawls]
+        m = self.hll[item_type][crawls[0]].m
+        state_file = self.CUMUL_STATE_FILE.format(
+            item_type.replace(' ', '_').rstrip('.'))
+        state = None
+        if os.path.exists(state_file):
+            state = numpy.load(state_file)
+            n = len(state['crawls'])
+            if (state['crawls'].tolist() != crawls[:n]
+                    or state['digests'].tolist() != digests[:n]
+                    or state['latest_n_crawls'].tolist()
+                    != latest_n_crawls_cumul):
+                print('Rebuilding state of cumulative sizes for', item_type)
+                state = None
+        if state is None:
+            processed = 0
+            sizes = {}
+            cumul = numpy.zeros(m, dtype=numpy.uint8)
+            windows = [SlidingWindowUnion(n_crawls, m)
+                       for n_crawls in latest_n_crawls_cumul]
+        else:
+            processed = len(state['crawls'])
+            sizes = json.loads(str(state['sizes']))
+            cumul = state['cumul'].copy()
+            windows = [SlidingWindowUnion.from_state(n_crawls, {
+                key: state['{}_{}'.format(key, n_crawls)]
+                for key in ('front', 'back', 'back_union')})
+                       for n_crawls in latest_n_crawls_cumul]
+        last_cumul_size = 0
+        if processed > 0:
+            last_cumul_size = sizes[crawls[processed-1]][0]
+        for crawl in crawls[processed:]:
+            hll = self.hll[item_type][crawl]
+            numpy.maximum(cumul, hll.M, out=cumul)
+            cumul_size = self.hll_size(cumul)
+            unseen = cumul_size - last_cumul_size
+            if unseen > len(hll):
+                # 1% error rate for cumulative HLLs is large in comparison
+                # to crawl size, adjust to size of items in this crawl
+                # (there can be no more new items than the size of the crawl)
+                unseen = len(hll)
+            last_cumul_size = cumul_size
+            last_n_sizes = {}
+            for n_crawls, window in zip(latest_n_crawls_cumul, windows):
+                window.push(hll.M)
+                size_last_n = 'nan'
+                if len(window) == n_crawls:
+                    size_last_n = self.hll_size(window.union())
+                last_n_sizes[str(n_crawls)] = size_last_n
+            sizes[crawl] = (cumul_size, unseen, last_n_sizes)
+        if processed < len(crawls):
+            arrays = {'crawls': numpy.array(crawls),
+                      'digests': numpy.array(digests),
+                      'latest_n_crawls': numpy.array(latest_n_crawls_cumul),
+                      'sizes': numpy.array(json.dumps(sizes)),
+                      'cumul': cumul}
+            for n_crawls, window in zip(latest_n_crawls_cumul, windows):
+                for key, value in window.get_state().items():
+                    arrays['{}_{}'.format(key, n_crawls)] = value
+            os.makedirs(os.path.dirname(state_file), exist_ok=True)
+            numpy.savez_compressed(state_file, **arrays)
+        return sizes
+
+    @staticmethod
+    def hll_size(registers):
+        """Size (rounded cardinality) of a HyperLogLog given its registers"""
+        return round(cardinalities(registers[numpy.newaxis])[0])
+
     def transform_data(self):
         """Convert internal dictionaries to pandas DataFrames."""
         self.size = pandas.DataFrame(self.size)
@@ -192,7 +269,7 @@ class CrawlSizePlot(CrawlPlot):
                        'crawlsize/cumulative.png',
                        data_export_csv='crawlsize/cumulative.csv')
         # -- new URLs per crawl
-        row_types = ['url estim. new']
+        row_types = ['url estim. new', 'url new']
         self.size_plot(self.size_by_type, row_types, '',
                        'New URLs per Crawl (not observed in prior crawls)',
                        'New URLs', 'crawlsize/monthly_new.png',
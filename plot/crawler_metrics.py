@@ -32,6 +32,10 @@ class CrawlerMetrics(CrawlSizePlot):
     across crawls.
     """
 
+    CST_TYPES = (CST.size, CST.scheme)
+    # crawler status (CST.crawl_status) is read from stdin
+    READ_STDIN_WITH_STORE = True
+
     metrics_map = {
         'fetcher:aggr:redirect': ('fetcher:temp_moved', 'fetcher:moved',
                                   'fetcher:redirect_count_exceeded',
@@ -8,6 +8,8 @@ from plot.table import TabularStats
 
 class DomainStats(TabularStats):
 
+    CST_TYPES = (CST.size, CST.domain)
+
     # defined via crawlstats command-line option --max-top-hosts-domains
     MAX_TOP_DOMAINS = 500
 
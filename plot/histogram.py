@@ -26,6 +26,8 @@ class CrawlHistogram(CrawlPlot):
     like duplicate rates, coverage per domain, etc.
     """
 
+    CST_TYPES = (CST.histogram,)
+
     PSEUDO_LOG_BINS = [0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000,
                        10000, 20000, 50000, 100000, 200000, 500000, 1000000,
                        2*10**6, 5*10**6, 10**7, 2*10**7, 5*10**7, 10**8,
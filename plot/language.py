@@ -7,6 +7,8 @@ from crawlstats import CST, MonthlyCrawl
 
 class LanguageStats(TabularStats):
 
+    CST_TYPES = (CST.size, CST.primary_language)
+
     MIN_AVERAGE_COUNT = 1
     MAX_LANGUAGES = 200
 
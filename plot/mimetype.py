@@ -7,6 +7,8 @@ from crawlstats import CST, MonthlyCrawl
 
 class MimeTypeStats(TabularStats):
 
+    CST_TYPES = (CST.size, CST.mimetype)
+
     MIN_AVERAGE_COUNT = 500
     MAX_MIME_TYPES = 100
 
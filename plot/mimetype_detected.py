@@ -6,6 +6,8 @@ from crawlstats import CST, MonthlyCrawl
 
 class MimeTypeDetectedStats(MimeTypeStats):
 
+    CST_TYPES = (CST.size, CST.mimetype_detected)
+
     def __init__(self):
         super().__init__()
         self.MAX_TYPE_VALUES = MimeTypeStats.MAX_MIME_TYPES
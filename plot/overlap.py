@@ -6,13 +6,18 @@ crawls based on URL or content digest similarities. Uses Jaccard similarity
 to measure the intersection over union of items between crawls.
 """
 
-import copy
+import hashlib
+import itertools
+import json
+import multiprocessing
 import os.path
 from collections import defaultdict
 
+import numpy
 import pandas
 import pygraphviz
 
+from crawlhll import cardinalities, union_cardinalities
 from crawlplot import CrawlPlot
 from crawlstats import CST, CrawlStatsJSONDecoder, MonthlyCrawl
 
@@ -22,11 +27,16 @@ class CrawlOverlap(CrawlPlot):
 
     Calculates and visualizes the Jaccard similarity between crawls
     based on unique URLs or content digests using HyperLogLog cardinality
-    estimation.
+    estimation. Union cardinalities are cached, see CACHE_FILE.
     """
 
+    CST_TYPES = (CST.size_estimate,)
+
     MAX_MATRIX_SIZE = 30
 
+    # cached union cardinalities of pairs of crawls, per item type
+    CACHE_FILE = 'data/crawloverlap_cache_{}.json'
+
     def __init__(self):
         super().__init__()
 
@@ -44,29 +54,80 @@ class CrawlOverlap(CrawlPlot):
         hll = CrawlStatsJSONDecoder.json_decode_hyperloglog(val)
         self.crawl_size[item_type][crawl] = hll
 
-    def fill_overlap_matrix(self):
-        """Calculate pairwise overlap and Jaccard similarity between all crawls."""
+    def fill_overlap_matrix(self, processes=None):
+        """Calculate pairwise overlap and Jaccard similarity between all crawls.
+
+        The registers of all HyperLogLogs are stacked into one matrix and
+        the union cardinalities are computed row by row (vectorized),
+        optionally in a pool of processes. Union cardinalities are cached
+        in CACHE_FILE, so that only pairs including new (or changed)
+        crawls need to be computed.
+        """
         for item_type in self.crawl_size:
-            for crawl1 in self.crawl_size[item_type]:
-                hll1 = self.crawl_size[item_type][crawl1]
-                size1 = len(hll1)
+            crawls = sorted(self.crawl_size[item_type])
+            registers = numpy.stack([self.crawl_size[item_type][crawl].M
+                                     for crawl in crawls])
+            sizes = [round(card) for card in cardinalities(registers)]
+            union = self.union_cardinalities(item_type, crawls, registers,
+                                             processes)
+            for i, crawl1 in enumerate(crawls):
+                size1 = sizes[i]
                 self.overlap[item_type][crawl1] = defaultdict(list)
                 self.similarity[item_type][crawl1] = defaultdict(float)
-                for crawl2 in self.crawl_size[item_type]:
-                    if crawl1 >= crawl2:
-                        continue
-                    hll2 = self.crawl_size[item_type][crawl2]
-                    size2 = len(hll2)
-                    union_hll = copy.deepcopy(hll1)
-                    union_hll.update(hll2)
-                    union = len(union_hll)
-                    intersection = size1 + size2 - union
-                    jaccard_sim = intersection / union
+                for j in range(i + 1, len(crawls)):
+                    crawl2 = crawls[j]
+                    size2 = sizes[j]
+                    intersection = size1 + size2 - union[crawl1][crawl2]
+                    jaccard_sim = intersection / union[crawl1][crawl2]
                     self.overlap[item_type][crawl1][crawl2] \
-                        = [intersection, union, size1, size2,
+                        = [intersection, union[crawl1][crawl2], size1, size2,
                            (intersection/size2), jaccard_sim]
                     self.similarity[item_type][crawl1][crawl2] = jaccard_sim
 
+    def union_cardinalities(self, item_type, crawls, registers,
+                            processes=None):
+        """Union cardinalities of all pairs of crawls (crawl1 < crawl2),
+        read from cache or computed"""
+        cache_file = self.CACHE_FILE.format(item_type)
+        cache = {'registers': {}, 'union': {}}
+        if os.path.exists(cache_file):
+            with open(cache_file) as f:
+                cache = json.load(f)
+        digests = [hashlib.sha1(row.tobytes()).hexdigest()
+                   for row in registers]
+        valid = set(crawl for crawl, digest in zip(crawls, digests)
+                    if cache['registers'].get(crawl) == digest)
+        union = defaultdict(dict)
+        tasks = []
+        for i, crawl1 in enumerate(crawls):
+            cached = cache['union'].get(crawl1, {})
+            missing = []
+            for j in range(i + 1, len(crawls)):
+                crawl2 = crawls[j]
+                if crawl1 in valid and crawl2 in valid and crawl2 in cached:
+                    union[crawl1][crawl2] = cached[crawl2]
+                else:
+                    missing.append(j)
+            if missing:
+                tasks.append((i, missing))
+        n_pairs = sum(len(missing) for _, missing in tasks)
+        print('Computing', n_pairs, 'union cardinalities for', item_type)
+        args = [(registers[i], registers[missing]) for i, missing in tasks]
+        if processes and processes > 1 and len(tasks) > 1:
+            with multiprocessing.Pool(processes) as pool:
+                results = pool.starmap(union_cardinalities, args)
+        else:
+            results = itertools.starmap(union_cardinalities, args)
+        for (i, missing), cards in zip(tasks, results):
+            for j, card in zip(missing, cards):
+                union[crawls[i]][crawls[j]] = round(card)
+        if n_pairs > 0:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            with open(cache_file, 'w') as f:
+                json.dump({'registers': dict(zip(crawls, digests)),
+                           'union': union}, f, sort_keys=True)
+        return union
+
     def save_overlap_matrix(self):
         """Save overlap and similarity matrices to CSV files."""
         for item_type in self.overlap:
@@ -270,7 +331,7 @@ class CrawlOverlap(CrawlPlot):
 if __name__ == '__main__':
     plot = CrawlOverlap()
     plot.read_from_stdin_or_file()
-    plot.fill_overlap_matrix()
+    plot.fill_overlap_matrix(processes=os.cpu_count())
     plot.save_overlap_matrix()
     # plot.plot_similarity_graph()
     plot.plot_similarity_matrix(
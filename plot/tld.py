@@ -1,3 +1,4 @@
+import os
 import sys
 
 from collections import defaultdict
@@ -17,6 +18,8 @@ min_urls_percentage = .05
 
 class TldStats(CrawlPlot):
 
+    CST_TYPES = (CST.tld,)
+
     def __init__(self):
         super().__init__()
 
@@ -261,7 +264,10 @@ if __name__ == '__main__':
         print()
         sys.exit(1)
     plot = TldStats()
-    plot.read_data(sys.stdin)
+    if os.environ.get('STATSSTORE'):
+        plot.read_from_store(os.environ['STATSSTORE'])
+    else:
+        plot.read_data(sys.stdin)
     plot.transform_data()
     plot.save_data()
     plot.plot_groups()
@@ -17,7 +17,7 @@ import pandas
 from matplotlib.ticker import MaxNLocator
 
 from crawlplot import CrawlPlot
-from crawlstats import MonthlyCrawl, MultiCount
+from crawlstats import CST, MonthlyCrawl, MultiCount
 from top_level_domain import TopLevelDomain
 
 
@@ -163,13 +163,19 @@ def get_data(f):
 class TLDByContinentPlot(CrawlPlot):
     """Generate TLD distribution by continent visualizations."""
 
+    CST_TYPES = (CST.tld,)
+
     def __init__(self):
         super().__init__()
 
     def plot(self):
         """Generate TLD by continent/year plots and save data tables."""
-        # Read from file path or stdin
-        if len(sys.argv) > 1 and os.path.exists(sys.argv[-1]):
+        # Read from columnar store, file path or stdin
+        if os.environ.get('STATSSTORE'):
+            from crawlstore import StatsStore
+            store = StatsStore(os.environ['STATSSTORE'])
+            d, dd = get_data(store.lines(self.CST_TYPES))
+        elif len(sys.argv) > 1 and os.path.exists(sys.argv[-1]):
             with fsspec.open(sys.argv[-1], compression="gzip", mode="rt") as f:
                 d, dd = get_data(f)
         else:
@@ -0,0 +1,139 @@
+"""Resolve host names into registered domain and public suffix.
+
+Same results as tldextract.extract(host) (ICANN section of the public
+suffix list, no private domains) but faster for many hosts sharing the
+same suffixes: the suffix list is held in a trie of reversed labels and
+the results are cached in a bounded LRU cache. The suffix list is read
+from the snapshot bundled with tldextract, so that the results do not
+depend on a list fetched at run time.
+"""
+
+import functools
+import pkgutil
+import re
+
+import idna
+
+from tldextract.remote import lenient_netloc, looks_like_ip, looks_like_ipv6
+from tldextract.suffix_list import extract_tlds_from_suffix_list
+
+
+class SuffixTrieNode:
+    """Node of a trie of reversed public suffix labels"""
+
+    __slots__ = ('children', 'end')
+
+    def __init__(self):
+        self.children = {}
+        self.end = False
+
+    def add(self, suffix):
+        node = self
+        for label in reversed(suffix.split('.')):
+            if label not in node.children:
+                node.children[label] = SuffixTrieNode()
+            node = node.children[label]
+        node.end = True
+
+
+class PublicSuffixResolver:
+    """Resolve host names into (domain, suffix, is_ip), e.g.
+      www.example.co.uk -> ('example.co.uk', 'co.uk', False)
+      co.uk             -> ('.co.uk', 'co.uk', False)
+      localhost         -> ('localhost', '', False)
+      192.168.0.1       -> ('192.168.0.1', '', True)
+    The domain is empty if the host name is empty. Host names without
+    public suffix looking like an IPv4 address (loosely: four dot-separated
+    numbers) and IPv6 addresses in brackets are flagged as IP address."""
+
+    DEFAULT_CACHE_SIZE = 1 << 16
+
+    IPpattern = re.compile(r'^\d{1,3}.\d{1,3}.\d{1,3}.\d{1,3}$')
+
+    # lower-case host name of ASCII labels, no leading or trailing dot
+    plain_host_pattern = re.compile(r'[a-z0-9_-]+(?:\.[a-z0-9_-]+)*')
+
+    _default = None
+
+    def __init__(self, suffixes=None, cache_size=DEFAULT_CACHE_SIZE):
+        if suffixes is None:
+            suffixes = PublicSuffixResolver.read_snapshot()
+        self.trie = SuffixTrieNode()
+        for suffix in suffixes:
+            self.trie.add(suffix)
+        self.resolve = functools.lru_cache(maxsize=cache_size)(
+            self._resolve)
+
+    @staticmethod
+    def default():
+        """Shared resolver using the bundled suffix list"""
+        if PublicSuffixResolver._default is None:
+            PublicSuffixResolver._default = PublicSuffixResolver()
+        return PublicSuffixResolver._default
+
+    @staticmethod
+    def read_snapshot():
+        """Public (ICANN) suffixes of the snapshot bundled with
+        tldextract"""
+        text = pkgutil.get_data('tldextract', '.tld_set_snapshot')
+        public, _private = extract_tlds_from_suffix_list(
+            text.decode('utf-8'))
+        return public
+
+    @staticmethod
+    def decode_label(label):
+        label = label.lower()
+        if label.startswith('xn--'):
+            try:
+                return idna.decode(label)
+            except (UnicodeError, IndexError):
+                pass
+        return label
+
+    def suffix_index(self, labels, decode=True):
+        """Index of the first label of the public suffix, len(labels)
+        if there is no known suffix. Labels are lower-cased and punycode
+        is decoded unless `decode` is False."""
+        node = self.trie
+        i = j = len(labels)
+        for label in reversed(labels):
+            if decode:
+                label = self.decode_label(label)
+            child = node.children.get(label)
+            if child is not None:
+                j -= 1
+                node = child
+                if node.end:
+                    i = j
+                continue
+            if '*' in node.children:
+                if ('!' + label) in node.children:
+                    return j
+                return j - 1
+            break
+        return i
+
+    def _resolve(self, host):
+        if self.plain_host_pattern.fullmatch(host):
+            # fast path: no port, user info, etc. and no IDN labels
+            netloc = host
+            labels = host.split('.')
+            i = self.suffix_index(labels, 'xn--' in host)
+        else:
+            netloc = lenient_netloc(host)
+            netloc = netloc.replace('\u3002', '.').replace(
+                '\uff0e', '.').replace('\uff61', '.')
+            if (len(netloc) >= 4 and netloc[0] == '[' and netloc[-1] == ']'
+                    and looks_like_ipv6(netloc[1:-1])):
+                return netloc, '', True
+            labels = netloc.split('.')
+            i = self.suffix_index(labels)
+        if i == len(labels):
+            is_ip = self.IPpattern.match(host) is not None
+            if i == 4 and looks_like_ip(netloc):
+                return netloc, '', is_ip
+            return labels[-1], '', is_ip
+        suffix = '.'.join(labels[i:])
+        if i == 0:
+            return '.' + suffix, suffix, False
+        return labels[i-1] + '.' + suffix, suffix, False
@@ -11,20 +11,35 @@ fi
 
 OUTPUT_COUNT=ccstats/$CRAWL/count/
 OUTPUT_STATS=ccstats/$CRAWL/stats/
+# written when the count job has completed (the _SUCCESS file is removed
+# before the output is copied to S3)
+COUNT_COMPLETED=ccstats/$CRAWL/count.completed
+
+# optional: store the map output of the count job per cdx file, a rerun
+# then processes only the cdx files without stored partial result
+CHECKPOINT_DIR=${CHECKPOINT_DIR:-}
 
 hadoop fs -mkdir -p ccstats/$CRAWL/
 
 # check that output paths do not exist (jobs will fail otherwise)
-if hadoop fs -ls $OUTPUT_COUNT; then
-    echo "Output path $OUTPUT_COUNT already exists: delete path before running the count job"
-    exit 1
-fi
-
 if hadoop fs -ls $OUTPUT_STATS; then
     echo "Output path $OUTPUT_STATS already exists: delete path before running the stats job"
     exit 1
 fi
 
+if hadoop fs -ls $OUTPUT_COUNT; then
+    if [ -n "$CHECKPOINT_DIR" ] && ! hadoop fs -test -e $COUNT_COMPLETED; then
+        # output of a failed count job, rebuilt from the partial results
+        echo "Count job did not complete: deleting output path $OUTPUT_COUNT, the count job resumes from $CHECKPOINT_DIR"
+        hadoop fs -rm -r $OUTPUT_COUNT
+    else
+        echo "Output path $OUTPUT_COUNT already exists: delete path before running the count job"
+        exit 1
+    fi
+fi
+
+hadoop fs -rm -f $COUNT_COMPLETED
+
 
 set -e
 set -x
@@ -35,10 +50,22 @@ INPUT="s3a://commoncrawl/cc-index/collections/CC-MAIN-$CRAWL/indexes/cdx-*.gz"
 
 HADOOP_USER=${HADOOP_USER:-$USER}
 
+COUNT_INPUT=("$INPUT")
+CHECKPOINT_ARGS=()
+if [ -n "$CHECKPOINT_DIR" ]; then
+    CHECKPOINT_ARGS=(--checkpoint-dir "$CHECKPOINT_DIR")
+    # replace cdx files by the partial results stored by earlier runs
+    python3 count_checkpoints.py "${CHECKPOINT_ARGS[@]}" --no-exact-counts "$INPUT" \
+        >count-inputs.$CRAWL.txt
+    mapfile -t COUNT_INPUT <count-inputs.$CRAWL.txt
+fi
+
 
 python3 crawlstats.py --job=count \
         --no-exact-counts \
+        "${CHECKPOINT_ARGS[@]}" \
         -r hadoop \
+        --py-files crawlbloom.py,crawlhll.py,public_suffix.py \
         --jobconf "mapreduce.map.memory.mb=720" \
         --jobconf "mapreduce.map.java.opts=-Xmx512m" \
         --jobconf "mapreduce.reduce.memory.mb=640" \
@@ -47,12 +74,13 @@ python3 crawlstats.py --job=count \
         --output-dir hdfs:///user/$HADOOP_USER/$OUTPUT_COUNT \
         --no-output \
         --cleanup NONE \
-        "$INPUT" \
+        "${COUNT_INPUT[@]}" \
     2>&1 | tee cc-stats.$CRAWL.count.log
 
 #for i in `seq 0 9`; do
 #    hadoop distcp ccstats/$CRAWL/count/part-0000$i.bz2 s3a://commoncrawl/crawl-analysis/CC-MAIN-$CRAWL/count/part-0000$i.bz2
 #done
+hadoop fs -touchz $COUNT_COMPLETED
 hadoop fs -rm ccstats/$CRAWL/count/_SUCCESS
 hadoop distcp -direct ccstats/$CRAWL/count s3a://commoncrawl/crawl-analysis/CC-MAIN-$CRAWL/count
 
@@ -61,7 +89,9 @@ python3 crawlstats.py --job=stats \
         --max-top-hosts-domains=500 \
         --min-urls-top-host-domain=100 \
         --min-lang-comb-freq=50 \
+        --stats-reducers=10 \
         -r hadoop \
+        --py-files crawlbloom.py,crawlhll.py,public_suffix.py \
         --jobconf "mapreduce.map.memory.mb=1200" \
         --jobconf "mapreduce.map.java.opts=-Xmx1024m" \
         --jobconf "mapreduce.reduce.memory.mb=1200" \
@@ -0,0 +1,60 @@
+import gzip
+import json
+
+import pytest
+
+
+CDX_CRAWL = 'CC-MAIN-2016-26'
+CDX_SEGMENT = 'crawl-data/CC-MAIN-2016-26/segments/1466783391519.0/'
+CDX_WARC = 'CC-MAIN-20160624154951-00000-ip-10-164-35-72.ec2.internal.warc.gz'
+
+
+def cdx_line(surt, url, status=200, mime='text/html', robotstxt=False,
+             languages='eng', digest=None):
+    if robotstxt:
+        subset = 'robotstxt'
+    elif status == 200:
+        subset = 'warc'
+    else:
+        subset = 'crawldiagnostics'
+    metadata = {'url': url, 'mime': mime, 'status': str(status),
+                'digest': digest or 'SHA1{:X}'.format(len(url)),
+                'length': '1000', 'offset': '2000',
+                'filename': CDX_SEGMENT + subset + '/' + CDX_WARC}
+    if status == 200 and not robotstxt:
+        metadata['mime-detected'] = mime
+        metadata['charset'] = 'UTF-8'
+        metadata['languages'] = languages
+    return '{} 20160625123456 {}\n'.format(surt, json.dumps(metadata))
+
+
+CDX_LINES = [
+    [cdx_line('com,example)/', 'http://www.example.com/'),
+     cdx_line('com,example)/', 'https://example.com/'),
+     cdx_line('com,example)/a', 'http://example.com/a'),
+     cdx_line('com,example)/a', 'http://example.com/a'),
+     cdx_line('com,example)/robots.txt', 'http://example.com/robots.txt',
+              robotstxt=True),
+     cdx_line('com,example,blog)/', 'http://blog.example.com/',
+              mime='application/xhtml+xml', digest='SHA1SAME'),
+     cdx_line('org,test)/x', 'http://test.org/x', status=404),
+     cdx_line('org,test)/y', 'http://test.org/y', languages='deu,eng')],
+    [cdx_line('org,test)/z', 'http://test.org/z'),
+     cdx_line('org,test,www)/', 'http://www.test.org:8080/',
+              digest='SHA1SAME'),
+     cdx_line('uk,co,example)/', 'https://example.co.uk/', status=301),
+     cdx_line('uk,co,example)/index', 'https://example.co.uk/index',
+              mime='text/plain', languages='fra')],
+]
+
+
+@pytest.fixture
+def cdx_files(tmp_path):
+    """Two small cdx files of one monthly crawl"""
+    paths = []
+    for n, lines in enumerate(CDX_LINES):
+        path = tmp_path / '{}-cdx-{:05d}.gz'.format(CDX_CRAWL, n)
+        with gzip.open(str(path), 'wt', encoding='utf-8') as cdx:
+            cdx.writelines(lines)
+        paths.append(str(path))
+    return paths
@@ -0,0 +1,46 @@
+import numpy
+
+from crawlbloom import BloomFilter, SeenFilter
+from crawlindex import cdx_fingerprints
+from crawlstats import CCStatsJob, CST, MonthlyCrawl
+
+from conftest import CDX_CRAWL, CDX_LINES
+
+
+def test_bloom_filter(tmp_path):
+    bloom = BloomFilter.create(str(tmp_path / 'test.bloom'), 10000, .01)
+    rng = numpy.random.default_rng(3)
+    added = rng.integers(0, 2**64, size=10000, dtype=numpy.uint64)
+    bloom.add_hashes(added)
+    bloom.flush()
+    bloom = BloomFilter(str(tmp_path / 'test.bloom'))
+    assert(bloom.contains_hashes(added).all())
+    others = rng.integers(0, 2**64, size=100000, dtype=numpy.uint64)
+    false_positive_rate = bloom.contains_hashes(others).mean()
+    assert(0 < false_positive_rate < .02)
+
+
+def test_count_new_items(cdx_files, tmp_path):
+    seen = SeenFilter.create(str(tmp_path / 'seen'), 1000)
+    seen.add_crawl('CC-MAIN-2016-22',
+                   zip(('url', 'digest'), cdx_fingerprints(cdx_files[0])))
+    job = CCStatsJob(['-r', 'inline', '--no-conf', '--job=count',
+                      '--seen-filter', str(tmp_path / 'seen')] + cdx_files)
+    with job.make_runner() as runner:
+        runner.run()
+        output = {tuple(key): value for key, value
+                  in job.parse_output(runner.cat_output())}
+    urls = [set(), set()]
+    for n, lines in enumerate(CDX_LINES):
+        for line in lines:
+            if '"status": "200"' in line and '/warc/' in line:
+                urls[n].add(line.split('"url": "')[1].split('"')[0])
+    crawl = MonthlyCrawl.get_by_name(CDX_CRAWL)
+    assert(output[(CST.new_items.value, CST.url.value, crawl)]
+           == len(urls[1] - urls[0]))
+    assert(output[(CST.new_items_for.value, CST.tld.value, 'co.uk',
+                   CST.url.value, crawl)] == 1)
+    assert((CST.new_items_for.value, CST.tld.value, 'com',
+            CST.url.value, crawl) not in output)
+    assert(output[(CST.new_items_for.value, CST.surt_domain.value,
+                   'org,test', CST.url.value, crawl)] == 1)
@@ -0,0 +1,123 @@
+import copy
+import json
+
+import jsonpickle
+import numpy
+import ujson
+
+from crawlhll import NumpyHyperLogLog, bit_length, hll_hash
+from crawlhll import pack_registers, unpack_registers
+from crawlhll import cardinalities, union_cardinalities
+from crawlhll import SlidingWindowUnion
+from crawlstats import CrawlStatsJSONDecoder, CrawlStatsJSONEncoder
+from hyperloglog import HyperLogLog
+
+
+def test_bit_length():
+    values = [0, 1, 2, 3, 255, 256, 2**32-1, 2**32, 2**50-1, 2**63, 2**64-1]
+    assert(bit_length(numpy.array(values, dtype=numpy.uint64)).tolist()
+           == [v.bit_length() for v in values])
+
+
+def test_numpy_hyperloglog():
+    for n in (10, 1000, 100000):
+        hll = HyperLogLog(.01)
+        nhll = NumpyHyperLogLog(.01)
+        nhll2 = NumpyHyperLogLog(.01)
+        nhll3 = NumpyHyperLogLog(.01)
+        values = ['http://example.com/{}'.format(i) for i in range(n)]
+        for value in values:
+            hll.add(value)
+            nhll.add(value)
+        nhll2.add_many(values)
+        nhll3.add_hashes([hll_hash(value) for value in values])
+        assert(nhll.M.tolist() == hll.M)
+        assert(nhll2 == nhll)
+        assert(nhll3 == nhll)
+        assert(abs(nhll.card() - hll.card()) < 1e-6 * n)
+        assert(len(nhll) == len(hll))
+
+
+def test_numpy_hyperloglog_update():
+    hll1, hll2 = HyperLogLog(.01), HyperLogLog(.01)
+    nhll1, nhll2 = NumpyHyperLogLog(.01), NumpyHyperLogLog(.01)
+    for i in range(2000):
+        hll1.add(str(i))
+        nhll1.add(str(i))
+        hll2.add(str(i + 1000))
+        nhll2.add(str(i + 1000))
+    union = copy.deepcopy(nhll1)
+    union.update(nhll2)
+    hll1.update(hll2)
+    assert(union.M.tolist() == hll1.M)
+    # registers of nhll1 unchanged
+    assert(nhll1 != union)
+    # merge with a list-based HyperLogLog
+    nhll1.update(hll2)
+    assert(nhll1 == union)
+
+
+def test_numpy_hyperloglog_serialization():
+    nhll = NumpyHyperLogLog(.01)
+    nhll.add_many(str(i) for i in range(5000))
+    jsons = json.dumps(nhll, cls=CrawlStatsJSONEncoder)
+    nhll2 = json.loads(jsons, cls=CrawlStatsJSONDecoder)
+    assert(isinstance(nhll2, NumpyHyperLogLog))
+    assert(nhll2 == nhll)
+    assert(nhll2.card() == nhll.card())
+    nhll3 = jsonpickle.decode(jsonpickle.encode(nhll))
+    assert(nhll3 == nhll)
+
+
+def test_packed_registers():
+    M = numpy.arange(64, dtype=numpy.uint8).repeat(4)
+    numpy.random.default_rng(42).shuffle(M)
+    packed = pack_registers(M)
+    assert(len(packed) == len(M) * 6 // 8)
+    assert(unpack_registers(packed).tolist() == M.tolist())
+
+
+def test_hyperloglog_encodings():
+    nhll = NumpyHyperLogLog(.01)
+    nhll.add_many(str(i) for i in range(5000))
+    for encoding in ('list', 'packed', 'packed-zlib'):
+        dic = CrawlStatsJSONEncoder.json_encode_hyperloglog(nhll, encoding)
+        line = ujson.dumps(dic)
+        # decoded by mrjob's protocol or in CrawlPlot.read_data
+        nhll2 = CrawlStatsJSONDecoder.json_decode_hyperloglog(
+            json.loads(line))
+        assert(nhll2 == nhll)
+        assert(nhll2.alpha == nhll.alpha)
+        assert(nhll2.card() == dic['card'])
+        nhll3 = json.loads(line, cls=CrawlStatsJSONDecoder)
+        assert(nhll3 == nhll)
+
+
+def test_cardinalities():
+    hlls = []
+    for n in (0, 10, 1000, 20000, 200000):
+        hll = NumpyHyperLogLog(.01)
+        hll.add_many('{}-{}'.format(n, i) for i in range(n))
+        hlls.append(hll)
+    registers = numpy.stack([hll.M for hll in hlls])
+    cards = cardinalities(registers)
+    for hll, card in zip(hlls, cards):
+        assert(abs(hll.card() - card) < 1e-6 * (1 + card))
+    unions = union_cardinalities(registers[2], registers[3:])
+    for hll, card in zip(hlls[3:], unions):
+        union = copy.deepcopy(hlls[2])
+        union.update(hll)
+        assert(abs(union.card() - card) < 1e-6 * card)
+
+
+def test_sliding_window_union():
+    rng = numpy.random.default_rng(7)
+    registers = rng.integers(0, 40, (20, 16), dtype=numpy.uint8)
+    window = SlidingWindowUnion(3, 16)
+    for i in range(20):
+        if i == 10:
+            window = SlidingWindowUnion.from_state(3, window.get_state())
+        window.push(registers[i])
+        assert(len(window) == min(i + 1, 3))
+        assert(window.union().tolist()
+               == registers[max(0, i - 2):i + 1].max(axis=0).tolist())
@@ -0,0 +1,91 @@
+import numpy
+
+from array import array
+
+from crawlhll import hll_hash
+from crawlindex import FingerprintIndex, SortedStream
+from crawlindex import decode_block, encode_block, merge_unique
+from crawlindex import sorted_unique
+from crawlindex import BLOCK_HEADER
+from crawlstats import CST
+
+from conftest import CDX_LINES
+
+
+def test_encode_block():
+    rng = numpy.random.default_rng(42)
+    for n in (1, 2, 100, 4096):
+        values = numpy.unique(rng.integers(0, 2**64, size=n,
+                                           dtype=numpy.uint64))
+        data = encode_block(values)
+        header = BLOCK_HEADER.unpack(data[:BLOCK_HEADER.size])
+        assert(numpy.array_equal(
+            decode_block(header, data[BLOCK_HEADER.size:]), values))
+    # block of a dense sequence (many fingerprints per file): small deltas
+    values = numpy.unique(rng.integers(2**60, 2**60 + 2**44, size=4096,
+                                       dtype=numpy.uint64))
+    data = encode_block(values)
+    assert(len(data) < 5 * len(values))
+
+
+def test_merge_unique():
+    rng = numpy.random.default_rng(7)
+    runs = [numpy.unique(rng.integers(0, 10000, size=500,
+                                      dtype=numpy.uint64))
+            for _ in range(5)]
+    streams = [SortedStream(numpy.array_split(run, 7)) for run in runs]
+    merged = numpy.concatenate(list(merge_unique(streams)))
+    assert(numpy.array_equal(merged, numpy.unique(numpy.concatenate(runs))))
+
+
+def test_sorted_unique():
+    rng = numpy.random.default_rng(3)
+    for n in (0, 1, 1000):
+        values = rng.integers(2**63, 2**64, size=n, dtype=numpy.uint64)
+        values = numpy.concatenate((values, values[:n//2]))
+        unique = sorted_unique(array('Q', values.tolist()))
+        assert(unique.dtype == numpy.uint64)
+        assert(numpy.array_equal(unique, numpy.unique(values)))
+
+
+def url_fingerprints():
+    """Fingerprints of successfully fetched URLs per cdx file"""
+    urls = [set(), set()]
+    for n, lines in enumerate(CDX_LINES):
+        for line in lines:
+            if '"status": "200"' in line and '/warc/' in line:
+                urls[n].add(hll_hash(line.split('"url": "')[1].split('"')[0]))
+    return urls
+
+
+def test_fingerprint_index(cdx_files, tmp_path):
+    index = FingerprintIndex(str(tmp_path / 'index'))
+    # the two cdx files as two crawls
+    counts = index.add_crawl('CC-MAIN-2016-22', cdx_files[:1], processes=1)
+    index.add_crawl('CC-MAIN-2016-26', cdx_files, processes=1)
+    assert(index.crawls() == ['CC-MAIN-2016-22', 'CC-MAIN-2016-26'])
+    urls = url_fingerprints()
+    assert(counts['url'] == len(urls[0]))
+    assert(index.new_items('CC-MAIN-2016-22', CST.url) == len(urls[0]))
+    assert(index.new_items('CC-MAIN-2016-26', CST.url)
+           == len(urls[1] - urls[0]))
+    assert(index.overlap('CC-MAIN-2016-26', 'CC-MAIN-2016-22', CST.url)
+           == len(urls[0]))
+    assert(index.new_items('CC-MAIN-2016-26', CST.digest) == 1)
+
+
+
+def test_fingerprint_index_crawl_order(cdx_files, tmp_path):
+    # crawl IDs are not chronological: CC-MAIN-2013-48 is 92,
+    # CC-MAIN-2016-26 is 14 and CC-MAIN-2024-26 is 100
+    index = FingerprintIndex(str(tmp_path / 'index'))
+    index.add_crawl('CC-MAIN-2024-26', cdx_files, processes=1)
+    index.add_crawl('CC-MAIN-2016-26', cdx_files, processes=1)
+    index.add_crawl('CC-MAIN-2013-48', cdx_files[:1], processes=1)
+    assert(index.crawls()
+           == ['CC-MAIN-2013-48', 'CC-MAIN-2016-26', 'CC-MAIN-2024-26'])
+    urls = url_fingerprints()
+    assert(index.new_items('CC-MAIN-2013-48', CST.url) == len(urls[0]))
+    assert(index.new_items('CC-MAIN-2016-26', CST.url)
+           == len(urls[1] - urls[0]))
+    assert(index.new_items('CC-MAIN-2024-26', CST.url) == 0)
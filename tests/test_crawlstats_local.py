@@ -0,0 +1,396 @@
+import bz2
+import glob
+import gzip
+import json
+import os
+
+from collections import defaultdict
+
+from mrjob.protocol import JSONProtocol
+
+from conftest import CDX_CRAWL, CDX_LINES
+from crawlstats import CCStatsJob, CdxChunk, CST, MultiCount, PhaseCounters
+from crawlstats import CompactKeyProtocol
+from crawlstats_local import LocalCountRunner, partition_of
+
+
+def run_inline(args, inputs):
+    job = CCStatsJob(['-r', 'inline', '--no-conf', '--job=count']
+                     + args + inputs)
+    with job.make_runner() as runner:
+        runner.run()
+        return sorted(b''.join(runner.cat_output()).splitlines(True))
+
+
+def run_stats_inline(args, count_dir):
+    job = CCStatsJob(['-r', 'inline', '--no-conf', '--job=stats']
+                     + args + [count_dir])
+    with job.make_runner() as runner:
+        runner.run()
+        return sorted(b''.join(runner.cat_output()).splitlines(True))
+
+
+def read_part_files(output_dir):
+    lines = []
+    for part in sorted(glob.glob(os.path.join(output_dir, 'part-*.bz2'))):
+        with bz2.open(part, 'rb') as f:
+            lines.extend(f)
+    return sorted(lines)
+
+
+def test_partition_of():
+    assert(partition_of(b'[7,"text\\/html",14]', 10)
+           == partition_of(b'[7,"text\\/html",14]', 10))
+    assert(0 <= partition_of(b'[2,"example.com",14]', 3) < 3)
+
+
+def test_local_count_runner(cdx_files, tmp_path):
+    output_dir = str(tmp_path / 'count')
+    runner = LocalCountRunner(['--no-exact-counts'], output_dir,
+                              processes=2, reducers=3,
+                              tmp_dir=str(tmp_path))
+    counters = runner.run(cdx_files)
+    assert(counters[('cdx-stats', 'cdx files finished')] == 2)
+    assert(counters[('cdx-stats', 'cdx lines read')] == 12)
+    assert(len(glob.glob(os.path.join(output_dir, 'part-*.bz2'))) == 3)
+    assert(read_part_files(output_dir)
+           == run_inline(['--no-exact-counts'], cdx_files))
+
+
+def test_local_count_runner_spill(cdx_files, tmp_path):
+    # spill a sorted run after every record, use a single reducer
+    # because counters in reducer_final are partial per reducer
+    output_dir = str(tmp_path / 'count')
+    runner = LocalCountRunner(['--exact-counts'], output_dir,
+                              processes=2, reducers=1,
+                              tmp_dir=str(tmp_path), map_buffer_size=1)
+    runner.run(cdx_files)
+    assert(read_part_files(output_dir)
+           == run_inline(['--exact-counts'], cdx_files))
+
+
+def test_local_count_runner_combiner(cdx_files, tmp_path):
+    # in-mapper combiner must not change the output
+    output_dir = str(tmp_path / 'count')
+    runner = LocalCountRunner([], output_dir,
+                              processes=2, reducers=1,
+                              tmp_dir=str(tmp_path))
+    counters = runner.run(cdx_files)
+    assert(counters[('cdx-stats', 'combiner records in')]
+           > counters[('cdx-stats', 'combiner records out')])
+    assert(read_part_files(output_dir)
+           == run_inline(['--mapper-combine-max-keys=0'], cdx_files))
+
+
+def write_cdx_blocks(path, lines, lines_per_block, cluster_idx):
+    """Write a cdx file of multiple gzip members and add the blocks
+    to the cluster.idx lines"""
+    offset = 0
+    with open(path, 'wb') as cdx:
+        for i in range(0, len(lines), lines_per_block):
+            block = gzip.compress(
+                ''.join(lines[i:i+lines_per_block]).encode('utf-8'))
+            cdx.write(block)
+            cluster_idx.append('{}\t{}\t{}\t{}\t{}\n'.format(
+                lines[i].split(' ')[0], os.path.basename(path), offset,
+                len(block), len(cluster_idx)))
+            offset += len(block)
+
+
+def test_cdx_chunks(cdx_files, tmp_path):
+    cluster_idx = []
+    for n, lines in enumerate(CDX_LINES):
+        write_cdx_blocks(str(tmp_path / 'cdx-{:05d}.gz'.format(n)), lines,
+                         2, cluster_idx)
+    for blocks_per_chunk in (1, 2, 10):
+        chunk_list = tmp_path / 'chunks-{}.txt'.format(blocks_per_chunk)
+        chunk_list.write_text(''.join(
+            chunk.to_line() + '\n' for chunk in CdxChunk.from_cluster_idx(
+                cluster_idx, str(tmp_path), blocks_per_chunk)))
+        for args in (['--exact-counts'], ['--no-exact-counts'],
+                     ['--no-exact-counts', '--cdx-perf']):
+            assert(run_inline(args + ['--cdx-chunks', '--crawl', CDX_CRAWL],
+                              [str(chunk_list)])
+                   == run_inline(args, cdx_files))
+    # one --cdx-perf report per chunk
+    report_dir = str(tmp_path / 'perf')
+    run_inline(['--no-exact-counts', '--cdx-chunks', '--crawl', CDX_CRAWL,
+                '--cdx-perf', '--cdx-perf-report-dir=' + report_dir],
+               [str(tmp_path / 'chunks-1.txt')])
+    chunks = list(CdxChunk.from_cluster_idx(cluster_idx, str(tmp_path), 1))
+    assert(len(os.listdir(report_dir)) == len(chunks))
+    cdx_lines = 0
+    for chunk in chunks:
+        report_path = os.path.join(report_dir, '{}.{}-{}.perf.json'.format(
+            os.path.basename(chunk.path), chunk.offset, chunk.end))
+        with open(report_path) as f:
+            report = json.load(f)
+        assert(report['input'] == chunk.path)
+        assert(report['byte_range'] == [chunk.offset, chunk.end])
+        cdx_lines += report['cdx_lines']
+    assert(cdx_lines == sum(map(len, CDX_LINES)))
+
+
+def reduce_shards(reducer_init, reducer, reducer_final, pairs, shards):
+    """Simulate a reduce phase with multiple reducers, keys and values
+    passed as JSON like between job steps"""
+    partitions = [defaultdict(list) for _ in range(shards)]
+    for key, value in pairs:
+        key = json.dumps(key)
+        partitions[hash(key) % shards][key].append(json.loads(
+            json.dumps(value)))
+    output = []
+    for partition in partitions:
+        reducer_init()
+        for key in sorted(partition):
+            output.extend(reducer(json.loads(key), partition[key]))
+        output.extend(reducer_final())
+    return output
+
+
+def test_stats_reducers():
+    pairs = []
+    for i in range(100):
+        host = 'www{}.example{}.com'.format(i, i % 20)
+        pairs.append(([2, host, 14], [i % 7 + 1, i]))
+    for j in range(20):
+        domain = 'example{}.com'.format(j)
+        pairs.append(([3, domain, 14], [j % 3 + 1, j, 5]))
+    for args in (['--max-top-hosts-domains=5'],
+                 ['--max-top-hosts-domains=5',
+                  '--min-urls-top-host-domain=50']):
+        job = CCStatsJob(['--job=stats'] + args)
+        job.stats_mapper_init()
+        mapped = [kv for key, value in pairs
+                  for kv in job.stats_mapper(key, value)]
+        mapped.extend(job.stats_mapper_final())
+        expected = reduce_shards(job.reducer_init, job.stats_reducer,
+                                 job.reducer_final, mapped, 1)
+        assert(sum(key[0] == 'host' for key, _ in expected) == 5)
+        sharded = reduce_shards(job.reducer_init, job.stats_reducer,
+                                job.stats_shard_reducer_final, mapped, 3)
+        merged = reduce_shards(job.reducer_init, job.stats_merge_reducer,
+                               job.reducer_final, sharded, 1)
+        assert(sorted(map(json.dumps, merged))
+               == sorted(map(json.dumps, expected)))
+
+
+def test_top_estimate(cdx_files, tmp_path):
+    count_dir = tmp_path / 'count'
+    count_dir.mkdir()
+    count_output = run_inline(['--no-exact-counts', '--top-estimate-size=4'],
+                              cdx_files)
+    (count_dir / 'part-00000').write_bytes(b''.join(count_output))
+    hosts = {}
+    top_estimates = {}
+    for line in count_output:
+        key, value = map(json.loads, line.split(b'\t'))
+        if key[0] == CST.host.value:
+            hosts[key[1]] = MultiCount.get_count(0, value)
+        elif key[0] == CST.top_estimate.value:
+            top_estimates[key[1]] = value
+    assert(sorted(top_estimates) == [CST.host.value, CST.domain.value,
+                                     CST.surt_domain.value])
+    _capacity, _floor, top_hosts = top_estimates[CST.host.value]
+    assert(top_hosts[0] == ['example.com', 3, 0])
+    for host, pages, error in top_hosts:
+        assert(pages - error <= hosts[host] <= pages)
+    expected = run_stats_inline(['--min-urls-top-host-domain=2'],
+                                str(count_dir))
+    output = run_stats_inline(['--top-hosts-domains-from-estimate',
+                               '--max-top-hosts-domains=1'], str(count_dir))
+    assert(b'["top_estimate","host","CC-MAIN-2016-26"]\t[["example.com",3,0]]\n'
+           in output)
+    assert([line for line in output if b'["host"' in line] == [])
+    assert([line for line in output if not line.startswith(b'["top_')]
+           == [line for line in expected if not line.startswith(b'["top_')
+               and not line.startswith(b'["host"')
+               and not line.startswith(b'["domain"')
+               and not line.startswith(b'["surt_domain"')])
+
+
+def test_json_protocol(cdx_files):
+    for args in (['--exact-counts'], ['--no-exact-counts']):
+        assert(run_inline(args + ['--json-protocol=orjson'], cdx_files)
+               == run_inline(args, cdx_files))
+
+
+def test_compact_keys(cdx_files, tmp_path):
+    for args in (['--exact-counts'], ['--no-exact-counts']):
+        output = run_inline(args + ['--compact-keys'], cdx_files)
+        assert(not any(line.startswith(b'[') for line in output))
+        expected = run_inline(args, cdx_files)
+        protocol = CompactKeyProtocol()
+        assert(sorted(JSONProtocol().write(*protocol.read(line.rstrip()))
+                      for line in output)
+               == [line.rstrip() for line in expected])
+    for name, lines in (('json', expected), ('compact', output)):
+        count_dir = tmp_path / name
+        count_dir.mkdir()
+        (count_dir / 'part-00000').write_bytes(b''.join(lines))
+    assert(run_stats_inline([], str(tmp_path / 'compact'))
+           == run_stats_inline([], str(tmp_path / 'json')))
+
+
+def test_count_output_codec(cdx_files, tmp_path):
+    assert(CCStatsJob.output_codec_jobconf('none')
+           == {'mapreduce.output.fileoutputformat.compress': 'false'})
+    output_dir = str(tmp_path / 'count')
+    runner = LocalCountRunner(['--count-output-codec=gzip'], output_dir,
+                              processes=2, reducers=2,
+                              tmp_dir=str(tmp_path))
+    runner.run(cdx_files)
+    parts = sorted(glob.glob(os.path.join(output_dir, 'part-*')))
+    assert(len(parts) == 2 and all(p.endswith('.gz') for p in parts))
+    lines = []
+    for part in parts:
+        with gzip.open(part, 'rb') as f:
+            lines.extend(f)
+    assert(sorted(lines) == run_inline([], cdx_files))
+
+
+def test_stats_zstd_input(cdx_files, tmp_path):
+    # mrjob's inline runner does not decompress .zst input
+    for codec in ('bzip2', 'zstd'):
+        runner = LocalCountRunner(['--count-output-codec=' + codec],
+                                  str(tmp_path / codec), processes=2,
+                                  reducers=2, tmp_dir=str(tmp_path))
+        runner.run(cdx_files)
+    assert(len(glob.glob(str(tmp_path / 'zstd' / 'part-*.zst'))) == 2)
+    stats = run_stats_inline([], str(tmp_path / 'zstd'))
+    assert(stats and stats == run_stats_inline([], str(tmp_path / 'bzip2')))
+
+
+def test_cdx_perf(cdx_files, tmp_path):
+    # instrumentation must not change the output
+    output_dir = str(tmp_path / 'count')
+    report_dir = str(tmp_path / 'perf')
+    runner = LocalCountRunner(['--cdx-perf', '--cdx-perf-sample=2',
+                               '--cdx-perf-report-dir=' + report_dir],
+                              output_dir, processes=2, reducers=2,
+                              tmp_dir=str(tmp_path))
+    counters = runner.run(cdx_files)
+    assert(read_part_files(output_dir) == run_inline([], cdx_files))
+    # SURT domains: 3 in first, 3 in second file, every second sampled
+    assert(counters[('cdx-perf', 'sampled surt domains')] == 4)
+    for phase in ('read', 'split', 'json', 'add', 'output', 'url-parse',
+                  'tld', 'hll'):
+        assert(counters[('cdx-perf', phase + ' calls')] > 0)
+    for path in cdx_files:
+        report_path = os.path.join(
+            report_dir, os.path.basename(path) + '.perf.json')
+        with open(report_path) as f:
+            report = json.load(f)
+        assert(report['input'] == path)
+        assert(report['sample'] == 2)
+        assert(report['units'] == 3)
+        assert(report['sampled_units'] == 2)
+        assert(report['phases']['json']['calls'] <= report['cdx_lines'])
+        # inner phases are excluded from the time of outer phases
+        for phase in report['phases'].values():
+            assert(phase['time'] <= phase['total_time'])
+        phases = report['phases']
+        assert(phases['output']['total_time'] >= phases['output']['time']
+               + phases['tld']['total_time'])
+
+
+def test_phase_counters_nested():
+    perf = PhaseCounters()
+    perf.next_unit()
+    inner = perf.timed_function('inner', lambda n: sum(range(n)))
+    items = list(perf.timed('outer', (inner(100000) for _ in range(3))))
+    assert(items == [sum(range(100000))] * 3)
+    assert(perf.calls['outer'] == 3 and perf.calls['inner'] == 3)
+    assert(perf.total_time['outer']
+           >= perf.time['outer'] + perf.total_time['inner'])
+    assert(perf.time['inner'] == perf.total_time['inner'])
+    assert(not perf.nested)
+
+
+def write_parquet_index(cdx_lines, path):
+    """Convert cdx lines into a Parquet file of the columnar index"""
+    import pyarrow
+    import pyarrow.parquet
+    from urllib.parse import urlparse
+    from public_suffix import PublicSuffixResolver
+    fields = {'url_surtkey': [], 'url': [], 'fetch_status': [],
+              'content_mime_type': [], 'content_mime_detected': [],
+              'content_charset': [], 'content_languages': [],
+              'content_digest': [], 'warc_filename': [],
+              'url_protocol': [], 'url_host_name': [],
+              'url_host_registered_domain': [],
+              'url_host_registered_suffix': [], 'url_host_tld': []}
+    for line in cdx_lines:
+        surt_url, _, metadata = line.split(' ', 2)
+        metadata = json.loads(metadata)
+        uri = urlparse(metadata['url'])
+        domain, suffix, is_ip = PublicSuffixResolver.default().resolve(
+            uri.hostname)
+        row = {'url_surtkey': surt_url, 'url': metadata['url'],
+               'fetch_status': int(metadata['status']),
+               'content_mime_type': metadata.get('mime'),
+               'content_mime_detected': metadata.get('mime-detected'),
+               'content_charset': metadata.get('charset'),
+               'content_languages': metadata.get('languages'),
+               'content_digest': metadata.get('digest'),
+               'warc_filename': metadata['filename'],
+               'url_protocol': uri.scheme, 'url_host_name': uri.hostname,
+               'url_host_registered_domain': None if is_ip else domain,
+               'url_host_registered_suffix': None if is_ip else suffix,
+               'url_host_tld': uri.hostname.split('.')[-1]}
+        for name, value in row.items():
+            fields[name].append(value)
+    pyarrow.parquet.write_table(pyarrow.table(fields), path,
+                                row_group_size=3)
+
+
+def test_parquet_input(cdx_files, tmp_path):
+    parquet_files = []
+    for n, lines in enumerate(CDX_LINES):
+        path = str(tmp_path / 'crawl={}-part-{:05d}.parquet'.format(
+            CDX_CRAWL, n))
+        write_parquet_index(lines, path)
+        parquet_files.append(path)
+    file_list = tmp_path / 'parquet-files.txt'
+    file_list.write_text(''.join(path + '\n' for path in parquet_files))
+    for args in (['--no-exact-counts'], ['--exact-counts'],
+                 ['--no-exact-counts', '--surt-domain-counter=compact']):
+        assert(run_inline(args + ['--parquet-input'], [str(file_list)])
+               == run_inline(args, cdx_files))
+    output_dir = str(tmp_path / 'count')
+    runner = LocalCountRunner(['--parquet-input'], output_dir,
+                              processes=2, reducers=2,
+                              tmp_dir=str(tmp_path))
+    runner.run(parquet_files)
+    assert(read_part_files(output_dir) == run_inline([], cdx_files))
+
+
+def test_count_checkpoint(cdx_files, tmp_path):
+    checkpoint_dir = str(tmp_path / 'checkpoint')
+    args = ['--no-exact-counts', '--checkpoint-dir', checkpoint_dir]
+    expected = run_inline(['--no-exact-counts'], cdx_files)
+    for run in range(2):
+        output_dir = str(tmp_path / 'count-{}'.format(run))
+        runner = LocalCountRunner(args, output_dir, processes=2,
+                                  reducers=3, tmp_dir=str(tmp_path))
+        counters = runner.run(cdx_files)
+        # the rerun takes the partial results as input
+        assert(counters[('cdx-stats', 'cdx files restored from checkpoint')]
+               == 2 * run)
+        assert(counters[('cdx-stats', 'cdx files finished')] == 2)
+        assert(counters[('cdx-stats', 'cdx lines read')] == 12)
+        assert(read_part_files(output_dir) == expected)
+        assert(len(glob.glob(os.path.join(checkpoint_dir, '*.partial.gz')))
+               == 2)
+    job = CCStatsJob(['--job=count'] + args)
+    inputs = job.checkpointed_inputs(cdx_files)
+    assert(all(path.startswith(checkpoint_dir) for path in inputs))
+    assert(run_inline(args, inputs) == expected)
+    # a modified cdx file is processed again
+    os.utime(cdx_files[0], ns=(0, 0))
+    inputs = job.checkpointed_inputs(cdx_files)
+    assert(inputs[0] == cdx_files[0])
+    assert(run_inline(args, inputs) == expected)
+    assert(len(glob.glob(os.path.join(checkpoint_dir, '*.partial.gz')))
+           == 3)
+    assert(job.checkpointed_inputs(cdx_files)[0] != cdx_files[0])
@@ -0,0 +1,76 @@
+import gzip
+import json
+import os
+
+import pyarrow.parquet
+
+from crawlstore import StatsStore
+
+
+def stats_lines(crawl, pages):
+    hll = {'__type__': 'HyperLogLog', 'card': 1.0, 'p': 4,
+           'M': [0] * 16, 'm': 16, 'alpha': .673}
+    return ['{}\t{}\n'.format(json.dumps(key), json.dumps(val))
+            for key, val in [
+                (['charset', 'UTF-8', crawl], [pages, pages // 2]),
+                (['domain', 'example.com', crawl], [pages, pages // 2, 3]),
+                (['size', 'page', crawl], pages),
+                (['size_estimate', 'url', crawl], hll)]]
+
+
+def write_stats(path, crawl, pages):
+    with gzip.open(os.path.join(path, crawl + '.gz'), 'wt') as f:
+        f.writelines(stats_lines(crawl, pages))
+    return os.path.join(path, crawl + '.gz')
+
+
+def test_stats_store(tmp_path):
+    crawls = ['CC-MAIN-2016-26', 'CC-MAIN-2016-30']
+    files = [write_stats(tmp_path, crawl, 100 * (i + 1))
+             for i, crawl in enumerate(crawls)]
+    store = StatsStore(os.path.join(tmp_path, 'store'))
+    store.ingest(files[0:1])
+    store.ingest(files)
+    assert(store.types() == ['charset', 'domain', 'size', 'size_estimate'])
+    assert(store.crawls('size') == crawls)
+    assert(list(store.lines())
+           == stats_lines(crawls[0], 100) + stats_lines(crawls[1], 200))
+    assert(list(store.lines(['size'], crawls[1:]))
+           == stats_lines(crawls[1], 200)[2:3])
+    table = store.read_table(['charset', 'domain', 'size'], crawls[1:])
+    assert(table.column('item').to_pylist()
+           == ['UTF-8', 'example.com', 'page'])
+    assert(table.column('count').to_pylist() == [200, 200, 200])
+    assert(table.column('url_count').to_pylist() == [100, 100, None])
+    assert(table.column('host_count').to_pylist() == [None, 3, None])
+    # modified stats file is ingested again
+    write_stats(tmp_path, crawls[1], 300)
+    os.utime(files[1], (0, 0))
+    store.ingest(files)
+    assert(store.read_table(['size']).column('count').to_pylist()
+           == [100, 300])
+
+
+def test_stats_store_records(tmp_path):
+    crawl = 'CC-MAIN-2016-26'
+    extra = [(['histogram', 'host', crawl, 'page', 1], 7),
+             (['http_status', 200, crawl], [5, 4]),
+             (['tld', 'com', crawl], [9, 8, 2, 1])]
+    path = write_stats(tmp_path, crawl, 100)
+    with gzip.open(path, 'at') as f:
+        f.writelines('{}\t{}\n'.format(json.dumps(key), json.dumps(val))
+                     for key, val in extra)
+    store = StatsStore(os.path.join(tmp_path, 'store'))
+    store.ingest([path])
+    assert(store.read_table(['charset', 'http_status', 'tld']).column(
+        'typed').to_pylist() == [True, False, False])
+    # typed records are built from typed columns, equal to the JSON
+    expected = [(json.loads(key), json.loads(val)) for key, val in (
+        line.rstrip('\n').split('\t') for line in store.lines())]
+    assert(list(store.records()) == expected)
+    assert(list(store.records(['size'])) == [(['size', 'page', crawl], 100)])
+    # store written before the typed column was added
+    partition = store.partition_path('charset', crawl)
+    table = pyarrow.parquet.read_table(partition)
+    pyarrow.parquet.write_table(table.drop_columns(['typed']), partition)
+    assert(list(store.records()) == expected)
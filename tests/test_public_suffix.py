@@ -0,0 +1,31 @@
+import tldextract
+
+from public_suffix import PublicSuffixResolver
+
+
+HOSTS = ['www.example.co.uk', 'co.uk', 'localhost', '192.168.0.1',
+         '999.1.1.1', '2001:db8::1', '', 'a..com', 'www.city.kawasaki.jp',
+         'city.kawasaki.jp', 'foo.bar.ck', 'www.ck', 'www.xn--fiqs8s',
+         'test.xn--p1ai', 'a.b.c.blogspot.com', 'x.y.invalidtld', '1.2.3']
+
+
+def test_resolve():
+    resolver = PublicSuffixResolver()
+    assert(resolver.resolve('www.example.co.uk')
+           == ('example.co.uk', 'co.uk', False))
+    assert(resolver.resolve('co.uk') == ('.co.uk', 'co.uk', False))
+    assert(resolver.resolve('localhost') == ('localhost', '', False))
+    assert(resolver.resolve('192.168.0.1') == ('192.168.0.1', '', True))
+    assert(resolver.resolve('[::1]') == ('[::1]', '', True))
+
+
+def test_same_as_tldextract():
+    resolver = PublicSuffixResolver(cache_size=4)
+    for host in HOSTS + HOSTS:
+        domain, suffix, _is_ip = resolver.resolve(host)
+        parsed = tldextract.extract(host)
+        assert(suffix == parsed.suffix)
+        if suffix:
+            assert(domain == parsed.domain + '.' + parsed.suffix)
+        else:
+            assert(domain == parsed.domain)